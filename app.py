@@ -1,8 +1,10 @@
 from src.routes_init import init_routes
+from src.commands import register_commands
 from flask import Flask
 
 app = Flask(__name__)
 init_routes(app)
+register_commands(app)
 
 if __name__ == "__main__":
     app.run(debug=True)
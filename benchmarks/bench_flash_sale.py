@@ -0,0 +1,75 @@
+"""Flash sale: thousands of concurrent orders against one low-stock product.
+
+Checks that stock never goes negative and exactly `stock` orders succeed, and reports throughput.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_flash_sale --orders 5000 --stock 100
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, percentile, reset_tables
+from src import crud, models
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    # Пул на всё число потоков, чтобы очередь была на блокировке строки в Postgres, а не в пуле
+    engine = make_engine(args.database_url, pool_size=args.concurrency)
+    reset_tables(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    with Session() as db:
+        product = models.Product(name="Flash sale item", price=19.99, category="Sale", stock=args.stock)
+        user = models.User(name="bench", email="bench@example.com")
+        db.add_all([product, user])
+        db.commit()
+
+    order = {"user_id": user.id, "items": [{"product_id": product.id, "quantity": 1}]}
+    start = threading.Barrier(args.concurrency)
+    latencies, outcomes = [], {"created": 0, "sold_out": 0}
+    lock = threading.Lock()
+
+    def worker(count):
+        start.wait()  # все потоки стартуют одновременно
+        local = []
+        for _ in range(count):
+            with Session() as db:
+                started = time.perf_counter()
+                try:
+                    crud.create_order(db, order)
+                    outcome = "created"
+                except crud.InsufficientStock:
+                    outcome = "sold_out"
+                local.append((time.perf_counter() - started) * 1000)
+            with lock:
+                outcomes[outcome] += 1
+        with lock:
+            latencies.extend(local)
+
+    per_worker = [args.orders // args.concurrency + (i < args.orders % args.concurrency) for i in range(args.concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(worker, per_worker))
+    elapsed = time.perf_counter() - started
+
+    with Session() as db:
+        stock = db.get(models.Product, product.id).stock
+        created = db.query(models.Order).count()
+    print(f"orders={args.orders} concurrency={args.concurrency} stock={args.stock}")
+    print(f"created={outcomes['created']} sold_out={outcomes['sold_out']} orders_in_db={created} stock_left={stock}")
+    print(f"orders/sec={round(args.orders / elapsed)} p50_ms={percentile(latencies, 50):.2f} "
+          f"p99_ms={percentile(latencies, 99):.2f}")
+    assert created == outcomes["created"] == args.stock and stock == 0, "oversell or lost reservation"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Fulfillment queue throughput versus number of worker processes.
+
+Each worker is a separate process running fulfillment.run_worker until the queue is empty;
+the handler sleeps --work-ms per order to stand in for calls to a carrier/warehouse API.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_fulfillment --orders 20000 --workers 1 2 4 8
+"""
+import argparse
+import multiprocessing
+import time
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, reset_tables, seed_products
+from src import crud, fulfillment, models
+
+
+def seed_orders(engine, count: int):
+    reset_tables(engine)
+    seed_products(engine, 100)
+    with engine.begin() as conn:
+        user_id = conn.execute(text("INSERT INTO users (name, email) VALUES ('bench', 'bench@example.com') RETURNING id")).scalar()
+    with sessionmaker(bind=engine)() as db:
+        for start in range(0, count, 1000):
+            crud.create_orders(db, [
+                {"user_id": user_id, "items": [{"product_id": i % 100 + 1, "quantity": 1}]}
+                for i in range(start, min(count, start + 1000))
+            ])
+
+
+def worker(database_url, batch_size, work_ms, results):
+    engine = make_engine(database_url, pool_size=1)
+
+    def handler(db, orders):
+        time.sleep(work_ms / 1000 * len(orders))
+
+    results.put(fulfillment.run_worker(sessionmaker(bind=engine), handler, batch_size, once=True))
+    engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--orders", type=int, default=20_000)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--work-ms", type=float, default=0.5, help="simulated work per order")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    for workers in args.workers:
+        seed_orders(engine, args.orders)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(args.database_url, args.batch_size, args.work_ms, results))
+            for _ in range(workers)
+        ]
+        started = time.perf_counter()
+        for process in processes:
+            process.start()
+        processed = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - started
+        with engine.connect() as conn:
+            done = conn.execute(text("SELECT count(*) FROM orders WHERE status = 'done'")).scalar()
+        # Каждый заказ должен быть обработан ровно одним воркером
+        assert sum(processed) == done == args.orders, (processed, done)
+        print(f"workers={workers:<2} orders/sec={round(args.orders / elapsed):>6}  per worker={processed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Bulk product import (COPY + upsert) versus one create_product call per row.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_import --rows 200000
+"""
+import argparse
+import io
+import json
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, reset_tables
+from src import crud, product_import
+
+
+def make_rows(count: int, prefix: str):
+    return [
+        {"sku": f"{prefix}-{i}", "name": f"Imported product {i}", "description": "Bulk loaded",
+         "price": round(1 + i % 1000 * 0.5, 2), "category": f"Category {i % 20}"}
+        for i in range(count)
+    ]
+
+
+def ndjson_stream(rows):
+    return io.BytesIO("".join(json.dumps(row) + "\n" for row in rows).encode())
+
+
+def csv_stream(rows):
+    lines = ["sku,name,description,price,category"]
+    lines += [f"{r['sku']},{r['name']},{r['description']},{r['price']},{r['category']}" for r in rows]
+    return io.BytesIO(("\n".join(lines) + "\n").encode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--baseline-rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    reset_tables(engine)
+    db = sessionmaker(bind=engine)()
+
+    rows = make_rows(args.baseline_rows, "single")
+    started = time.perf_counter()
+    for row in rows:
+        crud.create_product(db, dict(row))
+    elapsed = time.perf_counter() - started
+    print(f"create_product per row  {args.baseline_rows:>7} rows  {round(args.baseline_rows / elapsed * 60):>10} rows/min")
+
+    rows = make_rows(args.rows, "bulk")
+    for label, stream, parser_name in (
+        ("ndjson insert", ndjson_stream(rows), "ndjson"),
+        ("csv upsert   ", csv_stream(rows), "csv"),
+    ):
+        started = time.perf_counter()
+        result = product_import.import_products(db, product_import.PARSERS[parser_name](stream))
+        elapsed = time.perf_counter() - started
+        print(f"bulk {label}      {args.rows:>7} rows  {round(args.rows / elapsed * 60):>10} rows/min  "
+              f"(inserted {result['inserted']}, updated {result['updated']})")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
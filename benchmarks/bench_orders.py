@@ -0,0 +1,61 @@
+"""Order creation throughput for 1 / 100 / 10 000 items per order and for batches.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_orders
+"""
+import argparse
+import time
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, reset_tables, seed_products
+from src import crud, models
+
+
+def make_order(user_id: int, items: int, products: int):
+    return {
+        "user_id": user_id,
+        "items": [
+            {"product_id": i % products + 1, "quantity": 1 + i % 3, "price": 9.99}
+            for i in range(items)
+        ]
+    }
+
+
+def run(fn, repeat: int, items_per_call: int):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    elapsed = time.perf_counter() - started
+    return {
+        "ms_per_call": round(elapsed / repeat * 1000, 2),
+        "items_per_sec": round(repeat * items_per_call / elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    reset_tables(engine)
+    seed_products(engine, args.products)
+    db = sessionmaker(bind=engine)()
+    user = models.User(name="bench", email="bench@example.com")
+    db.add(user)
+    db.commit()
+
+    for items, repeat in ((1, 200), (100, 50), (10_000, 5)):
+        order = make_order(user.id, items, args.products)
+        result = run(lambda: crud.create_order(db, order), repeat, items)
+        print(f"create_order  {items:>6} items  {result}")
+
+    batch = [make_order(user.id, 10, args.products) for _ in range(1000)]
+    result = run(lambda: crud.create_orders(db, batch), 5, 10 * len(batch))
+    print(f"create_orders 1000 x 10 items  {result}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
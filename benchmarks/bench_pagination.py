@@ -0,0 +1,51 @@
+"""OFFSET vs keyset pagination on GET /products/.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_pagination --products 200000
+"""
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, measure, reset_tables, seed_products, summary
+from src import crud
+from src.pagination import encode_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--products", type=int, default=200_000)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--page", type=int, default=10_000)
+    parser.add_argument("--sort-by", default="price", choices=sorted(crud.PRODUCT_SORT_COLUMNS))
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    if not args.no_seed:
+        reset_tables(engine)
+        seed_products(engine, args.products)
+    db = sessionmaker(bind=engine)()
+
+    skip = (args.page - 1) * args.limit
+    # Курсор, указывающий на последнюю строку страницы page - 1
+    column = crud.PRODUCT_SORT_COLUMNS[args.sort_by].name
+    value, last_id = db.execute(text(
+        f"SELECT {column}, id FROM products ORDER BY {column}, id OFFSET :skip LIMIT 1"
+    ), {"skip": skip - 1}).one()
+    cursor = encode_cursor(f"{args.sort_by}:asc", value, last_id)
+
+    cases = {
+        "offset page 1": lambda: crud.get_products(db, skip=0, limit=args.limit, sort_by=args.sort_by),
+        f"offset page {args.page}": lambda: crud.get_products(db, skip=skip, limit=args.limit, sort_by=args.sort_by),
+        "keyset page 1": lambda: crud.get_products(db, limit=args.limit, sort_by=args.sort_by, cursor=""),
+        f"keyset page {args.page}": lambda: crud.get_products(db, limit=args.limit, sort_by=args.sort_by, cursor=cursor),
+    }
+    for name, fn in cases.items():
+        print(f"{name:<24} {summary(measure(fn))}")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
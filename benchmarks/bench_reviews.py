@@ -0,0 +1,89 @@
+"""Concurrent reviews on one hot product: synchronous aggregates vs the write-behind queue.
+
+sync: every review transaction updates the same products row and holds its lock until commit.
+deferred: the review transaction appends to rating_deltas; rating_aggregator then folds the queue
+into the product with one UPDATE per batch. Both modes must end with the same aggregates.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_reviews --reviews 5000 --concurrency 32
+"""
+import argparse
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, percentile, reset_tables
+from src import cache, crud, models, rating_aggregator
+
+
+def seed(engine, users: int):
+    reset_tables(engine)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO users (name, email)
+            SELECT 'reviewer ' || g, 'reviewer' || g || '@example.com' FROM generate_series(1, :users) AS g
+        """), {"users": users})
+        return conn.execute(text(
+            "INSERT INTO products (name, price, category) VALUES ('Hot product', 9.99, 'Hot') RETURNING id"
+        )).scalar()
+
+
+def run(engine, mode: str, reviews: int, concurrency: int):
+    product_id = seed(engine, reviews)
+    crud.RATING_AGGREGATION = mode
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    start = threading.Barrier(concurrency)
+    latencies = []
+    lock = threading.Lock()
+
+    def worker(user_ids):
+        start.wait()  # все потоки стартуют одновременно
+        local = []
+        for user_id in user_ids:
+            with Session() as db:
+                started = time.perf_counter()
+                crud.create_review(db, {"user_id": user_id, "product_id": product_id, "rating": 1 + user_id % 5})
+                local.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, [range(1 + i, reviews + 1, concurrency) for i in range(concurrency)]))
+    elapsed = time.perf_counter() - started
+
+    drain = 0.0
+    if mode == "deferred":
+        drained = time.perf_counter()
+        applied = rating_aggregator.run_worker(Session, once=True, response_cache=cache.NullCache())
+        drain = time.perf_counter() - drained
+        assert applied == reviews, applied
+
+    with Session() as db:
+        product = db.get(models.Product, product_id)
+        aggregates = (product.review_count, product.rating_sum)
+        # Агрегаты должны совпасть с таблицей reviews
+        assert crud.reconcile_product_ratings(db, product_id) == 0, "aggregates drifted"
+    print(f"{mode:<9} reviews/sec={round(reviews / elapsed):>6} p50_ms={percentile(latencies, 50):7.2f} "
+          f"p99_ms={percentile(latencies, 99):7.2f} drain_ms={drain * 1000:7.1f} aggregates={aggregates}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--modes", nargs="+", default=["sync", "deferred"], choices=["sync", "deferred"])
+    args = parser.parse_args()
+
+    # Пул на всё число потоков, чтобы очередь была на блокировке строки в Postgres, а не в пуле
+    engine = make_engine(args.database_url, pool_size=args.concurrency)
+    print(f"reviews={args.reviews} concurrency={args.concurrency} products=1")
+    for mode in args.modes:
+        run(engine, mode, args.reviews, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Full-text and faceted search over a synthetic catalog.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_search --products 1000000
+"""
+import argparse
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, measure, reset_tables, seed_products, summary
+from src import crud, models
+
+
+def ilike_search(db, term):
+    # Как выглядел бы тот же поиск без tsvector: ILIKE по name/description с теми же фасетами
+    product = models.Product
+    pattern = f"%{term}%"
+    match = product.name.ilike(pattern) | product.description.ilike(pattern)
+    facets = db.execute(select(product.category, func.count()).where(match).group_by(product.category)).all()
+    items = db.execute(select(product.id, product.name).where(match).order_by(product.id).limit(20)).all()
+    return items, facets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    if not args.no_seed:
+        reset_tables(engine)
+        seed_products(engine, args.products)
+    db = sessionmaker(bind=engine)()
+
+    cases = {
+        "ilike 'drone' (baseline)": lambda: ilike_search(db, "drone"),
+        "q=drone": lambda: crud.search_products(db, q="drone"),
+        "q='wireless drone'": lambda: crud.search_products(db, q="wireless drone"),
+        "q=drone price 100..200": lambda: crud.search_products(db, q="drone", min_price=100, max_price=200),
+        "q=drone rating>=4 by price": lambda: crud.search_products(db, q="drone", min_rating=4, sort_by="price",
+                                                                  order="asc"),
+        "q=drone category filter": lambda: crud.search_products(db, q="drone", category="Category 3"),
+    }
+    for name, fn in cases.items():
+        print(f"{name:<30} {summary(measure(fn, repeat=10))}")
+    items, total, facets = crud.search_products(db, q="wireless drone")
+    print(f"'wireless drone': {total} matches across {len(facets)} categories")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Serialization of a 1k-item product list: ORM objects + hand-built dicts + json vs rows + src.serializers + orjson.
+
+"encode" cases take already fetched items, "fetch+encode" cases include the database query.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_serialization --items 1000
+"""
+import argparse
+import json
+
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.common import make_engine, measure, reset_tables, seed_products, summary
+from src import crud, models, serializers
+
+
+def legacy_product_to_dict(product):
+    # Прежняя сборка ответа в маршрутах
+    return {
+        "id": product.id,
+        "name": product.name,
+        "description": product.description,
+        "price": product.price,
+        "category": product.category,
+        "average_rating": product.average_rating
+    }
+
+
+def legacy_dumps(body):
+    # Так кодирует стандартный провайдер Flask в jsonify
+    return json.dumps(body, sort_keys=True, separators=(",", ":")).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--database-url")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--no-seed", action="store_true")
+    args = parser.parse_args()
+
+    engine = make_engine(args.database_url)
+    if not args.no_seed:
+        reset_tables(engine)
+        seed_products(engine, args.items)
+    Session = sessionmaker(bind=engine)
+
+    def fetch_objects(db):
+        return db.query(models.Product).order_by(models.Product.id).limit(args.items).all()
+
+    def fetch_rows(db):
+        return crud.get_products(db, limit=args.items)
+
+    with Session() as db:
+        objects, rows = fetch_objects(db), fetch_rows(db)
+        assert legacy_dumps([legacy_product_to_dict(p) for p in objects]) == \
+            serializers.dumps(list(serializers.product_to_dict.many(rows))), "bodies differ"
+
+    def before(items):
+        return legacy_dumps([legacy_product_to_dict(p) for p in items])
+
+    def after(items):
+        return serializers.dumps(list(serializers.product_to_dict.many(items)))
+
+    def fetched(fetch, encode):
+        # Новая сессия на прогон, чтобы identity map не переиспользовал объекты
+        with Session() as db:
+            return encode(fetch(db))
+
+    print(f"items={len(rows)} json_backend={'orjson' if serializers.orjson else 'json'}")
+    cases = {
+        "encode before": lambda: before(objects),
+        "encode after": lambda: after(rows),
+        "fetch+encode before": lambda: fetched(fetch_objects, before),
+        "fetch+encode after": lambda: fetched(fetch_rows, after),
+    }
+    for name, fn in cases.items():
+        print(f"{name:<20} {summary(measure(fn, repeat=args.repeat))}")
+
+
+if __name__ == "__main__":
+    main()
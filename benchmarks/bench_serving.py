@@ -0,0 +1,103 @@
+"""Load test of a running server: requests/sec, p50 and p99 per scenario.
+
+Start both serving modes against the same database (CACHE_BACKEND=none to hit the database), e.g.
+
+    GUNICORN_MAX_REQUESTS=0 gunicorn -c gunicorn.conf.py --bind :8001 app:app
+    uvicorn src.asgi:app --port 8002 --workers 4
+
+then seed once and compare:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_serving --seed 100000 http://localhost:8001
+    python -m benchmarks.bench_serving http://localhost:8002
+"""
+import argparse
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from sqlalchemy import text
+
+from benchmarks.common import make_engine, percentile, reset_tables, seed_products
+
+SCENARIOS = {
+    "product": lambda rnd, n: ("GET", f"/products/{rnd.randint(1, n)}", None),
+    "list": lambda rnd, n: ("GET", f"/products/?limit=20&sort_by=price&category=Category {rnd.randint(0, 19)}&cursor=", None),
+    "search": lambda rnd, n: ("GET", f"/products/search?q={rnd.choice(['wireless', 'lamp', 'steel phone'])}&limit=20", None),
+    "order": lambda rnd, n: ("POST", "/orders/", {
+        "user_id": 1,
+        "items": [{"product_id": rnd.randint(1, n), "quantity": 1, "price": 9.99} for _ in range(3)]
+    }),
+}
+
+
+def seed(database_url, products: int):
+    engine = make_engine(database_url)
+    reset_tables(engine)
+    seed_products(engine, products)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO users (name, email) VALUES ('bench', 'bench@example.com')"))
+    engine.dispose()
+
+
+def run_scenario(base_url: str, scenario, products: int, concurrency: int, duration: float):
+    samples, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(seed):
+        nonlocal errors
+        rnd = random.Random(seed)
+        local, failed = [], 0
+        with requests.Session() as http:
+            while time.perf_counter() < deadline:
+                method, path, body = scenario(rnd, products)
+                started = time.perf_counter()
+                try:
+                    response = http.request(method, base_url + path, json=body)
+                except requests.ConnectionError:
+                    # Например, воркер gunicorn перезапустился по max_requests
+                    failed += 1
+                    continue
+                local.append((time.perf_counter() - started) * 1000)
+                failed += response.status_code >= 400
+        with lock:
+            samples.extend(local)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "rps": round(len(samples) / elapsed),
+        "p50_ms": round(percentile(samples, 50), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url")
+    parser.add_argument("--database-url")
+    parser.add_argument("--seed", type=int, help="truncate tables and insert N products before the run")
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    args = parser.parse_args()
+
+    if args.seed:
+        seed(args.database_url, args.seed)
+        args.products = args.seed
+
+    for name in args.scenario or SCENARIOS:
+        run_scenario(args.base_url.rstrip("/"), SCENARIOS[name], args.products, args.concurrency, 2)  # прогрев
+        result = run_scenario(args.base_url.rstrip("/"), SCENARIOS[name], args.products, args.concurrency, args.duration)
+        print(f"{name:<8} concurrency={args.concurrency}  {result}")
+
+
+if __name__ == "__main__":
+    main()
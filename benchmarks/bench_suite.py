@@ -0,0 +1,285 @@
+"""Load test of every route registered by routes_init.init_routes, with results saved to JSON.
+
+Seed a synthetic dataset once, start the server against the same database (CACHE_BACKEND=none to measure
+the database path, GUNICORN_MAX_REQUESTS=0 to avoid worker restarts mid-run), then run the suite:
+
+    DATABASE_URL=postgresql://... python -m benchmarks.bench_suite --seed-only --products 100000
+    CACHE_BACKEND=none GUNICORN_MAX_REQUESTS=0 gunicorn -c gunicorn.conf.py --bind :8001 app:app
+    python -m benchmarks.bench_suite http://localhost:8001 --output bench.json --baseline previous.json
+
+Queries per request come from the Server-Timing header (src/metrics.py). Write routes change the dataset,
+so reseed before runs that are meant to be compared.
+"""
+import argparse
+import json
+import random
+import subprocess
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from flask import Flask
+
+from benchmarks.common import make_engine, percentile, reset_tables, seed_dataset
+from src.routes_init import init_routes
+
+
+class Client:
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.http = requests.Session()
+
+    def call(self, method: str, path: str, body=None):
+        return self.http.request(method, self.base_url + path, json=body)
+
+
+def _product(rnd):
+    return {"name": f"Bench product {rnd.randint(1, 10**9)}", "description": "Created by bench_suite",
+            "price": round(rnd.uniform(1, 1000), 2), "category": f"Category {rnd.randint(0, 19)}"}
+
+def _order(rnd, size):
+    return {"user_id": rnd.randint(1, size["users"]),
+            "items": [{"product_id": rnd.randint(1, size["products"]), "quantity": 1} for _ in range(3)]}
+
+def _ids(rnd, count, upper):
+    return rnd.sample(range(1, upper + 1), min(count, upper))
+
+def _create_review(client, rnd, size):
+    product_id = rnd.randint(1, size["products"])
+    return "POST", f"/products/{product_id}/reviews/", {
+        "user_id": rnd.randint(1, size["users"]), "product_id": product_id, "rating": rnd.randint(1, 5),
+        "comment": "bench"}
+
+def _review_id(client, rnd, size):
+    # Отзыв пары (пользователь, товар) создаётся или заменяется — одна и та же пара может выпасть повторно
+    method, path, body = _create_review(client, rnd, size)
+    return body["product_id"], client.call(method, path, body).json()["id"]
+
+def _update_review(client, rnd, size):
+    product_id, review_id = _review_id(client, rnd, size)
+    return "PUT", f"/products/{product_id}/reviews/{review_id}", {"rating": rnd.randint(1, 5), "comment": "edited"}
+
+def _delete_review(client, rnd, size):
+    product_id, review_id = _review_id(client, rnd, size)
+    return "DELETE", f"/products/{product_id}/reviews/{review_id}", None
+
+def _delete_product(client, rnd, size):
+    # Удаляется только что созданный товар: у товаров из набора есть отзывы и заказы
+    product_id = client.call("POST", "/products/", _product(rnd)).json()["id"]
+    return "DELETE", f"/products/{product_id}", None
+
+def _add_favorite(client, rnd, size):
+    user_id = rnd.randint(1, size["users"])
+    return "POST", f"/users/{user_id}/favorites/", {"user_id": user_id, "product_id": rnd.randint(1, size["products"])}
+
+def _remove_favorite(client, rnd, size):
+    user_id, product_id = rnd.randint(1, size["users"]), rnd.randint(1, size["products"])
+    client.call("POST", f"/users/{user_id}/favorites/", {"user_id": user_id, "product_id": product_id})
+    return "DELETE", f"/users/{user_id}/favorites/{product_id}", None
+
+
+# (метод, правило Flask) -> сценарий(client, rnd, size) -> (метод, путь, тело). Сценарий может сделать
+# подготовительные запросы через client — они в замеры не попадают
+SCENARIOS = {
+    ("GET", "/health/db"): lambda c, rnd, size: ("GET", "/health/db", None),
+    ("GET", "/health/cache"): lambda c, rnd, size: ("GET", "/health/cache", None),
+    ("GET", "/metrics"): lambda c, rnd, size: ("GET", "/metrics", None),
+    ("GET", "/users/"): lambda c, rnd, size: ("GET", "/users/", None),
+    ("POST", "/products/"): lambda c, rnd, size: ("POST", "/products/", _product(rnd)),
+    ("GET", "/products/"): lambda c, rnd, size: (
+        "GET", f"/products/?limit=20&sort_by=price&category=Category {rnd.randint(0, 19)}&cursor=", None),
+    ("POST", "/products/bulk"): lambda c, rnd, size: (
+        "POST", "/products/bulk", [{**_product(rnd), "sku": f"bench-{rnd.randint(1, 10**9)}"} for _ in range(100)]),
+    ("GET", "/products/export"): lambda c, rnd, size: (
+        "GET", f"/products/export?category=Category {rnd.randint(0, 19)}", None),
+    ("GET", "/products/leaderboard"): lambda c, rnd, size: (
+        "GET", f"/products/leaderboard?by={rnd.choice(['favorites', 'rating'])}", None),
+    ("GET", "/products/search"): lambda c, rnd, size: (
+        "GET", f"/products/search?q={rnd.choice(['wireless', 'lamp', 'steel phone'])}&limit=20", None),
+    ("GET", "/products/<int:product_id>"): lambda c, rnd, size: (
+        "GET", f"/products/{rnd.randint(1, size['products'])}", None),
+    ("PUT", "/products/<int:product_id>"): lambda c, rnd, size: (
+        "PUT", f"/products/{rnd.randint(1, size['products'])}", _product(rnd)),
+    ("DELETE", "/products/<int:product_id>"): _delete_product,
+    ("GET", "/products/<int:product_id>/reviews/"): lambda c, rnd, size: (
+        "GET", f"/products/{rnd.randint(1, size['products'])}/reviews/?limit=20&cursor=", None),
+    ("POST", "/products/<int:product_id>/reviews/"): _create_review,
+    ("GET", "/products/<int:product_id>/reviews/stats"): lambda c, rnd, size: (
+        "GET", f"/products/{rnd.randint(1, size['products'])}/reviews/stats", None),
+    ("PUT", "/products/<int:product_id>/reviews/<int:review_id>"): _update_review,
+    ("DELETE", "/products/<int:product_id>/reviews/<int:review_id>"): _delete_review,
+    ("POST", "/orders/"): lambda c, rnd, size: ("POST", "/orders/", _order(rnd, size)),
+    ("POST", "/orders/batch"): lambda c, rnd, size: (
+        "POST", "/orders/batch", {"orders": [_order(rnd, size) for _ in range(20)]}),
+    ("GET", "/orders/<int:order_id>"): lambda c, rnd, size: (
+        "GET", f"/orders/{rnd.randint(1, size['orders'])}", None),
+    ("POST", "/orders/status"): lambda c, rnd, size: (
+        "POST", "/orders/status", {"status": "processing", "order_ids": _ids(rnd, 20, size["orders"])}),
+    ("PUT", "/orders/<int:order_id>/status"): lambda c, rnd, size: (
+        "PUT", f"/orders/{rnd.randint(1, size['orders'])}/status", {"status": rnd.choice(["processing", "done"])}),
+    ("GET", "/users/<int:user_id>/orders"): lambda c, rnd, size: (
+        "GET", f"/users/{rnd.randint(1, size['users'])}/orders?limit=20", None),
+    ("POST", "/users/<int:user_id>/favorites/"): _add_favorite,
+    ("GET", "/users/<int:user_id>/favorites/"): lambda c, rnd, size: (
+        "GET", f"/users/{rnd.randint(1, size['users'])}/favorites/?limit=20&cursor=", None),
+    ("DELETE", "/users/<int:user_id>/favorites/<int:product_id>"): _remove_favorite,
+    ("POST", "/users/<int:user_id>/favorites/bulk"): lambda c, rnd, size: (
+        "POST", f"/users/{rnd.randint(1, size['users'])}/favorites/bulk",
+        {"product_ids": _ids(rnd, 20, size["products"])}),
+    ("DELETE", "/users/<int:user_id>/favorites/bulk"): lambda c, rnd, size: (
+        "DELETE", f"/users/{rnd.randint(1, size['users'])}/favorites/bulk",
+        {"product_ids": _ids(rnd, 20, size["products"])}),
+    ("GET", "/users/<int:user_id>/favorites/check"): lambda c, rnd, size: (
+        "GET", f"/users/{rnd.randint(1, size['users'])}/favorites/check?product_ids="
+               + ",".join(map(str, _ids(rnd, 20, size["products"]))), None),
+}
+
+
+def registered_routes():
+    app = Flask(__name__)
+    init_routes(app)
+    return {
+        (method, rule.rule)
+        for rule in app.url_map.iter_rules() if rule.endpoint != "static"
+        for method in rule.methods - {"HEAD", "OPTIONS"}
+    }
+
+
+def _queries(response):
+    # Server-Timing: db;dur=1.23;desc="4 queries", ...
+    header = response.headers.get("Server-Timing", "")
+    start = header.find('desc="')
+    return int(header[start + 6:header.index(" ", start)]) if start >= 0 else None
+
+
+def run_scenario(base_url: str, scenario, size: dict, concurrency: int, duration: float, seed: int = 0):
+    samples, queries, statuses = [], [], Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rnd = random.Random(seed * 1000 + index)
+        client = Client(base_url)
+        local, local_queries, local_statuses = [], [], Counter()
+        while time.perf_counter() < deadline:
+            try:
+                method, path, body = scenario(client, rnd, size)
+                started = time.perf_counter()
+                response = client.call(method, path, body)
+                response.content  # тело читается целиком, включая потоковый экспорт
+            except requests.ConnectionError:
+                local_statuses["connection_error"] += 1
+                continue
+            local.append((time.perf_counter() - started) * 1000)
+            local_statuses[str(response.status_code)] += 1
+            if (count := _queries(response)) is not None:
+                local_queries.append(count)
+        with lock:
+            samples.extend(local)
+            queries.extend(local_queries)
+            statuses.update(local_statuses)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / elapsed, 1),
+        "p50_ms": round(percentile(samples, 50), 2) if samples else None,
+        "p95_ms": round(percentile(samples, 95), 2) if samples else None,
+        "p99_ms": round(percentile(samples, 99), 2) if samples else None,
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "statuses": dict(sorted(statuses.items())),
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def compare(results: dict, baseline: dict):
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous.get("p95_ms") or not result["p95_ms"]:
+            continue
+        p95 = (result["p95_ms"] / previous["p95_ms"] - 1) * 100
+        rps = (result["rps"] / previous["rps"] - 1) * 100 if previous["rps"] else 0.0
+        print(f"{name:<55} p95 {p95:+6.1f}%  rps {rps:+6.1f}%  "
+              f"queries {previous['queries_per_request']} -> {result['queries_per_request']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("base_url", nargs="?")
+    parser.add_argument("--database-url")
+    parser.add_argument("--seed-only", action="store_true", help="only (re)seed the dataset")
+    parser.add_argument("--seed", action="store_true", help="truncate and seed the dataset before the run")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--reviews", type=int, default=200_000)
+    parser.add_argument("--favorites", type=int, default=100_000)
+    parser.add_argument("--orders", type=int, default=50_000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--route", action="append", help="run only routes whose 'METHOD /rule' contains this")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="previous JSON output to compare against")
+    args = parser.parse_args()
+
+    size = {"users": args.users, "products": args.products, "orders": args.orders}
+    if args.seed or args.seed_only:
+        engine = make_engine(args.database_url)
+        reset_tables(engine)
+        started = time.perf_counter()
+        seed_dataset(engine, args.users, args.products, args.reviews, args.favorites, args.orders)
+        engine.dispose()
+        print(f"seeded in {time.perf_counter() - started:.1f}s")
+        if args.seed_only:
+            return
+    if not args.base_url:
+        parser.error("base_url is required unless --seed-only is given")
+
+    # Новый маршрут без сценария — ошибка: набор должен покрывать всё приложение
+    missing = registered_routes() - set(SCENARIOS)
+    if missing:
+        raise SystemExit(f"No benchmark scenario for: {sorted(missing)}")
+
+    base_url = args.base_url.rstrip("/")
+    results = {}
+    for (method, rule), scenario in sorted(SCENARIOS.items(), key=lambda item: (item[0][1], item[0][0])):
+        name = f"{method} {rule}"
+        if args.route and not any(part in name for part in args.route):
+            continue
+        run_scenario(base_url, scenario, size, args.concurrency, args.warmup)
+        results[name] = run_scenario(base_url, scenario, size, args.concurrency, args.duration, seed=1)
+        print(f"{name:<55} {results[name]}")
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "base_url": base_url,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "dataset": {**size, "reviews": args.reviews, "favorites": args.favorites},
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"saved to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Validation of a batch payload: the former hand-written checks vs compiled src.schemas validators.
+
+No database is needed; the payload is 1000 orders x 100 items = 100k order items by default.
+
+    python -m benchmarks.bench_validation --orders 1000 --items 100
+"""
+import argparse
+
+from benchmarks.common import measure, summary
+from src import schemas
+
+
+def legacy_validate_order(data):
+    # Прежняя проверка из src/schemas.py
+    if "user_id" not in data or not isinstance(data["user_id"], int):
+        raise ValueError("Valid 'user_id' is required")
+    if "items" not in data or not isinstance(data["items"], list) or not data["items"]:
+        raise ValueError("Order must contain at least one item")
+    for item in data["items"]:
+        if not all(k in item for k in ["product_id", "quantity"]):
+            raise ValueError("Each item must have 'product_id' and 'quantity'")
+        if not isinstance(item["quantity"], int) or item["quantity"] < 1:
+            raise ValueError("Quantity must be a positive integer")
+    return data
+
+
+def legacy_validate_order_batch(data):
+    if not isinstance(data, dict) or not isinstance(data.get("orders"), list) or not data["orders"]:
+        raise ValueError("Batch must contain a non-empty 'orders' list")
+    for index, order in enumerate(data["orders"]):
+        try:
+            legacy_validate_order(order)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"orders[{index}]: {e}")
+    return data
+
+
+def make_batch(orders: int, items: int):
+    return {"orders": [
+        {"user_id": o + 1,
+         "items": [{"product_id": i + 1, "quantity": 1 + i % 3, "price": 9.99} for i in range(items)]}
+        for o in range(orders)
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    batch = make_batch(args.orders, args.items)
+    total_items = args.orders * args.items
+    # Лимиты схемы рассчитаны на HTTP-запрос; для больших прогонов проверяем пачками по MAX_BATCH_ORDERS
+    chunks = [{"orders": batch["orders"][i:i + schemas.MAX_BATCH_ORDERS]}
+              for i in range(0, args.orders, schemas.MAX_BATCH_ORDERS)]
+
+    cases = {
+        "legacy": lambda: [legacy_validate_order_batch(chunk) for chunk in chunks],
+        "compiled": lambda: [schemas.validate_order_batch(chunk) for chunk in chunks],
+    }
+    print(f"orders={args.orders} items_per_order={args.items} items={total_items}")
+    for name, fn in cases.items():
+        stats = summary(measure(fn, repeat=args.repeat))
+        items_per_sec = round(total_items / stats["p50_ms"] * 1000)
+        print(f"{name:<10} {stats} items_per_sec={items_per_sec}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import os
+import statistics
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from src import crud
+from src.database import DATABASE_URL
+from src.models import Base
+
+
+def make_engine(url: str = None, **kwargs):
+    engine = create_engine(url or os.environ.get("DATABASE_URL", DATABASE_URL), **kwargs)
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def reset_tables(engine):
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+
+
+ADJECTIVES = ["red", "blue", "green", "black", "white", "compact", "wireless", "premium", "classic",
+              "portable", "smart", "vintage", "leather", "steel", "wooden", "silent", "ultra"]
+NOUNS = ["phone", "laptop", "headphones", "chair", "lamp", "backpack", "watch", "camera", "kettle",
+         "speaker", "keyboard", "mouse", "jacket", "sneakers", "desk", "monitor", "tablet", "blender",
+         "router", "drone", "guitar", "bicycle", "printer"]
+
+
+def _sql_array(words):
+    return "ARRAY[" + ", ".join(f"'{word}'" for word in words) + "]"
+
+
+def seed_products(engine, count: int, categories: int = 20):
+    # Генерируем данные на стороне Postgres, чтобы не гонять строки через драйвер
+    adjectives, nouns = _sql_array(ADJECTIVES), _sql_array(NOUNS)
+    with engine.begin() as conn:
+        conn.execute(text(f"""
+            INSERT INTO products (name, description, price, category, average_rating)
+            SELECT initcap(({adjectives})[1 + g % {len(ADJECTIVES)}]) || ' '
+                       || ({nouns})[1 + (g / {len(ADJECTIVES)}) % {len(NOUNS)}] || ' ' || g,
+                   'A ' || ({adjectives})[1 + (g / 7) % {len(ADJECTIVES)}] || ' '
+                       || ({nouns})[1 + (g / 11) % {len(NOUNS)}] || ' for everyday use',
+                   round((random() * 1000)::numeric, 2),
+                   'Category ' || (g % :categories),
+                   round((1 + random() * 4)::numeric, 2)
+            FROM generate_series(1, :count) AS g
+        """), {"count": count, "categories": categories})
+        conn.execute(text("ANALYZE products"))
+
+
+def seed_dataset(engine, users: int, products: int, reviews: int, favorites: int, orders: int,
+                 items_per_order: int = 3):
+    # Весь набор генерируется в Postgres через generate_series; агрегаты товаров затем пересчитываются
+    if max(reviews, favorites) > users * products:
+        raise ValueError("Not enough (user, product) pairs for unique reviews/favorites")
+    seed_products(engine, products)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO users (name, email)
+            SELECT 'user ' || g, 'user' || g || '@example.com' FROM generate_series(1, :users) AS g
+        """), {"users": users})
+        # Пары (user, product) различны при g < users * products
+        conn.execute(text("""
+            INSERT INTO reviews (user_id, product_id, rating, comment, created_at)
+            SELECT 1 + g % :users, 1 + (g / :users) % :products, 1 + (g * 7) % 5, 'Review ' || g,
+                   now() - g * interval '1 second'
+            FROM generate_series(0, :count - 1) AS g
+        """), {"users": users, "products": products, "count": reviews})
+        conn.execute(text("""
+            INSERT INTO favorites (user_id, product_id)
+            SELECT 1 + g % :users, 1 + (g / :users) % :products FROM generate_series(0, :count - 1) AS g
+        """), {"users": users, "products": products, "count": favorites})
+        conn.execute(text("""
+            INSERT INTO orders (user_id, order_date, status)
+            SELECT 1 + g % :users, now() - g * interval '1 minute',
+                   CASE WHEN g % 10 = 0 THEN 'new' ELSE 'done' END
+            FROM generate_series(1, :count) AS g
+        """), {"users": users, "count": orders})
+        conn.execute(text("""
+            INSERT INTO order_items (order_id, product_id, quantity, price)
+            SELECT o.id, p.id, 1 + i % 3, p.price
+            FROM orders AS o
+            CROSS JOIN generate_series(1, :items) AS i
+            JOIN products AS p ON p.id = 1 + (o.id * 31 + i) % :products
+        """), {"items": items_per_order, "products": products})
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        crud.reconcile_product_ratings(db)
+        crud.reconcile_favorite_counts(db)
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+
+def measure(fn, repeat: int = 20):
+    fn()  # прогрев
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def percentile(samples, pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(samples) -> dict:
+    return {
+        "mean_ms": round(statistics.mean(samples), 3),
+        "p50_ms": round(percentile(samples, 50), 3),
+        "p99_ms": round(percentile(samples, 99), 3),
+    }
@@ -0,0 +1,21 @@
+import multiprocessing
+import os
+
+# Синхронный режим: gunicorn -c gunicorn.conf.py app:app
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Воркеры стартуют после fork с окружением мастера: по WEB_CONCURRENCY src/cache.py выбирает общий кэш
+os.environ["WEB_CONCURRENCY"] = str(workers)
+# gthread: каждый воркер обслуживает несколько запросов, пока остальные ждут ответа базы.
+# Пул соединений на воркер должен покрывать threads: DB_POOL_SIZE + DB_MAX_OVERFLOW >= threads
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# Периодический перезапуск воркеров ограничивает рост памяти; jitter разносит перезапуски во времени
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+# Без preload_app: движок SQLAlchemy и его пул создаются после fork в каждом воркере
+preload_app = False
+accesslog = os.environ.get("GUNICORN_ACCESSLOG", "-")
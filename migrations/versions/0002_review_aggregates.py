@@ -0,0 +1,57 @@
+"""review aggregates
+
+Счётчики отзывов в строке товара: review_count, rating_sum и гистограмма rating_count_1..5.
+Колонки с постоянным значением по умолчанию добавляются без перезаписи таблицы; затем агрегаты
+и average_rating заполняются по reviews одним UPDATE. Отзывы, записанные старой версией приложения
+после этой ревизии, в агрегаты не попадут — после выкладки выполните flask reconcile-ratings.
+
+Revision ID: 0002
+Revises: 0001
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ['review_count', 'rating_sum'] + [f'rating_count_{r}' for r in range(1, 6)]
+
+BACKFILL = """
+    UPDATE products p SET
+        review_count = s.review_count,
+        rating_sum = s.rating_sum,
+        average_rating = s.rating_sum::float8 / s.review_count,
+        rating_count_1 = s.rating_count_1,
+        rating_count_2 = s.rating_count_2,
+        rating_count_3 = s.rating_count_3,
+        rating_count_4 = s.rating_count_4,
+        rating_count_5 = s.rating_count_5
+    FROM (
+        SELECT product_id, count(*) AS review_count, sum(rating) AS rating_sum,
+               count(*) FILTER (WHERE rating = 1) AS rating_count_1,
+               count(*) FILTER (WHERE rating = 2) AS rating_count_2,
+               count(*) FILTER (WHERE rating = 3) AS rating_count_3,
+               count(*) FILTER (WHERE rating = 4) AS rating_count_4,
+               count(*) FILTER (WHERE rating = 5) AS rating_count_5
+        FROM reviews
+        GROUP BY product_id
+    ) s
+    WHERE p.id = s.product_id
+"""
+
+
+def upgrade():
+    for name in COLUMNS:
+        op.add_column('products', sa.Column(name, sa.Integer(), server_default='0', nullable=False))
+    op.execute(BACKFILL)
+    op.execute("""
+        UPDATE products SET average_rating = 0.0
+        WHERE review_count = 0 AND average_rating IS DISTINCT FROM 0.0
+    """)
+
+
+def downgrade():
+    for name in reversed(COLUMNS):
+        op.drop_column('products', name)
@@ -0,0 +1,29 @@
+"""updated at
+
+products.updated_at и reviews.updated_at — источник ETag/Last-Modified. now() вычисляется
+один раз на ALTER, поэтому колонка добавляется без перезаписи таблицы; у существующих строк
+в ней время миграции.
+
+Revision ID: 0003
+Revises: 0002
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+TABLES = ['products', 'reviews']
+
+
+def upgrade():
+    for table in TABLES:
+        op.add_column(table, sa.Column('updated_at', sa.DateTime(timezone=True),
+                                       server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    for table in reversed(TABLES):
+        op.drop_column(table, 'updated_at')
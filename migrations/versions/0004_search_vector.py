@@ -0,0 +1,28 @@
+"""search vector
+
+Генерируемый tsvector для полнотекстового поиска; GIN-индекс по нему строит 0008 (CONCURRENTLY).
+Добавление STORED-колонки переписывает таблицу products под ACCESS EXCLUSIVE: на большом
+каталоге выполнять в окно обслуживания.
+
+Revision ID: 0004
+Revises: 0003
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+SEARCH_VECTOR = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))"
+
+
+def upgrade():
+    op.add_column('products', sa.Column('search_vector', postgresql.TSVECTOR(),
+                                        sa.Computed(SEARCH_VECTOR, persisted=True), nullable=True))
+
+
+def downgrade():
+    op.drop_column('products', 'search_vector')
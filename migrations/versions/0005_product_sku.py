@@ -0,0 +1,25 @@
+"""product sku
+
+Внешний артикул products.sku — ключ ON CONFLICT массовой загрузки. У существующих товаров NULL:
+уникальность NULL не ограничивает.
+
+Revision ID: 0005
+Revises: 0004
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('products', sa.Column('sku', sa.String(), nullable=True))
+    op.create_unique_constraint('products_sku_key', 'products', ['sku'])
+
+
+def downgrade():
+    op.drop_constraint('products_sku_key', 'products', type_='unique')
+    op.drop_column('products', 'sku')
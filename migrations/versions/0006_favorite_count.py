@@ -0,0 +1,29 @@
+"""favorite count
+
+products.favorite_count — сколько пользователей добавили товар в избранное. Заполняется по favorites;
+повторы пары (user_id, product_id), которые удалит 0008, считаются один раз. Изменения избранного,
+сделанные старой версией приложения после этой ревизии, поправит flask reconcile-favorites.
+
+Revision ID: 0006
+Revises: 0005
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('products', sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute("""
+        UPDATE products p SET favorite_count = f.favorite_count
+        FROM (SELECT product_id, count(DISTINCT user_id) AS favorite_count FROM favorites GROUP BY product_id) f
+        WHERE p.id = f.product_id
+    """)
+
+
+def downgrade():
+    op.drop_column('products', 'favorite_count')
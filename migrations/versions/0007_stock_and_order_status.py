@@ -0,0 +1,34 @@
+"""stock and order status
+
+products.stock — остаток на складе (NULL — не ведётся). orders.status становится обязательным
+и ограничивается жизненным циклом заказа; заказы без статуса получают 'new'. Если в базе есть
+другие статусы, добавление CHECK упадёт — их нужно привести к new/processing/done вручную.
+
+Revision ID: 0007
+Revises: 0006
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+# Значения на момент миграции; src.models не импортируем, чтобы ревизия не менялась вместе с моделями
+ORDER_STATUSES = "status IN ('new', 'processing', 'done')"
+
+
+def upgrade():
+    op.add_column('products', sa.Column('stock', sa.Integer(), nullable=True))
+    op.create_check_constraint('products_stock_check', 'products', 'stock >= 0')
+    op.execute("UPDATE orders SET status = 'new' WHERE status IS NULL")
+    op.alter_column('orders', 'status', existing_type=sa.String(), server_default='new', nullable=False)
+    op.create_check_constraint('orders_status_check', 'orders', ORDER_STATUSES)
+
+
+def downgrade():
+    op.drop_constraint('orders_status_check', 'orders', type_='check')
+    op.alter_column('orders', 'status', existing_type=sa.String(), server_default=None, nullable=True)
+    op.drop_constraint('products_stock_check', 'products', type_='check')
+    op.drop_column('products', 'stock')
@@ -0,0 +1,60 @@
+"""hot filter indexes
+
+Индексы под фильтры и keyset-пагинацию src/crud.py. Создаются CONCURRENTLY — без блокировки
+записи в таблицы; IF NOT EXISTS пропускает индексы, уже созданные через create_all.
+Перед уникальным ix_favorites_user_product удаляются повторы избранного (остаётся первая запись;
+favorite_count их уже не учитывает, см. 0006). Если старая версия приложения успела записать
+новый повтор до построения индекса, построение упадёт — повторите upgrade.
+
+Revision ID: 0008
+Revises: 0007
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+# (имя, таблица, колонки, дополнительные параметры)
+INDEXES = [
+    ('ix_products_category_id', 'products', ['category', 'id'], {}),
+    ('ix_products_price_id', 'products', ['price', 'id'], {}),
+    ('ix_products_category_price_id', 'products', ['category', 'price', 'id'], {}),
+    ('ix_products_average_rating_id', 'products', ['average_rating', 'id'], {}),
+    ('ix_products_category_average_rating_id', 'products', ['category', 'average_rating', 'id'], {}),
+    ('ix_products_favorite_count_id', 'products', ['favorite_count', 'id'], {}),
+    ('ix_products_category_favorite_count_id', 'products', ['category', 'favorite_count', 'id'], {}),
+    ('ix_products_search_vector', 'products', ['search_vector'], {'postgresql_using': 'gin'}),
+    ('ix_reviews_product_created_at_id', 'reviews', ['product_id', 'created_at', 'id'], {}),
+    ('ix_reviews_product_rating_id', 'reviews', ['product_id', 'rating', 'id'], {}),
+    ('ix_favorites_user_product', 'favorites', ['user_id', 'product_id'], {'unique': True}),
+    ('ix_favorites_user_id_id', 'favorites', ['user_id', 'id'], {}),
+    ('ix_favorites_product_id', 'favorites', ['product_id'], {}),
+    ('ix_orders_user_order_date_id', 'orders', ['user_id', 'order_date', 'id'], {}),
+    ('ix_orders_new_id', 'orders', ['id'], {'postgresql_where': sa.text("status = 'new'")}),
+    ('ix_order_items_order_id', 'order_items', ['order_id'], {}),
+    ('ix_order_items_product_id', 'order_items', ['product_id'], {}),
+]
+
+DEDUPLICATE_FAVORITES = """
+    DELETE FROM favorites f
+    USING favorites older
+    WHERE older.user_id = f.user_id AND older.product_id = f.product_id AND older.id < f.id
+"""
+
+
+def upgrade():
+    op.execute(DEDUPLICATE_FAVORITES)
+    # CONCURRENTLY нельзя выполнять внутри транзакции. Если построение прервалось, останется
+    # невалидный индекс: его нужно удалить (DROP INDEX CONCURRENTLY) и повторить upgrade
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True, **options)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,39 @@
+"""weighted rating
+
+Байесовская оценка products.weighted_rating — генерируемая колонка по rating_sum и review_count,
+и индексы под сортировку по ней. Добавление STORED-колонки переписывает таблицу products
+под ACCESS EXCLUSIVE: на большом каталоге выполнять в окно обслуживания.
+
+Revision ID: 0009
+Revises: 0008
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+# Значения на момент миграции; src.models не импортируем, чтобы ревизия не менялась вместе с моделями
+WEIGHTED_RATING = '(rating_sum + 30.0)::float8 / (review_count + 10)'
+
+INDEXES = [
+    ('ix_products_weighted_rating_id', 'products', ['weighted_rating', 'id']),
+    ('ix_products_category_weighted_rating_id', 'products', ['category', 'weighted_rating', 'id']),
+]
+
+
+def upgrade():
+    op.add_column('products', sa.Column('weighted_rating', sa.Float(),
+                                        sa.Computed(WEIGHTED_RATING, persisted=True), nullable=True))
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, postgresql_concurrently=True, if_exists=True)
+    op.drop_column('products', 'weighted_rating')
@@ -0,0 +1,59 @@
+"""unique user review
+
+Один отзыв пользователя на товар. Из накопившихся повторов остаётся последний (наибольший id);
+агрегаты товаров поправляются на удалённые отзывы тем же UPDATE, без пересчёта по reviews.
+Уникальный индекс строится CONCURRENTLY; если между удалением повторов и построением индекса
+старая версия приложения успела записать новый повтор, построение упадёт — повторите upgrade.
+
+Revision ID: 0010
+Revises: 0009
+"""
+from alembic import op
+
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+DEDUPLICATE = """
+    WITH removed AS (
+        DELETE FROM reviews r
+        USING reviews newer
+        WHERE newer.user_id = r.user_id AND newer.product_id = r.product_id AND newer.id > r.id
+        RETURNING r.product_id, r.rating
+    ), delta AS (
+        SELECT product_id, count(*) AS review_count, sum(rating) AS rating_sum,
+               count(*) FILTER (WHERE rating = 1) AS rating_count_1,
+               count(*) FILTER (WHERE rating = 2) AS rating_count_2,
+               count(*) FILTER (WHERE rating = 3) AS rating_count_3,
+               count(*) FILTER (WHERE rating = 4) AS rating_count_4,
+               count(*) FILTER (WHERE rating = 5) AS rating_count_5
+        FROM removed
+        GROUP BY product_id
+    )
+    UPDATE products p SET
+        review_count = p.review_count - d.review_count,
+        rating_sum = p.rating_sum - d.rating_sum,
+        average_rating = CASE WHEN p.review_count > d.review_count
+            THEN (p.rating_sum - d.rating_sum)::float8 / (p.review_count - d.review_count) ELSE 0.0 END,
+        rating_count_1 = p.rating_count_1 - d.rating_count_1,
+        rating_count_2 = p.rating_count_2 - d.rating_count_2,
+        rating_count_3 = p.rating_count_3 - d.rating_count_3,
+        rating_count_4 = p.rating_count_4 - d.rating_count_4,
+        rating_count_5 = p.rating_count_5 - d.rating_count_5
+    FROM delta d
+    WHERE p.id = d.product_id
+"""
+
+
+def upgrade():
+    op.execute(DEDUPLICATE)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_reviews_user_product', 'reviews', ['user_id', 'product_id'], unique=True,
+                        postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade():
+    # Удалённые повторы не восстанавливаются
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_reviews_user_product', table_name='reviews', postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,35 @@
+"""rating deltas
+
+Очередь приращений агрегатов отзывов для RATING_AGGREGATION=deferred (src/rating_aggregator.py).
+
+Revision ID: 0011
+Revises: 0010
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rating_deltas',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('review_count', sa.Integer(), nullable=False),
+    sa.Column('rating_sum', sa.Integer(), nullable=False),
+    sa.Column('rating_count_1', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rating_count_2', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rating_count_3', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rating_count_4', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('rating_count_5', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    # Неприменённые приращения теряются: перед откатом выполните flask aggregate-ratings --once
+    op.drop_table('rating_deltas')
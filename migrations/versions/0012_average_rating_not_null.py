@@ -0,0 +1,31 @@
+"""average rating not null
+
+products.average_rating получает server_default и NOT NULL: строки, вставленные в обход ORM
+(массовая загрузка до исправления), хранили NULL, и keyset-пагинация по рейтингу их теряла.
+NULL заполняется по агрегатам строки. SET NOT NULL проверяет всю таблицу под ACCESS EXCLUSIVE.
+
+Revision ID: 0012
+Revises: 0011
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        UPDATE products SET average_rating = CASE WHEN review_count > 0
+            THEN rating_sum::float8 / review_count ELSE 0.0 END
+        WHERE average_rating IS NULL
+    """)
+    op.alter_column('products', 'average_rating', existing_type=sa.Float(),
+                    server_default='0', nullable=False)
+
+
+def downgrade():
+    op.alter_column('products', 'average_rating', existing_type=sa.Float(),
+                    server_default=None, nullable=True)
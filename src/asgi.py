@@ -0,0 +1,489 @@
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import anyio.from_thread
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.applications import Starlette
+from starlette import responses
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Route
+from werkzeug.http import http_date, parse_accept_header, parse_date, parse_etags, parse_options_header, quote_etag
+
+from src import (
+    cache, conditional, crud, database, metrics, orders, pagination, product_import, products, schemas, serializers,
+    users,
+)
+
+
+# Асинхронный режим: маршруты на Starlette поверх AsyncSession/asyncpg.
+# Запросы к базе по-прежнему описаны в src/crud.py и выполняются через AsyncSession.run_sync,
+# валидация — src/schemas.py, разбор параметров и сборка ответов — src/products.py, сериализация — src/serializers.py.
+ASYNC_DATABASE_URL = os.environ.get(
+    "ASYNC_DATABASE_URL",
+    make_url(database.DATABASE_URL).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False),
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _connect_args():
+    if database.STATEMENT_TIMEOUT_MS:
+        return {"server_settings": {"statement_timeout": str(database.STATEMENT_TIMEOUT_MS)}}
+    return {}
+
+
+def make_async_engine(url: str = ASYNC_DATABASE_URL):
+    # Те же настройки пула, что и у синхронного движка: пул живёт в каждом воркере
+    return create_async_engine(
+        url,
+        pool_size=database.POOL_SIZE,
+        max_overflow=database.MAX_OVERFLOW,
+        pool_timeout=database.POOL_TIMEOUT,
+        pool_recycle=database.POOL_RECYCLE,
+        pool_pre_ping=database.POOL_PRE_PING,
+        connect_args=_connect_args(),
+    )
+
+
+class JSONResponse(responses.JSONResponse):
+    # Тело кодирует src/serializers.py (orjson, если установлен) — как и во Flask-приложении
+    def render(self, content) -> bytes:
+        with metrics.timed("serialize"):
+            return serializers.dumps(content)
+
+
+async def run_in_session(request, fn, *args):
+    # Сессия на вызов: fn получает синхронную Session, как и во Flask-маршрутах
+    async with request.app.state.session_factory() as session:
+        return await session.run_sync(fn, *args)
+
+
+# Экспорт и импорт идут через синхронную Session (psycopg2) в потоках пула Starlette:
+# COPY и серверный курсор есть только у psycopg2
+
+def _sync_session_call(session_factory, fn, *args):
+    db = session_factory()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+def _sync_session_chunks(session_factory, fn, *args):
+    db = session_factory()
+    try:
+        yield from fn(db, *args)
+    finally:
+        db.close()
+
+
+class _BodyReader:
+    # Тело запроса для синхронных парсеров: читается из потока пула, куски забираются у event loop
+    def __init__(self, request):
+        self._chunks = request.stream()
+        self._pending = b""
+
+    def read(self, size=-1):
+        while not self._pending:
+            try:
+                self._pending = anyio.from_thread.run(self._chunks.__anext__)
+            except StopAsyncIteration:
+                return b""
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def _validators(request):
+    return (
+        parse_etags(request.headers.get("if-none-match")),
+        parse_date(request.headers.get("if-modified-since")),
+    )
+
+def _is_conditional(validators):
+    if_none_match, if_modified_since = validators
+    return bool(if_none_match) or if_modified_since is not None
+
+def _respond(entry, validators):
+    headers = {"ETag": quote_etag(entry["etag"]), **entry.get("headers", {})}
+    if entry["last_modified"]:
+        headers["Last-Modified"] = http_date(datetime.fromisoformat(entry["last_modified"]))
+    if conditional.not_modified(entry, *validators):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(entry["body"], headers=headers)
+
+def _check_versions(versions, validators, collection=False):
+    # Дешёвая проверка до загрузки данных: ответ 304 или None, если нужно строить тело
+    entry = conditional.make_entry(None, versions, collection=collection)
+    if conditional.not_modified(entry, *validators):
+        return _respond(entry, validators)
+    return None
+
+
+async def create_product_route(request):
+    data = schemas.validate_product(await request.json())
+    product = await run_in_session(request, crud.create_product, data)
+    cache.invalidate_product(cache=request.app.state.cache)
+    return JSONResponse(serializers.product_fields(product), status_code=201)
+
+async def read_products_route(request):
+    params = products.products_list_params(request.query_params)
+    response_cache = request.app.state.cache
+    key = cache.products_list_key(params, response_cache)
+    entry = response_cache.get(key)
+    validators = _validators(request)
+    if entry is None:
+        if _is_conditional(validators):
+            versions = await run_in_session(request, products.products_page_versions, params)
+            not_modified = _check_versions(versions, validators, collection=True)
+            if not_modified:
+                return not_modified
+        entry = await run_in_session(request, products.products_page, params)
+        response_cache.set(key, entry)
+    return _respond(entry, validators)
+
+async def bulk_import_products_route(request):
+    import_format = products.BULK_FORMATS.get(parse_options_header(request.headers.get("content-type"))[0])
+    if import_format is None:
+        return JSONResponse({"error": products.BULK_FORMAT_ERROR}, status_code=415)
+    rows = product_import.PARSERS[import_format](_BodyReader(request))
+    result = await run_in_threadpool(
+        _sync_session_call, request.app.state.sync_session_factory, product_import.import_products, rows)
+    cache.invalidate_products(result.pop("updated_ids"), cache=request.app.state.cache)
+    return JSONResponse(result)
+
+async def export_products_route(request):
+    export_format = products.export_format_param(request.query_params)
+    use_gzip = parse_accept_header(request.headers.get("accept-encoding"))["gzip"] > 0
+    # Синхронный генератор StreamingResponse перебирает в потоке пула
+    chunks = _sync_session_chunks(
+        request.app.state.sync_session_factory, products.export_chunks, export_format,
+        request.query_params.get("category"), lambda record: serializers.dumps(record).decode(), use_gzip)
+    headers = {"Vary": "Accept-Encoding"}
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(chunks, media_type=products.EXPORT_MIMETYPES[export_format], headers=headers)
+
+async def search_products_route(request):
+    params = products.search_params(request.query_params)
+    return JSONResponse(await run_in_session(request, products.search_results, params))
+
+async def leaderboard_route(request):
+    params = products.leaderboard_params(request.query_params)
+    response_cache = request.app.state.cache
+    key = cache.leaderboard_key(params, response_cache)
+    body = response_cache.get(key)
+    if body is None:
+        body = await run_in_session(request, products.leaderboard, params)
+        response_cache.set(key, body)
+    return JSONResponse(body)
+
+async def read_product_route(request):
+    product_id = request.path_params["product_id"]
+    response_cache = request.app.state.cache
+    key = cache.product_key(product_id, response_cache)
+    entry = response_cache.get(key)
+    validators = _validators(request)
+    if entry is None:
+        if _is_conditional(validators):
+            versions = await run_in_session(request, crud.get_product_versions, product_id)
+            not_modified = versions and _check_versions(versions, validators)
+            if not_modified:
+                return not_modified
+        entry = await run_in_session(request, products.product_entry, product_id)
+        if entry is None:
+            return JSONResponse({"error": "Product not found"}, status_code=404)
+        response_cache.set(key, entry)
+    return _respond(entry, validators)
+
+async def update_product_route(request):
+    product_id = request.path_params["product_id"]
+    data = schemas.validate_product(await request.json())
+    product = await run_in_session(request, crud.update_product, product_id, data)
+    if not product:
+        return JSONResponse({"error": "Product not found"}, status_code=404)
+    cache.invalidate_product(product_id, cache=request.app.state.cache)
+    return JSONResponse(serializers.product_fields(product))
+
+async def delete_product_route(request):
+    product_id = request.path_params["product_id"]
+    product = await run_in_session(request, crud.delete_product, product_id)
+    if not product:
+        return JSONResponse({"error": "Product not found"}, status_code=404)
+    cache.invalidate_product(product_id, cache=request.app.state.cache)
+    return JSONResponse({"message": "Product deleted"})
+
+async def create_review_route(request):
+    product_id = request.path_params["product_id"]
+    data = schemas.validate_review(await request.json())
+    data["product_id"] = product_id
+    review, created = await run_in_session(request, crud.create_review, data)
+    cache.invalidate_product(product_id, cache=request.app.state.cache)
+    return JSONResponse({**serializers.review_to_dict(review), "product_id": review.product_id},
+                        status_code=201 if created else 200)
+
+async def update_review_route(request):
+    product_id, review_id = request.path_params["product_id"], request.path_params["review_id"]
+    data = schemas.validate_review_update(await request.json())
+    review = await run_in_session(request, crud.update_review, product_id, review_id, data)
+    if review is None:
+        return JSONResponse({"error": "Review not found"}, status_code=404)
+    cache.invalidate_product(product_id, cache=request.app.state.cache)
+    return JSONResponse({**serializers.review_to_dict(review), "product_id": review.product_id})
+
+async def delete_review_route(request):
+    product_id, review_id = request.path_params["product_id"], request.path_params["review_id"]
+    if not await run_in_session(request, crud.delete_review, product_id, review_id):
+        return JSONResponse({"error": "Review not found"}, status_code=404)
+    cache.invalidate_product(product_id, cache=request.app.state.cache)
+    return JSONResponse({"message": "Review deleted"})
+
+async def get_reviews_route(request):
+    product_id = request.path_params["product_id"]
+    params = products.reviews_list_params(request.query_params)
+    validators = _validators(request)
+    if _is_conditional(validators):
+        versions = await run_in_session(request, products.reviews_page_versions, product_id, params)
+        not_modified = _check_versions(versions, validators, collection=True)
+        if not_modified:
+            return not_modified
+    entry = await run_in_session(request, products.reviews_page, product_id, params)
+    return _respond(entry, validators)
+
+async def get_review_stats_route(request):
+    product_id = request.path_params["product_id"]
+    validators = _validators(request)
+    if _is_conditional(validators):
+        versions = await run_in_session(request, crud.get_product_versions, product_id)
+        not_modified = versions and _check_versions([("product", v) for _, v in versions], validators)
+        if not_modified:
+            return not_modified
+    entry = await run_in_session(request, products.review_stats_entry, product_id)
+    if entry is None:
+        return JSONResponse({"error": "Product not found"}, status_code=404)
+    return _respond(entry, validators)
+
+async def create_order_route(request):
+    data = schemas.validate_order(await request.json())
+    order = await run_in_session(request, crud.create_order, data)
+    return JSONResponse(serializers.order_to_dict(order), status_code=201)
+
+async def create_orders_batch_route(request):
+    data = schemas.validate_order_batch(await request.json())
+    order_ids = await run_in_session(request, crud.create_orders, data["orders"])
+    return JSONResponse({
+        "created": len(order_ids),
+        "order_ids": order_ids
+    }, status_code=201)
+
+async def transition_orders_route(request):
+    status, order_ids = schemas.validate_status_batch(await request.json())
+    updated = set(await run_in_session(request, crud.transition_orders, order_ids, status))
+    # Пропущенные — несуществующие заказы и заказы, для которых переход недопустим
+    return JSONResponse({
+        "status": status,
+        "updated": [order_id for order_id in order_ids if order_id in updated],
+        "skipped": [order_id for order_id in order_ids if order_id not in updated]
+    })
+
+async def transition_order_route(request):
+    order_id = request.path_params["order_id"]
+    status = schemas.validate_status_change(await request.json())["status"]
+    if await run_in_session(request, crud.transition_order, order_id, status) is None:
+        return JSONResponse({"error": "Order not found"}, status_code=404)
+    return JSONResponse({"id": order_id, "status": status})
+
+async def get_order_route(request):
+    order = await run_in_session(request, crud.get_order, request.path_params["order_id"])
+    if not order:
+        return JSONResponse({"error": "Order not found"}, status_code=404)
+    return JSONResponse(serializers.order_with_total(order))
+
+async def get_user_orders_route(request):
+    params = orders.user_orders_params(request.query_params)
+    page = await run_in_session(request, orders.user_orders_page, request.path_params["user_id"], params)
+    return JSONResponse(page)
+
+async def add_favorite_route(request):
+    user_id = request.path_params["user_id"]
+    data = schemas.validate_favorite(await request.json())
+    favorite_id, created = await run_in_session(request, crud.add_favorite, user_id, data["product_id"])
+    if created:
+        cache.invalidate_favorites(cache=request.app.state.cache)
+    return JSONResponse({
+        "id": favorite_id,
+        "user_id": user_id,
+        "product_id": data["product_id"]
+    }, status_code=201 if created else 200)
+
+async def add_favorites_bulk_route(request):
+    product_ids = schemas.validate_favorite_batch(await request.json())
+    added = await run_in_session(request, crud.add_favorites, request.path_params["user_id"], product_ids)
+    if added:
+        cache.invalidate_favorites(cache=request.app.state.cache)
+    # Порядок как в запросе; уже добавленные и несуществующие товары пропускаются
+    return JSONResponse({"added": [pid for pid in product_ids if pid in added]})
+
+async def remove_favorites_bulk_route(request):
+    product_ids = schemas.validate_favorite_batch(await request.json())
+    removed = set(await run_in_session(request, crud.remove_favorites, request.path_params["user_id"], product_ids))
+    if removed:
+        cache.invalidate_favorites(cache=request.app.state.cache)
+    return JSONResponse({"removed": [pid for pid in product_ids if pid in removed]})
+
+async def check_favorites_route(request):
+    product_ids = users.favorites_check_params(request.query_params)
+    favorited = await run_in_session(request, crud.get_favorited_product_ids, request.path_params["user_id"],
+                                     product_ids)
+    return JSONResponse({"favorited": {str(pid): pid in favorited for pid in product_ids}})
+
+async def remove_favorite_route(request):
+    user_id, product_id = request.path_params["user_id"], request.path_params["product_id"]
+    if not await run_in_session(request, crud.remove_favorite, user_id, product_id):
+        return JSONResponse({"error": "Favorite not found"}, status_code=404)
+    cache.invalidate_favorites(cache=request.app.state.cache)
+    return JSONResponse({"message": "Favorite removed"})
+
+async def get_favorites_route(request):
+    params = users.favorites_params(request.query_params)
+    items, next_cursor = await run_in_session(request, users.favorites_page, request.path_params["user_id"], params)
+    if params["cursor"] is None:
+        return JSONResponse(items, headers=pagination.next_cursor_header(next_cursor))
+    return JSONResponse({"items": items, "next_cursor": next_cursor})
+
+async def db_health_route(request):
+    # pool — синхронный пул (экспорт и импорт), async_pool — пул asyncpg остальных маршрутов
+    health = {"pool": database.pool_metrics()}
+    if request.app.state.engine is not None:
+        health["async_pool"] = database.pool_status(request.app.state.engine.pool)
+    return JSONResponse(health)
+
+async def cache_health_route(request):
+    return JSONResponse({"cache": request.app.state.cache.stats})
+
+async def metrics_route(request):
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def handle_value_error(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+async def handle_conflict(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=409)
+
+async def handle_exception(request, exc):
+    # Текст исключения может раскрыть SQL и параметры запроса: клиенту — общее сообщение, подробности — в лог
+    logger.exception("Unhandled error in %s %s", request.method, request.url.path, exc_info=exc)
+    return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+routes = [
+    Route("/products/", create_product_route, methods=["POST"]),
+    Route("/products/bulk", bulk_import_products_route, methods=["POST"]),
+    Route("/products/", read_products_route, methods=["GET"]),
+    Route("/products/export", export_products_route, methods=["GET"]),
+    Route("/products/search", search_products_route, methods=["GET"]),
+    Route("/products/leaderboard", leaderboard_route, methods=["GET"]),
+    Route("/products/{product_id:int}", read_product_route, methods=["GET"]),
+    Route("/products/{product_id:int}", update_product_route, methods=["PUT"]),
+    Route("/products/{product_id:int}", delete_product_route, methods=["DELETE"]),
+    Route("/products/{product_id:int}/reviews/", create_review_route, methods=["POST"]),
+    Route("/products/{product_id:int}/reviews/", get_reviews_route, methods=["GET"]),
+    Route("/products/{product_id:int}/reviews/stats", get_review_stats_route, methods=["GET"]),
+    Route("/products/{product_id:int}/reviews/{review_id:int}", update_review_route, methods=["PUT"]),
+    Route("/products/{product_id:int}/reviews/{review_id:int}", delete_review_route, methods=["DELETE"]),
+    Route("/orders/", create_order_route, methods=["POST"]),
+    Route("/orders/batch", create_orders_batch_route, methods=["POST"]),
+    Route("/orders/status", transition_orders_route, methods=["POST"]),
+    Route("/orders/{order_id:int}/status", transition_order_route, methods=["PUT"]),
+    Route("/orders/{order_id:int}", get_order_route, methods=["GET"]),
+    Route("/users/{user_id:int}/orders", get_user_orders_route, methods=["GET"]),
+    Route("/users/{user_id:int}/favorites/", add_favorite_route, methods=["POST"]),
+    Route("/users/{user_id:int}/favorites/bulk", add_favorites_bulk_route, methods=["POST"]),
+    Route("/users/{user_id:int}/favorites/bulk", remove_favorites_bulk_route, methods=["DELETE"]),
+    Route("/users/{user_id:int}/favorites/check", check_favorites_route, methods=["GET"]),
+    Route("/users/{user_id:int}/favorites/{product_id:int}", remove_favorite_route, methods=["DELETE"]),
+    Route("/users/{user_id:int}/favorites/", get_favorites_route, methods=["GET"]),
+    Route("/health/db", db_health_route, methods=["GET"]),
+    Route("/health/cache", cache_health_route, methods=["GET"]),
+    Route("/metrics", metrics_route, methods=["GET"]),
+]
+
+
+def _route_path(scope):
+    for route in routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    # То же, что metrics.init_app во Flask-приложении: счётчики запроса лежат в contextvar,
+    # и слушатели SQLAlchemy видят их внутри run_sync
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = metrics.new_request_stats()
+        token = metrics.asgi_request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["Server-Timing"] = metrics.server_timing(stats, time.perf_counter() - started)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            metrics.asgi_request_stats.reset(token)
+            route = _route_path(scope)
+            if route != "/metrics":
+                metrics.registry.record(scope["method"], route, status, stats, time.perf_counter() - started)
+
+
+def create_app(session_factory=None, response_cache=None, sync_session_factory=None):
+    engine = None
+    if session_factory is None:
+        engine = make_async_engine()
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        if engine is not None:
+            await engine.dispose()
+
+    app = Starlette(
+        routes=routes,
+        middleware=[Middleware(MetricsMiddleware)],
+        exception_handlers={
+            crud.InsufficientStock: handle_conflict,
+            crud.InvalidTransition: handle_conflict,
+            ValueError: handle_value_error,
+            Exception: handle_exception,
+        },
+        lifespan=lifespan,
+    )
+    app.state.engine = engine
+    app.state.session_factory = session_factory
+    app.state.sync_session_factory = sync_session_factory or database.SessionLocal
+    app.state.cache = response_cache if response_cache is not None else cache.make_cache()
+    return app
+
+
+app = create_app()
@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "auto")
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 30))
+CACHE_MAXSIZE = int(os.environ.get("CACHE_MAXSIZE", 1024))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Число процессов приложения: gunicorn.conf.py выставляет его по workers, uvicorn сам читает WEB_CONCURRENCY
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = CACHE_MAXSIZE, ttl: int = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[1] < time.monotonic():
+                del self._items[key]
+                self.stats["evictions"] += 1
+                item = None
+            if item is None:
+                self.stats["misses"] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats["hits"] += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + self.ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def generation(self, name):
+        with self._lock:
+            return self._generations.get(name, 0)
+
+    def bump(self, *names):
+        with self._lock:
+            for name in names:
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+
+class RedisCache:
+    # Подходит любой клиент с протоколом redis-py: get/set(ex=)/delete/pipeline(incr, expire)
+    def __init__(self, client, ttl: int = CACHE_TTL, prefix: str = "marketplace:"):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self._count("misses")
+            return None
+        self._count("hits")
+        return json.loads(raw)
+
+    def set(self, key, value):
+        self.client.set(self.prefix + key, json.dumps(value), ex=self.ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def generation(self, name):
+        return int(self.client.get(self.prefix + "gen:" + name) or 0)
+
+    def bump(self, *names):
+        # Один round trip на пачку: массовая загрузка и воркер рейтингов сбрасывают тысячи товаров.
+        # Счётчик поколения живёт 10 × ttl: после его истечения записи под старыми номерами
+        # давно вытеснены, и отсчёт с нуля ничего устаревшего не открывает
+        pipeline = self.client.pipeline(transaction=False)
+        for name in names:
+            pipeline.incr(self.prefix + "gen:" + name)
+            pipeline.expire(self.prefix + "gen:" + name, self.ttl * 10)
+        pipeline.execute()
+
+
+class NullCache:
+    def __init__(self):
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        self.stats["misses"] += 1
+        return None
+
+    def set(self, key, value):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def generation(self, name):
+        return 0
+
+    def bump(self, *names):
+        pass
+
+
+def make_cache(backend: str = CACHE_BACKEND, processes: int = WEB_CONCURRENCY):
+    if backend == "auto":
+        backend = "redis" if "REDIS_URL" in os.environ else "memory" if processes <= 1 else "none"
+    if backend == "memory":
+        # Сброс LRU доходит только до процесса, обработавшего запись: остальные воркеры
+        # отдавали бы устаревшие товары и рейтинги до CACHE_TTL
+        if processes > 1:
+            raise ValueError("CACHE_BACKEND=memory serves stale data with several workers; use redis or none")
+        return LRUCache()
+    if backend == "redis":
+        import redis  # опциональная зависимость, нужна только для CACHE_BACKEND=redis
+        return RedisCache(redis.Redis.from_url(REDIS_URL))
+    if backend == "none":
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_BACKEND '{backend}'")
+
+
+def init_app(app, cache=None):
+    app.extensions["response_cache"] = cache if cache is not None else make_cache()
+
+def get_cache():
+    return current_app.extensions["response_cache"]
+
+
+# Явный cache нужен ASGI-приложению, у которого нет current_app
+
+def _product_generation(product_id: int):
+    return f"product:{product_id}"
+
+def product_key(product_id: int, cache=None):
+    # Своё поколение у каждого товара: запись сбрасывает только его карточку. Поколение читается
+    # до запроса к базе: ответ, собранный до записи и положенный в кэш после её сброса,
+    # попадает под старое поколение и уже не отдаётся
+    cache = cache or get_cache()
+    return f"product:{product_id}:{cache.generation(_product_generation(product_id))}"
+
+def products_list_key(params: dict, cache=None):
+    # Поколение списков в ключе: любое изменение каталога делает все закэшированные страницы недостижимыми
+    cache = cache or get_cache()
+    normalized = "&".join(f"{name}={value}" for name, value in sorted(params.items()) if value is not None)
+    return f"products:{cache.generation('products')}:{normalized}"
+
+def leaderboard_key(params: dict, cache=None):
+    # Лидерборд зависит ещё и от favorite_count, который не меняет поколение каталога
+    cache = cache or get_cache()
+    return products_list_key({"view": "leaderboard", "favorites": cache.generation("favorites"), **params}, cache)
+
+def invalidate_product(product_id: int = None, cache=None):
+    invalidate_products([] if product_id is None else [product_id], cache)
+
+def invalidate_favorites(cache=None):
+    cache = cache or get_cache()
+    cache.bump("favorites")
+
+def invalidate_products(product_ids, cache=None):
+    cache = cache or get_cache()
+    cache.bump("products", *(_product_generation(product_id) for product_id in product_ids))
@@ -0,0 +1,76 @@
+import click
+from src import cache, crud, fulfillment, product_import, rating_aggregator
+from src.database import SessionLocal
+
+
+def register_commands(app):
+    @app.cli.command("reconcile-ratings")
+    @click.option("--product-id", type=int, default=None, help="Пересчитать только один товар")
+    def reconcile_ratings_command(product_id):
+        """Пересобрать review_count/rating_sum/average_rating по таблице reviews."""
+        db = SessionLocal()
+        try:
+            repaired = crud.reconcile_product_ratings(db, product_id)
+        finally:
+            db.close()
+        click.echo(f"Repaired rating aggregates for {repaired} product(s)")
+
+    @app.cli.command("reconcile-favorites")
+    @click.option("--product-id", type=int, default=None, help="Пересчитать только один товар")
+    def reconcile_favorites_command(product_id):
+        """Пересобрать favorite_count по таблице favorites."""
+        db = SessionLocal()
+        try:
+            repaired = crud.reconcile_favorite_counts(db, product_id)
+        finally:
+            db.close()
+        click.echo(f"Repaired favorite counts for {repaired} product(s)")
+
+    @app.cli.command("import-products")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--format", "import_format", type=click.Choice(product_import.FORMATS), default=None,
+                  help="Формат файла; по умолчанию определяется по расширению")
+    def import_products_command(path, import_format):
+        """Загрузить товары из JSON/NDJSON/CSV через COPY с upsert по sku."""
+        import_format = import_format or path.rsplit(".", 1)[-1].lower()
+        if import_format not in product_import.FORMATS:
+            raise click.UsageError("Cannot detect format, pass --format")
+        db = SessionLocal()
+        try:
+            with open(path, "rb") as stream:
+                result = product_import.import_products(db, product_import.PARSERS[import_format](stream))
+        finally:
+            db.close()
+        # Имеет смысл для общего кэша (CACHE_BACKEND=redis); LRU воркеров истечёт по TTL
+        cache.invalidate_products(result["updated_ids"])
+        for error in result["errors"]:
+            click.echo(f"row {error['row']}: {error['error']}", err=True)
+        click.echo(f"Inserted {result['inserted']}, updated {result['updated']}, failed {result['failed']}")
+
+    @app.cli.command("fulfill-orders")
+    @click.option("--batch-size", type=int, default=100, show_default=True, help="Заказов за одну транзакцию")
+    @click.option("--poll-interval", type=float, default=1.0, show_default=True,
+                  help="Пауза при пустой очереди, сек")
+    @click.option("--once", is_flag=True, help="Выйти, когда очередь опустеет")
+    def fulfill_orders_command(batch_size, poll_interval, once):
+        """Воркер выполнения заказов: забирает новые заказы через FOR UPDATE SKIP LOCKED.
+
+        Можно запускать несколько процессов параллельно — они не берут одни и те же заказы.
+        """
+        processed = fulfillment.run_worker(SessionLocal, batch_size=batch_size, poll_interval=poll_interval, once=once)
+        click.echo(f"Fulfilled {processed} order(s)")
+
+    @app.cli.command("aggregate-ratings")
+    @click.option("--batch-size", type=int, default=10000, show_default=True, help="Приращений за одну транзакцию")
+    @click.option("--max-staleness", type=float, default=rating_aggregator.RATING_MAX_STALENESS, show_default=True,
+                  help="Пауза при пустой очереди, сек — максимальное отставание агрегатов")
+    @click.option("--once", is_flag=True, help="Выйти, когда очередь опустеет")
+    def aggregate_ratings_command(batch_size, max_staleness, once):
+        """Воркер RATING_AGGREGATION=deferred: сводит rating_deltas в агрегаты товаров пачками.
+
+        Каждый товар пачки обновляется одним UPDATE, сколько бы отзывов на него ни пришло.
+        Ответы API обновятся сразу только с общим кэшем (CACHE_BACKEND=redis); с memory — через CACHE_TTL.
+        """
+        applied = rating_aggregator.run_worker(SessionLocal, batch_size=batch_size, max_staleness=max_staleness,
+                                               once=once)
+        click.echo(f"Applied {applied} rating delta(s)")
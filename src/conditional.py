@@ -0,0 +1,57 @@
+import hashlib
+from datetime import datetime
+
+from flask import Response, jsonify, request
+
+
+def make_entry(body, versions, headers=None, collection=False):
+    # versions — пары (id, updated_at) строк, из которых собран ответ; headers — доп. заголовки ответа.
+    # У списков Last-Modified нет: удаление строки или сдвиг страницы не меняют максимум updated_at,
+    # и If-Modified-Since дал бы устаревший 304. Они проверяются только по ETag, куда входят id строк
+    digest = hashlib.sha1()
+    last_modified = None
+    for row_id, updated_at in versions:
+        digest.update(f"{row_id}:{updated_at.isoformat() if updated_at else ''};".encode())
+        if updated_at and (last_modified is None or updated_at > last_modified):
+            last_modified = updated_at
+    entry = {
+        "body": body,
+        "etag": digest.hexdigest(),
+        "last_modified": last_modified.isoformat() if last_modified and not collection else None,
+    }
+    if headers:
+        entry["headers"] = headers
+    return entry
+
+def is_conditional():
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+def not_modified(entry, if_none_match, if_modified_since):
+    # If-None-Match имеет приоритет над If-Modified-Since (RFC 9110, 13.2.2)
+    if if_none_match:
+        return if_none_match.contains_weak(entry["etag"])
+    if if_modified_since is not None and entry["last_modified"]:
+        modified = datetime.fromisoformat(entry["last_modified"]).replace(microsecond=0)
+        return modified <= if_modified_since
+    return False
+
+def is_not_modified(entry):
+    return not_modified(entry, request.if_none_match, request.if_modified_since)
+
+def respond(entry):
+    if is_not_modified(entry):
+        response = Response(status=304)
+    else:
+        response = jsonify(entry["body"])
+    response.set_etag(entry["etag"])
+    response.headers.update(entry.get("headers", {}))
+    if entry["last_modified"]:
+        response.last_modified = datetime.fromisoformat(entry["last_modified"])
+    return response
+
+def check_versions(versions, collection=False):
+    # Дешёвая проверка до загрузки данных: ответ 304 или None, если нужно строить тело
+    entry = make_entry(None, versions, collection=collection)
+    if is_not_modified(entry):
+        return respond(entry)
+    return None
@@ -1,5 +1,56 @@
-from sqlalchemy.orm import Session
+import os
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import Float, Integer, case, cast, column, delete, exists, func, insert, literal, or_, select, text, tuple_, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, selectinload, undefer
+from sqlalchemy.orm.attributes import set_committed_value
 from src import models
+from src.pagination import decode_cursor
+
+PRODUCT_SORT_COLUMNS = {
+    "id": models.Product.id,
+    "price": models.Product.price,
+    "average_rating": models.Product.average_rating,
+}
+
+REVIEW_SORT_COLUMNS = {
+    "created_at": models.Review.created_at,
+    "rating": models.Review.rating,
+}
+
+RATING_VALUES = range(1, 6)
+
+# sync — агрегаты отзывов товара обновляются в транзакции отзыва; deferred — транзакция отзыва только
+# дописывает приращение в rating_deltas, а товар обновляет воркер `flask aggregate-ratings`
+RATING_AGGREGATION_MODES = ("sync", "deferred")
+
+
+def _rating_aggregation(mode: str):
+    # Опечатка в режиме молча включала бы sync: падаем при старте, как make_cache
+    if mode not in RATING_AGGREGATION_MODES:
+        raise ValueError(f"Unknown RATING_AGGREGATION '{mode}'")
+    return mode
+
+RATING_AGGREGATION = _rating_aggregation(os.environ.get("RATING_AGGREGATION", "sync"))
+
+FAVORITES_SORT_KEY = "favorited:desc"
+
+ORDERS_SORT_KEY = "order_date:desc"
+
+# processing -> new: возврат заказа в очередь
+ORDER_TRANSITIONS = {
+    "new": ("processing",),
+    "processing": ("done", "new"),
+    "done": (),
+}
+
+# «Лучшие по рейтингу» сортируются по байесовской оценке: товары с парой отзывов не вытесняют популярные
+LEADERBOARD_COLUMNS = {
+    "favorites": models.Product.favorite_count,
+    "rating": models.Product.weighted_rating,
+}
 
 
 def create_product(db: Session, product: dict):
@@ -9,15 +60,103 @@ def create_product(db: Session, product: dict):
     db.refresh(db_product)
     return db_product
 
-def get_products(db: Session, skip: int = 0, limit: int = 10, category: str = None):
+def _products_query(db: Session, skip: int, limit: int, category: str, sort_by: str, order: str, cursor: str):
+    if sort_by not in PRODUCT_SORT_COLUMNS:
+        raise ValueError(f"Unsupported sort field '{sort_by}'")
+    if order not in ("asc", "desc"):
+        raise ValueError("Order must be 'asc' or 'desc'")
+    sort_column = PRODUCT_SORT_COLUMNS[sort_by]
     query = db.query(models.Product)
     if category:
         query = query.filter(models.Product.category == category)
-    return query.offset(skip).limit(limit).all()
+    if cursor:
+        # Keyset-пагинация: продолжаем сразу после последней строки предыдущей страницы
+        value, last_id = decode_cursor(cursor, f"{sort_by}:{order}", sort_column.type.python_type)
+        if sort_by == "id":
+            key, bound = models.Product.id, last_id
+        else:
+            key, bound = tuple_(sort_column, models.Product.id), tuple_(value, last_id)
+        query = query.filter(key < bound if order == "desc" else key > bound)
+    columns = [sort_column] if sort_by == "id" else [sort_column, models.Product.id]
+    query = query.order_by(*(c.desc() if order == "desc" else c.asc() for c in columns))
+    if not cursor:
+        query = query.offset(skip)
+    return query.limit(limit)
+
+def get_products(db: Session, skip: int = 0, limit: int = 10, category: str = None,
+                 sort_by: str = "id", order: str = "asc", cursor: str = None):
+    # Строки Row вместо ORM-объектов: без identity map и отслеживания изменений на каждый товар
+    query = _products_query(db, skip, limit, category, sort_by, order, cursor)
+    return query.with_entities(*_product_columns(), models.Product.updated_at).all()
+
+def get_products_versions(db: Session, skip: int = 0, limit: int = 10, category: str = None,
+                          sort_by: str = "id", order: str = "asc", cursor: str = None):
+    # Только (id, updated_at) той же страницы — для ETag без загрузки самих товаров
+    query = _products_query(db, skip, limit, category, sort_by, order, cursor)
+    return query.with_entities(models.Product.id, models.Product.updated_at).all()
+
+def _product_columns():
+    product = models.Product
+    return (product.id, product.name, product.description, product.price, product.category,
+            product.average_rating)
+
+def stream_products(db: Session, category: str = None, batch_size: int = 1000):
+    # yield_per включает серверный курсор: строки приходят пачками, память не растёт с каталогом
+    product = models.Product
+    statement = select(*_product_columns()).order_by(product.id)
+    if category:
+        statement = statement.where(product.category == category)
+    return db.execute(statement.execution_options(yield_per=batch_size))
+
+def search_products(db: Session, q: str = None, category: str = None, min_price: float = None,
+                    max_price: float = None, min_rating: float = None, sort_by: str = "relevance",
+                    order: str = "desc", limit: int = 20, skip: int = 0):
+    product = models.Product
+    if sort_by not in ("relevance", "price", "rating"):
+        raise ValueError(f"Unsupported sort field '{sort_by}'")
+    if order not in ("asc", "desc"):
+        raise ValueError("Order must be 'asc' or 'desc'")
+    filters = []
+    rank = None
+    if q:
+        tsquery = func.websearch_to_tsquery("simple", q)
+        filters.append(product.search_vector.op("@@")(tsquery))
+        rank = func.ts_rank_cd(product.search_vector, tsquery)
+    if min_price is not None:
+        filters.append(product.price >= min_price)
+    if max_price is not None:
+        filters.append(product.price <= max_price)
+    if min_rating is not None:
+        filters.append(product.average_rating >= min_rating)
+
+    # Фасеты считаются по всем фильтрам, кроме самой категории — одним GROUP BY
+    facets = dict(db.execute(
+        select(product.category, func.count()).where(*filters).group_by(product.category)
+    ).all())
+
+    if sort_by == "relevance" and rank is None:
+        sort_by = "id"
+    sort_column = {"relevance": rank, "price": product.price, "rating": product.weighted_rating,
+                   "id": product.id}[sort_by]
+    statement = select(*_product_columns()).where(*filters)
+    if category:
+        statement = statement.where(product.category == category)
+    columns = [product.id] if sort_by == "id" else [sort_column, product.id]
+    statement = statement.order_by(*(c.desc() if order == "desc" else c.asc() for c in columns))
+    items = db.execute(statement.offset(skip).limit(limit)).all()
+    total = facets.get(category, 0) if category else sum(facets.values())
+    return items, total, facets
 
 def get_product(db: Session, product_id: int):
     return db.query(models.Product).filter(models.Product.id == product_id).first()
 
+def get_product_versions(db: Session, product_id: int):
+    return (
+        db.query(models.Product.id, models.Product.updated_at)
+        .filter(models.Product.id == product_id)
+        .all()
+    )
+
 def update_product(db: Session, product_id: int, product: dict):
     db_product = get_product(db, product_id)
     if not db_product:
@@ -36,81 +175,522 @@ def delete_product(db: Session, product_id: int):
     return db_product
 
 def create_order(db: Session, order: dict):
-    db_order = models.Order(user_id=order["user_id"])
-    db.add(db_order)
+    db_order = _insert_orders(db, [order], return_items=True)[0]
     db.commit()
-    db.refresh(db_order)
-
-    for item in order["items"]:
-        db_item = models.OrderItem(
-            order_id=db_order.id,
-            product_id=item["product_id"],
-            quantity=item["quantity"],
-            price=item["price"]
+    return db_order
+
+def create_orders(db: Session, orders: list):
+    db_orders = _insert_orders(db, orders)
+    order_ids = [db_order.id for db_order in db_orders]
+    db.commit()
+    return order_ids
+
+class InsufficientStock(ValueError):
+    pass
+
+class InvalidTransition(ValueError):
+    pass
+
+def _reserve_products(db: Session, orders: list):
+    # Все товары заказа(ов) блокируются одним SELECT ... FOR NO KEY UPDATE в порядке id:
+    # одинаковый порядок захвата исключает взаимоблокировки, а NO KEY не мешает
+    # параллельным вставкам отзывов/избранного, ссылающимся на товар по внешнему ключу
+    quantities = Counter()
+    for order in orders:
+        for item in order["items"]:
+            quantities[item["product_id"]] += item["quantity"]
+    product = models.Product
+    locked = {
+        row.id: row
+        for row in db.execute(
+            select(product.id, product.price, product.stock)
+            .where(product.id.in_(sorted(quantities)))
+            .order_by(product.id)
+            .with_for_update(key_share=True)
+        )
+    }
+    for product_id, quantity in quantities.items():
+        row = locked.get(product_id)
+        if row is None:
+            raise ValueError(f"Product with id {product_id} not found.")
+        # stock IS NULL — остаток не ведётся, продажа без ограничений
+        if row.stock is not None and row.stock < quantity:
+            raise InsufficientStock(f"Insufficient stock for product {product_id}: {row.stock} left")
+    tracked = [(product_id, quantity) for product_id, quantity in quantities.items() if locked[product_id].stock is not None]
+    if tracked:
+        reserved = values(column("id", Integer), column("quantity", Integer), name="reserved").data(tracked)
+        # Остаток не входит в представление товара, поэтому updated_at (ETag) не трогаем
+        db.execute(
+            update(product)
+            .where(product.id == reserved.c.id)
+            .values(stock=product.stock - reserved.c.quantity, updated_at=product.updated_at)
+            .execution_options(synchronize_session=False)
         )
-        db.add(db_item)
+    return {product_id: row.price for product_id, row in locked.items()}
+
+def _insert_orders(db: Session, orders: list, return_items: bool = False):
+    # Заказ и его позиции пишутся в одной транзакции: сначала резерв остатков и цены
+    # из базы, затем flush выдаёт id заказов, а все позиции уходят одним executemany-INSERT
+    try:
+        prices = _reserve_products(db, orders)
+    except ValueError:
+        db.rollback()
+        raise
+    db_orders = [models.Order(user_id=order["user_id"]) for order in orders]
+    db.add_all(db_orders)
+    db.flush()
+    rows = [
+        {
+            "order_id": db_order.id,
+            "product_id": item["product_id"],
+            "quantity": item["quantity"],
+            # Цена фиксируется по товару на момент заказа; цена из запроса не используется
+            "price": prices[item["product_id"]]
+        }
+        for db_order, order in zip(db_orders, orders)
+        for item in order["items"]
+    ]
+    if not return_items:
+        db.execute(insert(models.OrderItem), rows)
+        return db_orders
+    # RETURNING id в том же INSERT: позиции в ответе — сохранённые строки, без повторного SELECT
+    item_ids = db.scalars(insert(models.OrderItem).returning(models.OrderItem.id, sort_by_parameter_order=True), rows)
+    by_order = {db_order.id: [] for db_order in db_orders}
+    for item_id, row in zip(item_ids, rows):
+        by_order[row["order_id"]].append(models.OrderItem(id=item_id, **row))
+    for db_order in db_orders:
+        set_committed_value(db_order, "items", by_order[db_order.id])
+    return db_orders
+
+def _orders_query(db: Session):
+    return db.query(models.Order).options(selectinload(models.Order.items), undefer(models.Order.total))
 
+def get_order(db: Session, order_id: int):
+    return _orders_query(db).filter(models.Order.id == order_id).first()
+
+def get_user_orders(db: Session, user_id: int, limit: int = 20, cursor: str = None):
+    # Страница — два запроса при любом limit: заказы с суммой и одна выборка позиций по IN
+    query = _orders_query(db).filter(models.Order.user_id == user_id)
+    if cursor:
+        value, last_id = decode_cursor(cursor, ORDERS_SORT_KEY, datetime)
+        key = tuple_(models.Order.order_date, models.Order.id)
+        query = query.filter(key < tuple_(value, last_id))
+    return query.order_by(models.Order.order_date.desc(), models.Order.id.desc()).limit(limit).all()
+
+
+def _status_sources(status: str):
+    if status not in models.ORDER_STATUSES:
+        raise ValueError(f"Unknown order status '{status}'")
+    return [source for source, targets in ORDER_TRANSITIONS.items() if status in targets]
+
+def set_orders_status(db: Session, order_ids: list, status: str):
+    # Проверка перехода — в WHERE самого UPDATE: конкурентные изменения статуса не проскочат.
+    # Без commit: вызывающий код может объединить переход с другой работой в одной транзакции
+    return db.scalars(
+        update(models.Order)
+        .where(models.Order.id.in_(order_ids), models.Order.status.in_(_status_sources(status)))
+        .values(status=status)
+        .returning(models.Order.id)
+    ).all()
+
+def transition_orders(db: Session, order_ids: list, status: str):
+    updated = set_orders_status(db, order_ids, status)
     db.commit()
-    return db_order
+    return updated
+
+def transition_order(db: Session, order_id: int, status: str):
+    if transition_orders(db, [order_id], status):
+        return True
+    current = db.scalar(select(models.Order.status).where(models.Order.id == order_id))
+    if current is None:
+        return None
+    raise InvalidTransition(f"Cannot change order status from '{current}' to '{status}'")
+
+def claim_orders(db: Session, batch_size: int):
+    # SKIP LOCKED: параллельные воркеры берут разные заказы и не ждут друг друга.
+    # Строки заблокированы до commit/rollback; при сбое обработчика заказы вернутся в очередь
+    orders = (
+        _orders_query(db)
+        .filter(models.Order.status == "new")
+        .order_by(models.Order.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True, of=models.Order)
+        .all()
+    )
+    if orders:
+        set_orders_status(db, [order.id for order in orders], "processing")
+    return orders
+
 
+def _insert_review(db: Session, review: dict):
+    # INSERT ... SELECT ничего не вставит для несуществующего товара, ON CONFLICT — для повторного отзыва
+    return db.scalar(
+        pg_insert(models.Review)
+        .from_select(
+            ["user_id", "product_id", "rating", "comment", "created_at"],
+            select(literal(review["user_id"], Integer), models.Product.id, literal(review["rating"], Integer),
+                   literal(review.get("comment")), literal(datetime.utcnow()))
+            .where(models.Product.id == review["product_id"])
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "product_id"])
+        .returning(models.Review.id)
+    )
+
+def _update_review(db: Session, condition, values: dict):
+    # UPDATE ... FROM подзапроса с FOR UPDATE возвращает оценку до изменения — прежнее значение
+    # нужно для поправки агрегатов, отдельный SELECT не требуется
+    review = models.Review
+    old = select(review.id, review.rating).where(condition).with_for_update().subquery()
+    return db.execute(
+        update(review)
+        .where(review.id == old.c.id)
+        .values(**values)
+        .returning(review.id, old.c.rating)
+        .execution_options(synchronize_session=False)
+    ).first()
 
 def create_review(db: Session, review: dict):
+    # Один отзыв на пару (пользователь, товар): повторный POST заменяет оценку и комментарий.
+    # Возвращает (отзыв, создан ли новый)
     user = db.query(models.User).filter(models.User.id == review["user_id"]).first()
     if not user:
         raise ValueError(f"User with id {review['user_id']} not found.")
 
-    product = db.query(models.Product).filter(models.Product.id == review["product_id"]).first()
-    if not product:
+    # Второй проход — на случай, если существующий отзыв удалили между INSERT и UPDATE
+    for _ in range(2):
+        review_id = _insert_review(db, review)
+        if review_id is not None:
+            removed = None
+            break
+        updated = _update_review(
+            db,
+            (models.Review.user_id == review["user_id"]) & (models.Review.product_id == review["product_id"]),
+            {"rating": review["rating"], "comment": review.get("comment")},
+        )
+        if updated is not None:
+            review_id, removed = updated
+            break
+    else:
+        db.rollback()
         raise ValueError(f"Product with id {review['product_id']} not found.")
 
-    db_review = models.Review(**review)
-    db.add(db_review)
+    # Агрегаты товара поправляются одним UPDATE в той же транзакции, что и запись отзыва;
+    # повтор с той же оценкой их не меняет
+    if review["rating"] != removed:
+        _record_rating_delta(db, review["product_id"], added=review["rating"], removed=removed)
     db.commit()
-    db.refresh(db_review)
+    return db.get(models.Review, review_id), removed is None
 
-    update_product_rating(db, review["product_id"])
-    return db_review
+def update_review(db: Session, product_id: int, review_id: int, values: dict):
+    review = models.Review
+    updated = _update_review(db, (review.id == review_id) & (review.product_id == product_id), values)
+    if updated is None:
+        return None
+    _, removed = updated
+    if values["rating"] != removed:
+        _record_rating_delta(db, product_id, added=values["rating"], removed=removed)
+    db.commit()
+    return db.get(review, review_id)
+
+def delete_review(db: Session, product_id: int, review_id: int):
+    removed = db.scalar(
+        delete(models.Review)
+        .where(models.Review.id == review_id, models.Review.product_id == product_id)
+        .returning(models.Review.rating)
+    )
+    if removed is None:
+        return False
+    _record_rating_delta(db, product_id, removed=removed)
+    db.commit()
+    return True
 
 
-def get_reviews(db: Session, product_id: int, sort_by: str = "created_at", order: str = "desc"):
+def _reviews_query(db: Session, product_id: int, sort_by: str, order: str, limit: int, cursor: str):
+    if sort_by not in REVIEW_SORT_COLUMNS:
+        raise ValueError(f"Unsupported sort field '{sort_by}'")
+    if order not in ("asc", "desc"):
+        raise ValueError("Order must be 'asc' or 'desc'")
+    sort_column = REVIEW_SORT_COLUMNS[sort_by]
     query = db.query(models.Review).filter(models.Review.product_id == product_id)
-    if sort_by == "rating":
-        query = query.order_by(models.Review.rating.desc() if order == "desc" else models.Review.rating.asc())
+    if cursor:
+        value, last_id = decode_cursor(cursor, f"{sort_by}:{order}", sort_column.type.python_type)
+        key, bound = tuple_(sort_column, models.Review.id), tuple_(value, last_id)
+        query = query.filter(key < bound if order == "desc" else key > bound)
+    if order == "desc":
+        query = query.order_by(sort_column.desc(), models.Review.id.desc())
     else:
-        query = query.order_by(models.Review.created_at.desc() if order == "desc" else models.Review.created_at.asc())
-    return query.all()
-
-def update_product_rating(db: Session, product_id: int):
-    product = db.query(models.Product).filter(models.Product.id == product_id).first()
-    if not product:
-        print(f"[ERROR] Product with id {product_id} not found.")
-        return
-    reviews = db.query(models.Review).filter(models.Review.product_id == product_id).all()
-    if reviews:
-        average_rating = sum(r.rating for r in reviews) / len(reviews)
-        product.average_rating = average_rating
-        db.commit()
-        print(f"[DEBUG] Updated average rating for product {product_id}: {average_rating}")
-    else:
-        print(f"[INFO] No reviews found for product {product_id}, skipping rating update.")
+        query = query.order_by(sort_column.asc(), models.Review.id.asc())
+    return query.limit(limit)
+
+def get_reviews(db: Session, product_id: int, sort_by: str = "created_at", order: str = "desc",
+                limit: int = 50, cursor: str = None):
+    review = models.Review
+    query = _reviews_query(db, product_id, sort_by, order, limit, cursor)
+    return query.with_entities(review.id, review.user_id, review.rating, review.comment, review.created_at,
+                               review.updated_at).all()
+
+def get_reviews_versions(db: Session, product_id: int, sort_by: str = "created_at", order: str = "desc",
+                         limit: int = 50, cursor: str = None):
+    query = _reviews_query(db, product_id, sort_by, order, limit, cursor)
+    return query.with_entities(models.Review.id, models.Review.updated_at).all()
+
+def get_review_summary(db: Session, product_id: int):
+    # Итоги по отзывам читаются из счётчиков товара, а не подсчётом по reviews
+    product = models.Product
+    return (
+        db.query(product.review_count, product.average_rating, product.weighted_rating, product.updated_at,
+                 *(getattr(product, f"rating_count_{r}") for r in RATING_VALUES))
+        .filter(product.id == product_id)
+        .first()
+    )
+
+def _rating_delta(added: int = None, removed: int = None):
+    # added/removed — оценка появившегося и исчезнувшего отзыва; при изменении отзыва заданы обе
+    histogram = Counter()
+    if added is not None:
+        histogram[added] += 1
+    if removed is not None:
+        histogram[removed] -= 1
+    return {
+        "review_count": sum(histogram.values()),
+        "rating_sum": (added or 0) - (removed or 0),
+        **{f"rating_count_{rating}": delta for rating, delta in histogram.items() if delta},
+    }
+
+def _rating_aggregates(review_count, rating_sum, histogram: dict):
+    # Значения для UPDATE products: текущие агрегаты плюс приращения — числа или колонки сводки очереди
+    product = models.Product
+    new_count = product.review_count + review_count
+    new_sum = product.rating_sum + rating_sum
+    return {
+        "review_count": new_count,
+        "rating_sum": new_sum,
+        "average_rating": case((new_count > 0, cast(new_sum, Float) / new_count), else_=0.0),
+        **{name: getattr(product, name) + delta for name, delta in histogram.items()},
+    }
+
+def _apply_rating_delta(db: Session, product_id: int, added: int = None, removed: int = None):
+    delta = _rating_delta(added, removed)
+    review_count, rating_sum = delta.pop("review_count"), delta.pop("rating_sum")
+    updated = db.execute(
+        update(models.Product)
+        .where(models.Product.id == product_id)
+        .values(**_rating_aggregates(review_count, rating_sum, delta))
+        .returning(models.Product.id)
+    ).first()
+    return updated is not None
+
+def _enqueue_rating_delta(db: Session, product_id: int, added: int = None, removed: int = None):
+    # Строку товара не трогаем: приращение сведёт воркер apply_rating_deltas
+    db.execute(insert(models.RatingDelta).values(product_id=product_id, **_rating_delta(added, removed)))
+    return True
+
+def _record_rating_delta(db: Session, product_id: int, added: int = None, removed: int = None):
+    if RATING_AGGREGATION == "deferred":
+        return _enqueue_rating_delta(db, product_id, added, removed)
+    return _apply_rating_delta(db, product_id, added, removed)
+
+def apply_rating_deltas(db: Session, batch_size: int = 10000):
+    # Один запрос на пачку: DELETE ... RETURNING забирает самые старые приращения (SKIP LOCKED —
+    # параллельные воркеры берут разные строки), GROUP BY складывает их по товару, и каждый товар
+    # пачки обновляется одним UPDATE — одна блокировка строки товара на пачку, а не на отзыв.
+    # Возвращает [(product_id, число приращений)]
+    delta = models.RatingDelta
+    histogram = [f"rating_count_{r}" for r in RATING_VALUES]
+    claimed = select(delta.id).order_by(delta.id).limit(batch_size).with_for_update(skip_locked=True)
+    taken = (
+        delete(delta)
+        .where(delta.id.in_(claimed))
+        .returning(delta.product_id, delta.review_count, delta.rating_sum, *(getattr(delta, n) for n in histogram))
+        .cte("taken")
+    )
+    summed = (
+        select(
+            taken.c.product_id,
+            func.count().label("deltas"),
+            func.sum(taken.c.review_count).label("review_count"),
+            func.sum(taken.c.rating_sum).label("rating_sum"),
+            *(func.sum(taken.c[name]).label(name) for name in histogram),
+        )
+        .group_by(taken.c.product_id)
+        .cte("summed")
+    )
+    rows = db.execute(
+        update(models.Product)
+        .where(models.Product.id == summed.c.product_id)
+        .values(**_rating_aggregates(summed.c.review_count, summed.c.rating_sum,
+                                     {name: summed.c[name] for name in histogram}))
+        .returning(models.Product.id, summed.c.deltas)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return [tuple(row) for row in rows]
 
+def pending_rating_deltas(db: Session):
+    # Длина очереди и возраст самого старого приращения — фактическое отставание агрегатов
+    delta = models.RatingDelta
+    return db.execute(select(func.count(), func.min(delta.created_at))).one()
+
+def reconcile_product_ratings(db: Session, product_id: int = None):
+    product, review = models.Product, models.Review
+    # Отложенные приращения уже учтены в пересчёте по reviews — удаляем их. Блокировка очереди
+    # задерживает запись новых отзывов до конца сверки, чтобы их приращения не учлись дважды
+    db.execute(text("LOCK TABLE rating_deltas IN EXCLUSIVE MODE"))
+    pending = delete(models.RatingDelta)
+    if product_id is not None:
+        pending = pending.where(models.RatingDelta.product_id == product_id)
+    db.execute(pending.execution_options(synchronize_session=False))
+    histogram = [f"rating_count_{r}" for r in RATING_VALUES]
+    stats = (
+        select(
+            review.product_id,
+            func.count(review.id).label("review_count"),
+            func.sum(review.rating).label("rating_sum"),
+            *(func.count(review.id).filter(review.rating == r).label(f"rating_count_{r}") for r in RATING_VALUES),
+        )
+        .group_by(review.product_id)
+        .subquery()
+    )
+    with_reviews = (
+        update(product)
+        .where(product.id == stats.c.product_id)
+        .where(or_(
+            product.review_count != stats.c.review_count,
+            product.rating_sum != stats.c.rating_sum,
+            product.average_rating.is_distinct_from(cast(stats.c.rating_sum, Float) / stats.c.review_count),
+            *(getattr(product, name) != stats.c[name] for name in histogram),
+        ))
+        .values(
+            review_count=stats.c.review_count,
+            rating_sum=stats.c.rating_sum,
+            average_rating=cast(stats.c.rating_sum, Float) / stats.c.review_count,
+            **{name: stats.c[name] for name in histogram},
+        )
+    )
+    without_reviews = (
+        update(product)
+        .where(~exists().where(review.product_id == product.id))
+        .where(or_(product.review_count != 0, product.rating_sum != 0,
+                   product.average_rating.is_distinct_from(0.0),
+                   *(getattr(product, name) != 0 for name in histogram)))
+        .values(review_count=0, rating_sum=0, average_rating=0.0, **{name: 0 for name in histogram})
+    )
+    if product_id is not None:
+        with_reviews = with_reviews.where(product.id == product_id)
+        without_reviews = without_reviews.where(product.id == product_id)
+    repaired = 0
+    for statement in (with_reviews, without_reviews):
+        repaired += db.execute(statement.execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return repaired
+
+
+def _favorite_count_delta(delta: int):
+    # favorite_count не входит в представление товара, поэтому updated_at (ETag) не трогаем
+    product = models.Product
+    return {"favorite_count": product.favorite_count + delta, "updated_at": product.updated_at}
+
+def add_favorites(db: Session, user_id: int, product_ids: list):
+    # Один запрос: INSERT ... SELECT отсекает несуществующие товары, ON CONFLICT — повторы
+    # (уникальный индекс (user_id, product_id), без гонки между SELECT и INSERT),
+    # а UPDATE по CTE увеличивает favorite_count только у реально добавленных
+    added = (
+        pg_insert(models.Favorite)
+        .from_select(
+            ["user_id", "product_id"],
+            select(literal(user_id, Integer), models.Product.id).where(models.Product.id.in_(product_ids))
+        )
+        .on_conflict_do_nothing(index_elements=["user_id", "product_id"])
+        .returning(models.Favorite.product_id, models.Favorite.id)
+        .cte("added")
+    )
+    rows = db.execute(
+        update(models.Product)
+        .where(models.Product.id == added.c.product_id)
+        .values(**_favorite_count_delta(1))
+        .returning(added.c.product_id, added.c.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return dict(rows)
 
 def add_favorite(db: Session, user_id: int, product_id: int):
-    existing = db.query(models.Favorite).filter_by(user_id=user_id, product_id=product_id).first()
-    if not existing:
-        db_favorite = models.Favorite(user_id=user_id, product_id=product_id)
-        db.add(db_favorite)
-        db.commit()
-        db.refresh(db_favorite)
-        return db_favorite
-    return existing
+    added = add_favorites(db, user_id, [product_id])
+    if product_id in added:
+        return added[product_id], True
+    # Вставки не было: товар уже в избранном или не существует
+    existing = db.scalar(select(models.Favorite.id).filter_by(user_id=user_id, product_id=product_id))
+    if existing is None:
+        raise ValueError(f"Product with id {product_id} not found.")
+    return existing, False
+
+def remove_favorites(db: Session, user_id: int, product_ids: list):
+    removed = (
+        delete(models.Favorite)
+        .where(models.Favorite.user_id == user_id, models.Favorite.product_id.in_(product_ids))
+        .returning(models.Favorite.product_id)
+        .cte("removed")
+    )
+    removed_ids = db.scalars(
+        update(models.Product)
+        .where(models.Product.id == removed.c.product_id)
+        .values(**_favorite_count_delta(-1))
+        .returning(removed.c.product_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.commit()
+    return removed_ids
 
 def remove_favorite(db: Session, user_id: int, product_id: int):
-    favorite = db.query(models.Favorite).filter_by(user_id=user_id, product_id=product_id).first()
-    if favorite:
-        db.delete(favorite)
-        db.commit()
-    return favorite
+    return bool(remove_favorites(db, user_id, [product_id]))
+
+def get_favorited_product_ids(db: Session, user_id: int, product_ids: list):
+    return set(db.scalars(
+        select(models.Favorite.product_id)
+        .where(models.Favorite.user_id == user_id, models.Favorite.product_id.in_(product_ids))
+    ))
+
+def get_favorites(db: Session, user_id: int, limit: int = 50, cursor: str = None):
+    # Сначала недавно добавленные; к колонкам товара добавлен favorite_id — по нему строится курсор
+    query = (
+        db.query(*_product_columns(), models.Favorite.id.label("favorite_id"))
+        .join(models.Favorite, models.Favorite.product_id == models.Product.id)
+        .filter(models.Favorite.user_id == user_id)
+    )
+    if cursor:
+        favorite_id, _ = decode_cursor(cursor, FAVORITES_SORT_KEY, int)
+        query = query.filter(models.Favorite.id < favorite_id)
+    return query.order_by(models.Favorite.id.desc()).limit(limit).all()
 
-def get_favorites(db: Session, user_id: int):
-    return db.query(models.Product).join(models.Favorite).filter(models.Favorite.user_id == user_id).all()
+def get_leaderboard(db: Session, by: str = "favorites", category: str = None, limit: int = 10):
+    # Top-N читается обратным проходом по (category, счётчик, id) — без агрегации favorites/reviews
+    if by not in LEADERBOARD_COLUMNS:
+        raise ValueError(f"Unsupported leaderboard '{by}'")
+    column = LEADERBOARD_COLUMNS[by]
+    query = db.query(*_product_columns(), models.Product.favorite_count, models.Product.review_count,
+                     models.Product.weighted_rating)
+    if category:
+        query = query.filter(models.Product.category == category)
+    if by == "rating":
+        query = query.filter(models.Product.review_count > 0)
+    else:
+        query = query.filter(models.Product.favorite_count > 0)
+    return query.order_by(column.desc(), models.Product.id.desc()).limit(limit).all()
+
+def reconcile_favorite_counts(db: Session, product_id: int = None):
+    product = models.Product
+    actual = (
+        select(func.count(models.Favorite.id))
+        .where(models.Favorite.product_id == product.id)
+        .scalar_subquery()
+    )
+    statement = (
+        update(product)
+        .where(product.favorite_count != actual)
+        .values(favorite_count=actual, updated_at=product.updated_at)
+    )
+    if product_id is not None:
+        statement = statement.where(product.id == product_id)
+    repaired = db.execute(statement.execution_options(synchronize_session=False)).rowcount
+    db.commit()
+    return repaired
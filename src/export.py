@@ -0,0 +1,35 @@
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _buffered(parts, chunk_size=CHUNK_SIZE):
+    # Склеиваем мелкие строки в куски ~64 КБ, чтобы не писать в сокет по одной записи
+    buffer, size = [], 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= chunk_size:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+def ndjson_chunks(records, dumps):
+    return _buffered(dumps(record) + "\n" for record in records)
+
+def json_array_chunks(records, dumps):
+    def parts():
+        yield "["
+        for index, record in enumerate(records):
+            yield ("," if index else "") + dumps(record)
+        yield "]"
+    return _buffered(parts())
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,38 @@
+import time
+
+from src import crud
+
+
+def process_batch(db, handler=None, batch_size: int = 100):
+    # Одна транзакция на пакет: claim (new -> processing) под SKIP LOCKED, обработчик, processing -> done.
+    # Если обработчик упал, rollback возвращает заказы в new, и их заберёт следующий воркер
+    orders = crud.claim_orders(db, batch_size)
+    if not orders:
+        db.rollback()
+        return 0
+    try:
+        if handler is not None:
+            handler(db, orders)
+        crud.set_orders_status(db, [order.id for order in orders], "done")
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(orders)
+
+def run_worker(session_factory, handler=None, batch_size: int = 100, poll_interval: float = 1.0,
+               once: bool = False, should_stop=lambda: False):
+    processed = 0
+    while not should_stop():
+        db = session_factory()
+        try:
+            count = process_batch(db, handler, batch_size)
+        finally:
+            db.close()
+        processed += count
+        if count == 0:
+            if once:
+                break
+            # Очередь пуста — ждём новых заказов, не нагружая базу
+            time.sleep(poll_interval)
+    return processed
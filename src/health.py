@@ -0,0 +1,12 @@
+from flask import jsonify
+from src import cache, database
+
+
+def route_health(app):
+    @app.route("/health/db", methods=["GET"])
+    def db_health_route():
+        return jsonify({"pool": database.pool_metrics()})
+
+    @app.route("/health/cache", methods=["GET"])
+    def cache_health_route():
+        return jsonify({"cache": cache.get_cache().stats})
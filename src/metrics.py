@@ -0,0 +1,179 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from src import database
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))  # 0 — не логировать
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    # Метрики процесса: у каждого воркера gunicorn своя копия, Prometheus опрашивает их по отдельности
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.latency = {}
+        self.queries = {}
+        self.totals = {}
+
+    def record(self, method, route, status, stats, latency):
+        labels = (method, route)
+        with self._lock:
+            key = labels + (status,)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(labels, Histogram(LATENCY_BUCKETS)).observe(latency)
+            self.queries.setdefault(labels, Histogram(QUERY_COUNT_BUCKETS)).observe(stats["queries"])
+            totals = self.totals.setdefault(labels, {"db": 0.0, "serialize": 0.0, "commits": 0})
+            totals["db"] += stats["db"]
+            totals["serialize"] += stats["serialize"]
+            totals["commits"] += stats["commits"]
+
+    def render(self):
+        with self._lock:
+            lines = []
+            _counter(lines, "http_requests_total", "Запросы по маршруту и статусу",
+                     {_labels(method=m, route=r, status=s): v for (m, r, s), v in self.requests.items()})
+            _histogram(lines, "http_request_duration_seconds", "Время обработки запроса", self.latency)
+            _histogram(lines, "db_queries_per_request", "SQL-запросов на HTTP-запрос", self.queries)
+            for name, field, help_text in (
+                ("db_query_duration_seconds_total", "db", "Суммарное время SQL-запросов"),
+                ("serialization_duration_seconds_total", "serialize", "Суммарное время сериализации ответов"),
+                ("db_commits_total", "commits", "Коммиты сессии"),
+            ):
+                _counter(lines, name, help_text,
+                         {_labels(method=m, route=r): t[field] for (m, r), t in self.totals.items()})
+        pool = database.pool_metrics()
+        for name in ("pool_size", "checked_out", "overflow"):
+            lines += [f"# TYPE db_pool_{name} gauge", f"db_pool_{name} {pool[name]}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels.values())
+    return ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+
+def _counter(lines, name, help_text, samples):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines += [f"{name}{{{labels}}} {value}" for labels, value in samples.items()]
+
+def _histogram(lines, name, help_text, histograms):
+    lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for (method, route), histogram in histograms.items():
+        labels = _labels(method=method, route=route)
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+registry = Registry()
+
+# Счётчики запроса ASGI-приложения: contextvar виден и внутри AsyncSession.run_sync
+asgi_request_stats = ContextVar("asgi_request_stats", default=None)
+
+
+def new_request_stats():
+    return {"queries": 0, "db": 0.0, "serialize": 0.0, "commits": 0}
+
+def server_timing(stats, latency):
+    return (
+        f'db;dur={stats["db"] * 1000:.2f};desc="{stats["queries"]} queries", '
+        f'serialize;dur={stats["serialize"] * 1000:.2f}, '
+        f'total;dur={latency * 1000:.2f}'
+    )
+
+def _request_stats():
+    # Вне HTTP-запроса (CLI, воркеры) счётчики не ведутся, slow query log работает везде
+    if has_request_context():
+        return g.get("request_stats")
+    return asgi_request_stats.get()
+
+@contextmanager
+def timed(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _request_stats()
+        if stats is not None:
+            stats[name] += time.perf_counter() - started
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_started
+    stats = _request_stats()
+    if stats is not None:
+        stats["queries"] += 1
+        stats["db"] += elapsed
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        route = request.url_rule.rule if has_request_context() and request.url_rule else "-"
+        logger.warning("slow query %.1f ms [%s]: %s", elapsed * 1000, route, " ".join(statement.split())[:1000])
+
+def _after_commit(session):
+    stats = _request_stats()
+    if stats is not None:
+        stats["commits"] += 1
+
+# Слушатели на классах: учитываются все движки и сессии, включая тестовые
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+event.listen(Session, "after_commit", _after_commit)
+
+
+def _start_request():
+    g.request_stats = new_request_stats()
+    g.request_started = time.perf_counter()
+
+def _finish_request(response):
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return response
+    latency = time.perf_counter() - g.pop("request_started")
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    if route != "/metrics":
+        registry.record(request.method, route, response.status_code, stats, latency)
+    response.headers["Server-Timing"] = server_timing(stats, latency)
+    return response
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def init_app(app):
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics_route():
+        return Response(registry.render(), mimetype=CONTENT_TYPE)
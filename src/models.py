@@ -1,4 +1,6 @@
-from sqlalchemy import Column, Integer, String, Text, Float, ForeignKey, DateTime, CheckConstraint
+from sqlalchemy import BigInteger, Column, Integer, String, Text, Float, ForeignKey, DateTime, CheckConstraint, Index, Computed, select, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import column_property, deferred, relationship
 from sqlalchemy.sql import func
 from src.database import Base
 from datetime import datetime
@@ -13,12 +15,26 @@ class User(Base):
     email = Column(String, unique=True, nullable=False)
 
 
+# Жизненный цикл заказа; допустимые переходы — crud.ORDER_TRANSITIONS
+ORDER_STATUSES = ("new", "processing", "done")
+
 class Order(Base):
     __tablename__ = "orders"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     order_date = Column(DateTime(timezone=True), server_default=func.now())
-    status = Column(String, default="new")
+    status = Column(String, CheckConstraint(f"status IN {ORDER_STATUSES}"), nullable=False,
+                    default="new", server_default="new")
+
+    # Позиции не грузятся неявно: списки заказов подгружают их через selectinload
+    items = relationship("OrderItem", back_populates="order", order_by="OrderItem.id", lazy="raise_on_sql")
+
+    # Заказы пользователя по дате — keyset-пагинация GET /users/<id>/orders
+    __table_args__ = (
+        Index("ix_orders_user_order_date_id", "user_id", "order_date", "id"),
+        # Очередь на выполнение: частичный индекс только по новым заказам
+        Index("ix_orders_new_id", "id", postgresql_where=text("status = 'new'")),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -28,6 +44,29 @@ class OrderItem(Base):
     quantity = Column(Integer, nullable=False)
     price = Column(Float, nullable=False)
 
+    order = relationship("Order", back_populates="items")
+
+    # product_id — проверка внешнего ключа при удалении товара
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+        Index("ix_order_items_product_id", "product_id"),
+    )
+
+# Сумма заказа считается в SQL коррелированным подзапросом; загружается только по undefer
+Order.total = column_property(
+    select(func.coalesce(func.sum(OrderItem.quantity * OrderItem.price), 0.0))
+    .where(OrderItem.order_id == Order.id)
+    .correlate_except(OrderItem)
+    .scalar_subquery(),
+    deferred=True,
+)
+
+# Байесовская оценка для сортировки «лучшие по рейтингу»: к отзывам товара добавляется
+# RATING_PRIOR_WEIGHT виртуальных отзывов со средней оценкой RATING_PRIOR_MEAN, поэтому товар
+# с одной пятёркой не обгоняет товар с сотней отзывов по 4.8. Смена констант — через миграцию
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 10
+
 class Product(Base):
     __tablename__ = "products"
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
@@ -35,7 +74,47 @@ class Product(Base):
     description = Column(Text)
     price = Column(Float, nullable=False)
     category = Column(String, nullable=False)
-    average_rating = Column(Float, default=0.0)  # Новое поле
+    sku = Column(String, unique=True)  # внешний артикул, ключ для массовой загрузки
+    average_rating = Column(Float, nullable=False, default=0.0, server_default="0")  # Новое поле
+    # Агрегаты отзывов, обновляемые инкрементально при каждом новом отзыве
+    review_count = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_sum = Column(Integer, nullable=False, default=0, server_default="0")
+    # Гистограмма оценок: количество отзывов с оценкой 1..5
+    rating_count_1 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_2 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_3 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_4 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_5 = Column(Integer, nullable=False, default=0, server_default="0")
+    weighted_rating = Column(Float, Computed(
+        f"(rating_sum + {RATING_PRIOR_MEAN * RATING_PRIOR_WEIGHT})::float8 / (review_count + {RATING_PRIOR_WEIGHT})",
+        persisted=True,
+    ))
+    # Сколько пользователей добавили товар в избранное; меняется вместе с таблицей favorites
+    favorite_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Остаток на складе; NULL — остаток не ведётся. Уменьшается при оформлении заказа
+    stock = Column(Integer, CheckConstraint("stock >= 0"))
+    # Меняется при любом UPDATE строки — источник ETag/Last-Modified
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    # Генерируемый tsvector для полнотекстового поиска; в обычных запросах не загружается
+    search_vector = deferred(Column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(description, ''))", persisted=True),
+    ))
+
+    # Индексы под keyset-пагинацию списка товаров: (ключ сортировки, id)
+    __table_args__ = (
+        Index("ix_products_search_vector", "search_vector", postgresql_using="gin"),
+        Index("ix_products_category_id", "category", "id"),
+        Index("ix_products_price_id", "price", "id"),
+        Index("ix_products_category_price_id", "category", "price", "id"),
+        Index("ix_products_average_rating_id", "average_rating", "id"),
+        Index("ix_products_category_average_rating_id", "category", "average_rating", "id"),
+        Index("ix_products_weighted_rating_id", "weighted_rating", "id"),
+        Index("ix_products_category_weighted_rating_id", "category", "weighted_rating", "id"),
+        # Лидерборды «самые избранные» — общий и по категории
+        Index("ix_products_favorite_count_id", "favorite_count", "id"),
+        Index("ix_products_category_favorite_count_id", "category", "favorite_count", "id"),
+    )
 
 class Review(Base):
     __tablename__ = "reviews"
@@ -45,9 +124,43 @@ class Review(Base):
     rating = Column(Integer, CheckConstraint("rating >= 1 AND rating <= 5"), nullable=False)
     comment = Column(Text)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+
+    # Индексы под keyset-пагинацию отзывов товара по обоим вариантам сортировки;
+    # уникальная пара (user_id, product_id) — один отзыв пользователя на товар, цель ON CONFLICT
+    __table_args__ = (
+        Index("ix_reviews_product_created_at_id", "product_id", "created_at", "id"),
+        Index("ix_reviews_product_rating_id", "product_id", "rating", "id"),
+        Index("ix_reviews_user_product", "user_id", "product_id", unique=True),
+    )
+
+class RatingDelta(Base):
+    # Очередь приращений агрегатов отзывов (RATING_AGGREGATION=deferred): только вставки из транзакций
+    # отзывов и удаление пачками воркером src/rating_aggregator.py. Без внешнего ключа — очередь
+    # не должна мешать удалению товара; приращения удалённого товара воркер просто отбрасывает
+    __tablename__ = "rating_deltas"
+    id = Column(BigInteger, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    review_count = Column(Integer, nullable=False)
+    rating_sum = Column(Integer, nullable=False)
+    rating_count_1 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_2 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_3 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_4 = Column(Integer, nullable=False, default=0, server_default="0")
+    rating_count_5 = Column(Integer, nullable=False, default=0, server_default="0")
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
 
 class Favorite(Base):
     __tablename__ = "favorites"
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+
+    # Уникальность пары — основа идемпотентного ON CONFLICT DO NOTHING;
+    # (user_id, id) обслуживает постраничный список избранного; product_id — пересчёт
+    # favorite_count и проверка внешнего ключа при удалении товара
+    __table_args__ = (
+        Index("ix_favorites_user_product", "user_id", "product_id", unique=True),
+        Index("ix_favorites_user_id_id", "user_id", "id"),
+        Index("ix_favorites_product_id", "product_id"),
+    )
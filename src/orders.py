@@ -1,15 +1,25 @@
 from flask import request, jsonify
-from src import database, models, schemas
-from src.crud import create_order
-from src.database import SessionLocal
+from src import crud, schemas
+from src.crud import create_order, create_orders
+from src.database import get_db_session
+from src.pagination import next_page, parse_limit
+from src.serializers import order_to_dict, order_with_total
 
 
-def get_db_session():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def user_orders_params(args):
+    return {
+        "cursor": args.get("cursor"),
+        "limit": parse_limit(args.get("limit"), default=20, maximum=100),
+    }
+
+def user_orders_page(db, user_id, params):
+    orders = crud.get_user_orders(db, user_id, limit=params["limit"] + 1, cursor=params["cursor"])
+    orders, next_cursor = next_page(orders, params["limit"], crud.ORDERS_SORT_KEY, "order_date")
+    return {
+        "items": [order_with_total(order) for order in orders],
+        "next_cursor": next_cursor
+    }
+
 
 def route_order(app):
     @app.route("/orders/", methods=["POST"])
@@ -18,12 +28,66 @@ def route_order(app):
         try:
             data = schemas.validate_order(request.get_json())
             order = create_order(db, data)
+            return jsonify(order_to_dict(order)), 201
+        except crud.InsufficientStock as e:
+            return jsonify({"error": str(e)}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/orders/batch", methods=["POST"])
+    def create_orders_batch_route():
+        db = get_db_session()
+        try:
+            data = schemas.validate_order_batch(request.get_json())
+            order_ids = create_orders(db, data["orders"])
             return jsonify({
-                "id": order.id,
-                "user_id": order.user_id,
-                "order_date": order.order_date.isoformat(),
-                "status": order.status,
-                "items": data["items"]
+                "created": len(order_ids),
+                "order_ids": order_ids
             }), 201
+        except crud.InsufficientStock as e:
+            return jsonify({"error": str(e)}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/orders/status", methods=["POST"])
+    def transition_orders_route():
+        db = get_db_session()
+        try:
+            status, order_ids = schemas.validate_status_batch(request.get_json())
+            updated = set(crud.transition_orders(db, order_ids, status))
+            # Пропущенные — несуществующие заказы и заказы, для которых переход недопустим
+            return jsonify({
+                "status": status,
+                "updated": [order_id for order_id in order_ids if order_id in updated],
+                "skipped": [order_id for order_id in order_ids if order_id not in updated]
+            })
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/orders/<int:order_id>/status", methods=["PUT"])
+    def transition_order_route(order_id):
+        db = get_db_session()
+        try:
+            status = schemas.validate_status_change(request.get_json())["status"]
+            if crud.transition_order(db, order_id, status) is None:
+                return jsonify({"error": "Order not found"}), 404
+            return jsonify({"id": order_id, "status": status})
+        except crud.InvalidTransition as e:
+            return jsonify({"error": str(e)}), 409
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/orders/<int:order_id>", methods=["GET"])
+    def get_order_route(order_id):
+        order = crud.get_order(get_db_session(), order_id)
+        if not order:
+            return jsonify({"error": "Order not found"}), 404
+        return jsonify(order_with_total(order))
+
+    @app.route("/users/<int:user_id>/orders", methods=["GET"])
+    def get_user_orders_route(user_id):
+        try:
+            params = user_orders_params(request.args)
+            return jsonify(user_orders_page(get_db_session(), user_id, params))
         except ValueError as e:
-            return jsonify({"error": str(e)}), 400
\ No newline at end of file
+            return jsonify({"error": str(e)}), 400
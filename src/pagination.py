@@ -0,0 +1,62 @@
+import base64
+import json
+import math
+from datetime import datetime
+
+
+def encode_cursor(sort_key: str, value, last_id: int) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps({"k": sort_key, "v": value, "id": last_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _cursor_value(value, value_type):
+    # Курсор приходит от клиента: значение другого типа дошло бы до fromisoformat или SQL и дало 500
+    if value_type is datetime and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    elif value_type is float and type(value) in (int, float) and math.isfinite(value):
+        return float(value)
+    elif value_type is int and type(value) is int:
+        return value
+    raise ValueError("Invalid cursor")
+
+
+def decode_cursor(cursor: str, sort_key: str, value_type: type = None):
+    # value_type — Python-тип колонки сортировки (int, float, datetime); значение приводится к нему
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        key, value, last_id = payload["k"], payload["v"], payload["id"]
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
+    if key != sort_key or type(last_id) is not int:
+        raise ValueError("Cursor does not match the requested sort order")
+    if value_type is not None:
+        value = _cursor_value(value, value_type)
+    return value, last_id
+
+
+def next_cursor_header(next_cursor) -> dict:
+    # Списки в прежнем формате (массив, без cursor в запросе): продолжение передаётся заголовком,
+    # тело остаётся прежним
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+
+def parse_limit(value, default: int, maximum: int) -> int:
+    limit = int(value) if value is not None else default
+    if limit < 1 or limit > maximum:
+        raise ValueError(f"Limit must be between 1 and {maximum}")
+    return limit
+
+
+def next_page(items: list, limit: int, sort_key: str, attr: str):
+    # Запрашиваем limit + 1 строк: лишняя строка означает, что есть следующая страница
+    if len(items) <= limit:
+        return items, None
+    items = items[:limit]
+    last = items[-1]
+    return items, encode_cursor(sort_key, getattr(last, attr), last.id)
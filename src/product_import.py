@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+
+from sqlalchemy import text
+
+from src import schemas
+
+BATCH_SIZE = 5000
+MAX_REPORTED_ERRORS = 1000
+FORMATS = ("json", "ndjson", "csv")
+
+STAGING_DDL = """
+    CREATE TEMP TABLE IF NOT EXISTS products_staging (
+        row_number integer,
+        sku text,
+        name text,
+        description text,
+        price double precision,
+        category text,
+        stock integer
+    ) ON COMMIT DROP
+"""
+
+# Внутри пачки побеждает последняя строка с данным SKU; xmax = 0 означает вставку, а не обновление.
+# Строка без остатка не трогает уже заведённый: выгрузки без колонки stock его не обнуляют
+UPSERT_SQL = """
+    WITH upserted AS (
+        INSERT INTO products AS p (sku, name, description, price, category, stock, average_rating)
+        SELECT DISTINCT ON (sku) sku, name, description, price, category, stock, 0.0
+        FROM products_staging
+        ORDER BY sku, row_number DESC
+        ON CONFLICT (sku) DO UPDATE SET
+            name = EXCLUDED.name,
+            description = EXCLUDED.description,
+            price = EXCLUDED.price,
+            category = EXCLUDED.category,
+            stock = coalesce(EXCLUDED.stock, p.stock),
+            updated_at = now()
+        RETURNING p.id, (xmax = 0) AS inserted
+    )
+    SELECT id, inserted FROM upserted
+"""
+
+
+class _RawStream(io.RawIOBase):
+    # wsgi.input под gunicorn — не io-объект (нет readable()), и TextIOWrapper его не принимает
+    def __init__(self, stream):
+        self._stream = stream
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+def _text(stream, **kwargs):
+    if not isinstance(stream, io.IOBase):
+        stream = io.BufferedReader(_RawStream(stream))
+    return io.TextIOWrapper(stream, encoding="utf-8", **kwargs)
+
+def iter_json_array(stream):
+    # JSON-массив приходится разбирать целиком; для больших файлов лучше NDJSON или CSV
+    try:
+        rows = json.load(_text(stream))
+    except ValueError as e:
+        raise ValueError(f"Invalid JSON: {e}")
+    if not isinstance(rows, list):
+        raise ValueError("JSON payload must be an array of products")
+    for row in rows:
+        yield row, None
+
+def iter_ndjson(stream):
+    for line in _text(stream):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line), None
+        except ValueError as e:
+            yield None, f"Invalid JSON: {e}"
+
+def iter_csv(stream):
+    for row in csv.DictReader(_text(stream, newline="")):
+        try:
+            row["price"] = float(row["price"])
+        except (KeyError, TypeError, ValueError):
+            pass  # сообщение об ошибке даст схема PRODUCT_IMPORT
+        row["description"] = row.get("description") or None
+        row["stock"] = row.get("stock") or None  # пустая ячейка — остаток не задан
+        yield row, None
+
+PARSERS = {"json": iter_json_array, "ndjson": iter_ndjson, "csv": iter_csv}
+
+
+def _validated(rows):
+    for number, (record, error) in enumerate(rows, start=1):
+        if error is None:
+            try:
+                record = schemas.validate_product_import(record)
+            except ValueError as e:
+                error = str(e)
+        yield number, record, error
+
+
+def import_products(db, rows, batch_size: int = BATCH_SIZE):
+    result = {"inserted": 0, "updated": 0, "failed": 0, "errors": [], "updated_ids": []}
+    db.execute(text(STAGING_DDL))
+    cursor = db.connection().connection.cursor()
+    buffer, writer, pending = None, None, 0
+
+    def flush():
+        buffer.seek(0)
+        cursor.copy_expert(
+            "COPY products_staging (row_number, sku, name, description, price, category, stock) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+        for product_id, inserted in db.execute(text(UPSERT_SQL)):
+            if inserted:
+                result["inserted"] += 1
+            else:
+                result["updated"] += 1
+                result["updated_ids"].append(product_id)
+        db.execute(text("TRUNCATE products_staging"))
+
+    for number, record, error in _validated(rows):
+        if error is not None:
+            result["failed"] += 1
+            if len(result["errors"]) < MAX_REPORTED_ERRORS:
+                result["errors"].append({"row": number, "error": error})
+            continue
+        if writer is None:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+        writer.writerow([number, record["sku"], record["name"], record.get("description"),
+                         record["price"], record["category"], record.get("stock")])
+        pending += 1
+        if pending >= batch_size:
+            flush()
+            buffer, writer, pending = None, None, 0
+    if pending:
+        flush()
+    cursor.close()
+    db.commit()
+    return result
@@ -1,15 +1,176 @@
-from flask import request, jsonify, g
-from src import models, schemas, crud
-from src.database import SessionLocal
+from flask import Response, request, jsonify, stream_with_context
+from src import cache, conditional, export, product_import, schemas, crud
+from src.database import get_db_session
 from src.crud import create_product, update_product, delete_product
+from src.pagination import next_cursor_header, next_page, parse_limit
+from src.serializers import (
+    leaderboard_entry, product_detail, product_fields, product_to_dict, rating_histogram, review_stats, review_to_dict
+)
 
-def get_db_session():
-    db = getattr(g, 'db_session', None) or SessionLocal()
-    try:
-        yield db
-    finally:
-        if not hasattr(g, 'db_session'):  # Закрываем только если это не тестовая сессия
-            db.close()
+
+BULK_FORMATS = {
+    "application/json": "json",
+    "application/x-ndjson": "ndjson",
+    "text/csv": "csv",
+}
+BULK_FORMAT_ERROR = "Content-Type must be application/json, application/x-ndjson or text/csv"
+EXPORT_MIMETYPES = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+
+
+def _optional_float(value):
+    return float(value) if value is not None else None
+
+# Разбор параметров и сборка ответов не зависят от Flask: их же использует ASGI-слой (src/asgi.py)
+
+def products_list_params(args):
+    params = {
+        "category": args.get("category"),
+        "sort_by": args.get("sort_by", "id"),
+        "order": args.get("order", "asc"),
+        "cursor": args.get("cursor"),
+    }
+    if params["cursor"] is not None:
+        # Режим курсора: пустой cursor означает первую страницу
+        params["limit"] = parse_limit(args.get("limit"), default=10, maximum=100)
+    else:
+        params["skip"] = int(args.get("skip", 0))
+        params["limit"] = int(args.get("limit", 10))
+    return params
+
+def _page_query(params):
+    query = {
+        "category": params["category"],
+        "sort_by": params["sort_by"],
+        "order": params["order"],
+        "limit": params["limit"],
+    }
+    if params["cursor"] is not None:
+        # Запрашиваем на одну строку больше, чтобы понять, есть ли следующая страница
+        query.update(limit=params["limit"] + 1, cursor=params["cursor"])
+    else:
+        query["skip"] = params["skip"]
+    return query
+
+def products_page_versions(db, params):
+    return crud.get_products_versions(db, **_page_query(params))
+
+def products_page(db, params):
+    products = crud.get_products(db, **_page_query(params))
+    versions = [(p.id, p.updated_at) for p in products]
+    if params["cursor"] is not None:
+        sort_key = f"{params['sort_by']}:{params['order']}"
+        products, next_cursor = next_page(products, params["limit"], sort_key, params["sort_by"])
+        body = {
+            "items": list(product_to_dict.many(products)),
+            "next_cursor": next_cursor
+        }
+    else:
+        body = list(product_to_dict.many(products))
+    return conditional.make_entry(body, versions, collection=True)
+
+def product_entry(db, product_id):
+    product = crud.get_product(db, product_id)
+    if not product:
+        return None
+    return conditional.make_entry(product_detail(product), [(product.id, product.updated_at)])
+
+def search_params(args):
+    sort_by = args.get("sort_by", "relevance")
+    return {
+        "q": args.get("q"),
+        "category": args.get("category"),
+        "min_price": _optional_float(args.get("min_price")),
+        "max_price": _optional_float(args.get("max_price")),
+        "min_rating": _optional_float(args.get("min_rating")),
+        "sort_by": sort_by,
+        "order": args.get("order", "asc" if sort_by == "price" else "desc"),
+        "limit": parse_limit(args.get("limit"), default=20, maximum=100),
+        "skip": int(args.get("skip", 0)),
+    }
+
+def search_results(db, params):
+    items, total, facets = crud.search_products(db, **params)
+    return {
+        "items": list(product_to_dict.many(items)),
+        "total": total,
+        "facets": {"category": facets}
+    }
+
+def leaderboard_params(args):
+    return {
+        "by": args.get("by", "favorites"),
+        "category": args.get("category"),
+        "limit": parse_limit(args.get("limit"), default=10, maximum=100),
+    }
+
+def leaderboard(db, params):
+    items = crud.get_leaderboard(db, **params)
+    return {
+        "by": params["by"],
+        "category": params["category"],
+        "items": list(leaderboard_entry.many(items))
+    }
+
+def reviews_list_params(args):
+    return {
+        "sort_by": args.get("sort_by", "created_at"),
+        "order": args.get("order", "desc"),
+        "cursor": args.get("cursor"),
+        "limit": parse_limit(args.get("limit"), default=50, maximum=100),
+    }
+
+def _reviews_query(params):
+    return {**params, "limit": params["limit"] + 1}
+
+def reviews_page_versions(db, product_id, params):
+    versions = crud.get_reviews_versions(db, product_id, **_reviews_query(params))
+    if params["cursor"] is not None:
+        # Итоги в конверте зависят от счётчиков товара
+        versions += [("product", v) for _, v in crud.get_product_versions(db, product_id)]
+    return versions
+
+def reviews_page(db, product_id, params):
+    reviews = crud.get_reviews(db, product_id, **_reviews_query(params))
+    versions = [(r.id, r.updated_at) for r in reviews]
+    sort_key = f"{params['sort_by']}:{params['order']}"
+    reviews, next_cursor = next_page(reviews, params["limit"], sort_key, params["sort_by"])
+    items = list(review_to_dict.many(reviews))
+    if params["cursor"] is None:
+        # Прежний формат — массив; продолжение, если оно есть, передаётся заголовком
+        return conditional.make_entry(items, versions, next_cursor_header(next_cursor), collection=True)
+    summary = crud.get_review_summary(db, product_id)
+    if summary:
+        versions.append(("product", summary.updated_at))
+    return conditional.make_entry({
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": summary.review_count if summary else 0,
+        "rating_histogram": rating_histogram(summary)
+    }, versions, collection=True)
+
+def review_stats_entry(db, product_id):
+    summary = crud.get_review_summary(db, product_id)
+    if summary is None:
+        return None
+    return conditional.make_entry({"product_id": product_id, **review_stats(summary)},
+                                  [("product", summary.updated_at)])
+
+def export_format_param(args):
+    export_format = args.get("format", "ndjson")
+    if export_format not in EXPORT_MIMETYPES:
+        raise ValueError("Format must be 'ndjson' or 'json'")
+    return export_format
+
+def export_chunks(db, export_format, category, dumps, use_gzip):
+    records = product_to_dict.many(crud.stream_products(db, category=category))
+    if export_format == "ndjson":
+        chunks = export.ndjson_chunks(records, dumps)
+    else:
+        chunks = export.json_array_chunks(records, dumps)
+    return export.gzip_chunks(chunks) if use_gzip else chunks
 
 def route_product(app):
     @app.errorhandler(Exception)
@@ -18,122 +179,184 @@ def route_product(app):
 
     @app.route("/products/", methods=["POST"])
     def create_product_route():
-        db = next(get_db_session())
+        db = get_db_session()
         try:
             data = schemas.validate_product(request.get_json())
             product = create_product(db, data)
-            return jsonify({
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "category": product.category
-            }), 201
+            cache.invalidate_product()
+            return jsonify(product_fields(product)), 201
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
 
+    @app.route("/products/bulk", methods=["POST"])
+    def bulk_import_products_route():
+        import_format = BULK_FORMATS.get(request.mimetype)
+        if import_format is None:
+            return jsonify({"error": BULK_FORMAT_ERROR}), 415
+        try:
+            result = product_import.import_products(
+                get_db_session(), product_import.PARSERS[import_format](request.stream))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        cache.invalidate_products(result.pop("updated_ids"))
+        return jsonify(result)
+
     @app.route("/products/", methods=["GET"])
     def read_products_route():
-        db = next(get_db_session())
         try:
-            skip = int(request.args.get("skip", 0))
-            limit = int(request.args.get("limit", 10))
-            category = request.args.get("category")
-            products = crud.get_products(db, skip=skip, limit=limit, category=category)
-            return jsonify([{
-                "id": p.id,
-                "name": p.name,
-                "description": p.description,
-                "price": p.price,
-                "category": p.category,
-                "average_rating": p.average_rating
-            } for p in products])
-        except Exception as e:
-            raise  # Передаем ошибку обработчику
+            params = products_list_params(request.args)
+            response_cache = cache.get_cache()
+            key = cache.products_list_key(params)
+            entry = response_cache.get(key)
+            if entry is None:
+                db = get_db_session()
+                if conditional.is_conditional():
+                    not_modified = conditional.check_versions(products_page_versions(db, params), collection=True)
+                    if not_modified:
+                        return not_modified
+                entry = products_page(db, params)
+                response_cache.set(key, entry)
+            return conditional.respond(entry)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/products/export", methods=["GET"])
+    def export_products_route():
+        try:
+            export_format = export_format_param(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        use_gzip = request.accept_encodings["gzip"] > 0
+        chunks = export_chunks(get_db_session(), export_format, request.args.get("category"),
+                               app.json.dumps, use_gzip)
+        response = Response(stream_with_context(chunks), mimetype=EXPORT_MIMETYPES[export_format])
+        response.vary.add("Accept-Encoding")
+        if use_gzip:
+            response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    @app.route("/products/search", methods=["GET"])
+    def search_products_route():
+        try:
+            return jsonify(search_results(get_db_session(), search_params(request.args)))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/products/leaderboard", methods=["GET"])
+    def leaderboard_route():
+        try:
+            params = leaderboard_params(request.args)
+            response_cache = cache.get_cache()
+            key = cache.leaderboard_key(params)
+            body = response_cache.get(key)
+            if body is None:
+                body = leaderboard(get_db_session(), params)
+                response_cache.set(key, body)
+            return jsonify(body)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
     @app.route("/products/<int:product_id>", methods=["GET"])
     def read_product_route(product_id):
-        db = next(get_db_session())
-        try:
-            product = crud.get_product(db, product_id)
-            if not product:
+        response_cache = cache.get_cache()
+        key = cache.product_key(product_id)
+        entry = response_cache.get(key)
+        if entry is None:
+            db = get_db_session()
+            if conditional.is_conditional():
+                versions = crud.get_product_versions(db, product_id)
+                not_modified = versions and conditional.check_versions(versions)
+                if not_modified:
+                    return not_modified
+            entry = product_entry(db, product_id)
+            if entry is None:
                 return jsonify({"error": "Product not found"}), 404
-            return jsonify({
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "category": product.category,
-                "average_rating": product.average_rating
-            })
-        except Exception as e:
-            raise
+            response_cache.set(key, entry)
+        return conditional.respond(entry)
 
     @app.route("/products/<int:product_id>", methods=["PUT"])
     def update_product_route(product_id):
-        db = next(get_db_session())
+        db = get_db_session()
         try:
             data = schemas.validate_product(request.get_json())
             product = update_product(db, product_id, data)
             if not product:
                 return jsonify({"error": "Product not found"}), 404
-            return jsonify({
-                "id": product.id,
-                "name": product.name,
-                "description": product.description,
-                "price": product.price,
-                "category": product.category
-            })
+            cache.invalidate_product(product_id)
+            return jsonify(product_fields(product))
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
 
     @app.route("/products/<int:product_id>", methods=["DELETE"])
     def delete_product_route(product_id):
-        db = next(get_db_session())
+        db = get_db_session()
         try:
             product = delete_product(db, product_id)
             if not product:
                 return jsonify({"error": "Product not found"}), 404
+            cache.invalidate_product(product_id)
             return jsonify({"message": "Product deleted"})
         except Exception as e:
             raise
 
     @app.route("/products/<int:product_id>/reviews/", methods=["POST"])
     def create_review_route(product_id):
-        db = next(get_db_session())
+        db = get_db_session()
         try:
             data = schemas.validate_review(request.get_json())
             data["product_id"] = product_id
-            review = crud.create_review(db, data)
-            # Пересчитываем средний рейтинг
-            product = db.query(models.Product).filter(models.Product.id == product_id).first()
-            reviews = db.query(models.Review).filter(models.Review.product_id == product_id).all()
-            product.average_rating = sum(r.rating for r in reviews) / len(reviews) if reviews else 0.0
-            db.commit()
-            return jsonify({
-                "id": review.id,
-                "user_id": review.user_id,
-                "product_id": review.product_id,
-                "rating": review.rating,
-                "comment": review.comment,
-                "created_at": review.created_at.isoformat()
-            }), 201
+            review, created = crud.create_review(db, data)
+            # Новый отзыв меняет average_rating — сбрасываем карточку и списки
+            cache.invalidate_product(product_id)
+            return jsonify({**review_to_dict(review), "product_id": review.product_id}), 201 if created else 200
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
 
+    @app.route("/products/<int:product_id>/reviews/<int:review_id>", methods=["PUT"])
+    def update_review_route(product_id, review_id):
+        db = get_db_session()
+        try:
+            data = schemas.validate_review_update(request.get_json())
+            review = crud.update_review(db, product_id, review_id, data)
+            if review is None:
+                return jsonify({"error": "Review not found"}), 404
+            cache.invalidate_product(product_id)
+            return jsonify({**review_to_dict(review), "product_id": review.product_id})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/products/<int:product_id>/reviews/<int:review_id>", methods=["DELETE"])
+    def delete_review_route(product_id, review_id):
+        db = get_db_session()
+        if not crud.delete_review(db, product_id, review_id):
+            return jsonify({"error": "Review not found"}), 404
+        cache.invalidate_product(product_id)
+        return jsonify({"message": "Review deleted"})
+
+    @app.route("/products/<int:product_id>/reviews/stats", methods=["GET"])
+    def get_review_stats_route(product_id):
+        # Счётчики товара меняются вместе с updated_at, поэтому ETag берём по нему
+        db = get_db_session()
+        if conditional.is_conditional():
+            versions = [("product", v) for _, v in crud.get_product_versions(db, product_id)]
+            not_modified = versions and conditional.check_versions(versions)
+            if not_modified:
+                return not_modified
+        entry = review_stats_entry(db, product_id)
+        if entry is None:
+            return jsonify({"error": "Product not found"}), 404
+        return conditional.respond(entry)
+
     @app.route("/products/<int:product_id>/reviews/", methods=["GET"])
     def get_reviews_route(product_id):
-        db = next(get_db_session())
+        db = get_db_session()
         try:
-            sort_by = request.args.get("sort_by", "created_at")
-            order = request.args.get("order", "desc")
-            reviews = crud.get_reviews(db, product_id, sort_by=sort_by, order=order)
-            return jsonify([{
-                "id": r.id,
-                "user_id": r.user_id,
-                "rating": r.rating,
-                "comment": r.comment,
-                "created_at": r.created_at.isoformat()
-            } for r in reviews])
-        except Exception as e:
-            raise
\ No newline at end of file
+            params = reviews_list_params(request.args)
+            if conditional.is_conditional():
+                versions = reviews_page_versions(db, product_id, params)
+                not_modified = conditional.check_versions(versions, collection=True)
+                if not_modified:
+                    return not_modified
+            return conditional.respond(reviews_page(db, product_id, params))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
@@ -0,0 +1,41 @@
+import logging
+import os
+import time
+
+from src import cache, crud
+
+# Насколько average_rating и счётчики товара в базе могут отставать от отзывов в режиме
+# RATING_AGGREGATION=deferred: пауза воркера при пустой очереди
+RATING_MAX_STALENESS = float(os.environ.get("RATING_MAX_STALENESS", 2.0))
+
+logger = logging.getLogger(__name__)
+
+
+def process_batch(db, batch_size: int = 10000, response_cache=None):
+    applied = crud.apply_rating_deltas(db, batch_size)
+    if applied:
+        # Доходит до веб-процессов только через общий кэш (CACHE_BACKEND=redis). С LRU (memory) веб-процесс
+        # мог уже закэшировать старые агрегаты, сбросив кэш при самом отзыве: они живут до CACHE_TTL.
+        # Без response_cache нужен контекст Flask-приложения (CLI)
+        cache.invalidate_products([product_id for product_id, _ in applied], cache=response_cache)
+    return sum(deltas for _, deltas in applied)
+
+
+def run_worker(session_factory, batch_size: int = 10000, max_staleness: float = RATING_MAX_STALENESS,
+               once: bool = False, should_stop=lambda: False, response_cache=None):
+    applied = 0
+    while not should_stop():
+        db = session_factory()
+        try:
+            count = process_batch(db, batch_size, response_cache)
+        finally:
+            db.close()
+        applied += count
+        if count:
+            logger.info("applied %d rating delta(s)", count)
+        if count < batch_size:
+            if once:
+                break
+            # Очередь разобрана — следующая пачка не позже чем через max_staleness
+            time.sleep(max_staleness)
+    return applied
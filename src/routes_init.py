@@ -1,8 +1,15 @@
+from src import cache, database, metrics, serializers
 from src.products import route_product
 from src.users import route_user
 from src.orders import route_order
+from src.health import route_health
 
 def init_routes(app):
+    database.init_app(app)
+    cache.init_app(app)
+    serializers.init_app(app)
+    metrics.init_app(app)
     route_product(app)
     route_user(app)
     route_order(app)
+    route_health(app)
@@ -1,38 +1,273 @@
-def validate_product(data):
-    required_fields = ["name", "price", "category"]
-    for field in required_fields:
-        if field not in data or not data[field]:
-            raise ValueError(f"Field '{field}' is required")
-    if not isinstance(data["price"], (int, float)) or data["price"] < 0:
-        raise ValueError("Price must be a positive number")
-    return data
-
-def validate_order(data):
-    if "user_id" not in data or not isinstance(data["user_id"], int):
-        raise ValueError("Valid 'user_id' is required")
-    if "items" not in data or not isinstance(data["items"], list) or not data["items"]:
-        raise ValueError("Order must contain at least one item")
-    for item in data["items"]:
-        if not all(k in item for k in ["product_id", "quantity", "price"]):
-            raise ValueError("Each item must have 'product_id', 'quantity', and 'price'")
-    return data
-
-
-def validate_review(data):
-    required_fields = ["user_id", "product_id", "rating"]
-    for field in required_fields:
-        if field not in data or data[field] is None:
-            raise ValueError(f"Field '{field}' is required")
-
-    if not isinstance(data["rating"], int) or not (1 <= data["rating"] <= 5):
-        raise ValueError("Rating must be an integer between 1 and 5")
-
-    return data
-
-
-def validate_favorite(data):
-    required_fields = ["user_id", "product_id"]
-    for field in required_fields:
-        if field not in data or not data[field]:
-            raise ValueError(f"Field '{field}' is required")
-    return data
+import math
+import sys
+from abc import ABC, abstractmethod
+
+# Схемы тел запросов описываются декларативно и компилируются один раз при импорте модуля в замыкания:
+# проверка объекта — один проход по заранее собранному кортежу полей, без повторного разбора описания.
+# Валидатор возвращает новый словарь только с объявленными полями; неизвестные ключи отбрасываются.
+
+INT_MAX = 2 ** 31 - 1  # integer в Postgres
+FLOAT_MAX = sys.float_info.max  # бесконечности не пропускаем
+MAX_NAME_LENGTH = 255
+MAX_TEXT_LENGTH = 10_000
+MAX_ORDER_ITEMS = 10_000
+MAX_BATCH_ORDERS = 1000
+MAX_BATCH_FAVORITES = 500
+
+
+class SchemaError(ValueError):
+    # path — до объекта или элемента списка с ошибкой: "orders[1].items[0]: Quantity must be a positive integer"
+    def __init__(self, message, path=""):
+        super().__init__(f"{path}: {message}" if path else message)
+        self.message = message
+        self.path = path
+
+    def at(self, segment):
+        return SchemaError(self.message, f"{segment}.{self.path}" if self.path else segment)
+
+
+class Field(ABC):
+    def __init__(self, required=True, error=None, missing=None):
+        self.required = required
+        self.error = error
+        self.missing = missing
+
+    def messages(self, name):
+        missing = (self.missing or "Field '{name}' is required").format(name=name)
+        return missing, (self.error or missing).format(name=name)
+
+    @abstractmethod
+    def compile(self, name=""):
+        # Возвращает функцию проверки значения; name — для сообщений об ошибках
+        ...
+
+
+class Integer(Field):
+    # coerce — принимать целые в строках (CSV)
+    def __init__(self, minimum=-INT_MAX - 1, maximum=INT_MAX, coerce=False, **kwargs):
+        super().__init__(**kwargs)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.coerce = coerce
+
+    def compile(self, name=""):
+        _, error = self.messages(name)
+        minimum, maximum, coerce = self.minimum, self.maximum, self.coerce
+
+        def check(value):
+            if coerce and type(value) is str:
+                try:
+                    value = int(value)
+                except ValueError:
+                    raise SchemaError(error) from None
+            # type() is int отсекает и bool, который в Python — подкласс int
+            if type(value) is not int or not minimum <= value <= maximum:
+                raise SchemaError(error)
+            return value
+        return check
+
+
+class Number(Field):
+    # coerce — принимать числа в строках (CSV); результат всегда float
+    def __init__(self, minimum=-FLOAT_MAX, maximum=FLOAT_MAX, coerce=False, **kwargs):
+        super().__init__(**kwargs)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.coerce = coerce
+
+    def compile(self, name=""):
+        _, error = self.messages(name)
+        minimum, maximum, coerce = self.minimum, self.maximum, self.coerce
+
+        def check(value):
+            kind = type(value)
+            if kind is not float and kind is not int and not (coerce and kind is str):
+                raise SchemaError(error)
+            try:
+                value = float(value)
+            except (ValueError, OverflowError):
+                raise SchemaError(error) from None
+            # NaN не проходит ни одно сравнение
+            if not minimum <= value <= maximum:
+                raise SchemaError(error)
+            return value
+        return check
+
+
+class String(Field):
+    def __init__(self, max_length=MAX_NAME_LENGTH, **kwargs):
+        super().__init__(**kwargs)
+        self.max_length = max_length
+
+    def compile(self, name=""):
+        missing, error = self.messages(name)
+        max_length, required = self.max_length, self.required
+        too_long = f"Field '{name}' must not be longer than {max_length} characters"
+
+        def check(value):
+            if type(value) is not str:
+                raise SchemaError(error)
+            # Пустая строка в обязательном поле — то же, что отсутствие поля
+            if not value and required:
+                raise SchemaError(missing)
+            if len(value) > max_length:
+                raise SchemaError(too_long)
+            return value
+        return check
+
+
+class List(Field):
+    # unique — убрать повторы с сохранением порядка
+    def __init__(self, item, min_items=0, max_items=None, unique=False, **kwargs):
+        # Отсутствующий и пустой список — одна и та же ошибка
+        kwargs.setdefault("missing", kwargs.get("error"))
+        super().__init__(**kwargs)
+        self.item = item
+        self.min_items = min_items
+        self.max_items = max_items
+        self.unique = unique
+
+    def compile(self, name=""):
+        _, error = self.messages(name)
+        check_item = self.item.compile(name)
+        min_items, max_items, unique = self.min_items, self.max_items or math.inf, self.unique
+        too_many = f"'{name}' must not contain more than {self.max_items} items"
+
+        def check(value):
+            if type(value) is not list or len(value) < min_items:
+                raise SchemaError(error)
+            if len(value) > max_items:
+                raise SchemaError(too_many)
+            try:
+                result = [check_item(item) for item in value]
+            except SchemaError:
+                # Индекс нужен только для сообщения: ищем его повторным проходом, не замедляя успешный путь
+                for index, item in enumerate(value):
+                    try:
+                        check_item(item)
+                    except SchemaError as e:
+                        raise e.at(f"{name}[{index}]") from None
+                raise
+            return list(dict.fromkeys(result)) if unique else result
+        return check
+
+
+class Schema(Field):
+    def __init__(self, fields, error="Request body must be a JSON object", **kwargs):
+        super().__init__(error=error, **kwargs)
+        self.fields = fields
+
+    def extend(self, fields, **kwargs):
+        return Schema({**self.fields, **fields}, **{"error": self.error, **kwargs})
+
+    def compile(self, name=""):
+        _, error = self.messages(name)
+        fields = tuple(
+            (field_name, field.compile(field_name), field.required, field.messages(field_name)[0])
+            for field_name, field in self.fields.items()
+        )
+
+        def check(value):
+            if type(value) is not dict:
+                raise SchemaError(error)
+            result = {}
+            for field_name, check_field, required, missing in fields:
+                field_value = value.get(field_name)
+                if field_value is None:
+                    if required:
+                        raise SchemaError(missing)
+                    # null в необязательном поле сохраняем: для PUT это «очистить значение»
+                    if field_name in value:
+                        result[field_name] = None
+                    continue
+                result[field_name] = check_field(field_value)
+            return result
+        return check
+
+
+def _ids(name, maximum):
+    return List(Integer(minimum=1, error="Value must be a positive integer"), min_items=1, max_items=maximum,
+                unique=True, error=f"'{name}' must be a non-empty list")
+
+
+PRODUCT = Schema({
+    "name": String(),
+    "description": String(required=False, max_length=MAX_TEXT_LENGTH),
+    "price": Number(minimum=0, error="Price must be a positive number"),
+    "category": String(),
+    "stock": Integer(minimum=0, required=False, error="Stock must be a non-negative integer"),
+})
+
+# Строка массовой загрузки: артикул обязателен, цена и остаток могут прийти строкой (выгрузки из таблиц)
+PRODUCT_IMPORT = PRODUCT.extend({
+    "price": Number(minimum=0, coerce=True, error="Price must be a positive number"),
+    "stock": Integer(minimum=0, required=False, coerce=True, error="Stock must be a non-negative integer"),
+    "sku": String(),
+}, error="Row must be an object")
+
+ITEM_FIELDS_REQUIRED = "Each item must have 'product_id' and 'quantity'"
+
+ORDER_ITEM = Schema({
+    "product_id": Integer(minimum=1, missing=ITEM_FIELDS_REQUIRED, error="Field 'product_id' must be a positive integer"),
+    "quantity": Integer(minimum=1, missing=ITEM_FIELDS_REQUIRED, error="Quantity must be a positive integer"),
+    # price в позиции допускается для совместимости, но цену берёт сервер
+    "price": Number(required=False),
+}, error="Each item must be an object")
+
+ORDER = Schema({
+    "user_id": Integer(minimum=1, error="Valid 'user_id' is required", missing="Valid 'user_id' is required"),
+    "items": List(ORDER_ITEM, min_items=1, max_items=MAX_ORDER_ITEMS, error="Order must contain at least one item"),
+}, error="Order must be an object")
+
+ORDER_BATCH = Schema({
+    "orders": List(ORDER, min_items=1, max_items=MAX_BATCH_ORDERS, error="Batch must contain a non-empty 'orders' list"),
+}, error="Batch must contain a non-empty 'orders' list")
+
+REVIEW = Schema({
+    "user_id": Integer(minimum=1, error="Field 'user_id' must be a positive integer"),
+    "product_id": Integer(minimum=1, error="Field 'product_id' must be a positive integer"),
+    "rating": Integer(minimum=1, maximum=5, error="Rating must be an integer between 1 and 5"),
+    "comment": String(required=False, max_length=MAX_TEXT_LENGTH),
+})
+
+REVIEW_UPDATE = Schema({
+    "rating": REVIEW.fields["rating"],
+    "comment": REVIEW.fields["comment"],
+})
+
+FAVORITE = Schema({
+    "user_id": Integer(minimum=1, error="Field 'user_id' must be a positive integer"),
+    "product_id": Integer(minimum=1, error="Field 'product_id' must be a positive integer"),
+})
+
+FAVORITE_BATCH = Schema({
+    "product_ids": _ids("product_ids", MAX_BATCH_FAVORITES),
+}, error="Request body must be an object with 'product_ids'")
+
+STATUS_CHANGE = Schema({
+    "status": String(error="Field 'status' is required"),
+}, error="Field 'status' is required")
+
+STATUS_BATCH = STATUS_CHANGE.extend({
+    "order_ids": _ids("order_ids", MAX_BATCH_ORDERS),
+})
+
+
+validate_product = PRODUCT.compile()
+validate_product_import = PRODUCT_IMPORT.compile()
+validate_order = ORDER.compile()
+validate_order_batch = ORDER_BATCH.compile()
+validate_review = REVIEW.compile()
+validate_review_update = REVIEW_UPDATE.compile()
+validate_favorite = FAVORITE.compile()
+validate_product_ids = _ids("product_ids", MAX_BATCH_FAVORITES).compile("product_ids")
+validate_status_change = STATUS_CHANGE.compile()
+_validate_favorite_batch = FAVORITE_BATCH.compile()
+_validate_status_batch = STATUS_BATCH.compile()
+
+def validate_favorite_batch(data):
+    return _validate_favorite_batch(data)["product_ids"]
+
+def validate_status_batch(data):
+    data = _validate_status_batch(data)
+    return data["status"], data["order_ids"]
@@ -0,0 +1,124 @@
+import json
+import os
+from datetime import datetime
+from operator import attrgetter, itemgetter
+
+from flask.json.provider import DefaultJSONProvider, _default
+from sqlalchemy.engine import Row
+
+try:
+    import orjson  # опциональная зависимость: без неё ответы кодирует стандартный json
+except ImportError:
+    orjson = None
+
+from src import crud, metrics
+
+JSON_BACKEND = os.environ.get("JSON_BACKEND", "orjson")
+
+PRODUCT_FIELDS = ("id", "name", "description", "price", "category")
+PRODUCT_LIST_FIELDS = PRODUCT_FIELDS + ("average_rating",)
+LEADERBOARD_FIELDS = PRODUCT_LIST_FIELDS + ("favorite_count", "review_count", "weighted_rating")
+REVIEW_FIELDS = ("id", "user_id", "rating", "comment", "created_at")
+ORDER_ITEM_FIELDS = ("id", "product_id", "quantity", "price")
+
+
+class Projection:
+    # Набор полей ответа; одинаково читает ORM-объекты и строки Row из column-запросов
+    def __init__(self, *fields, **converters):
+        self.fields = fields
+        self.converters = converters
+        self._attrs = attrgetter(*fields)
+
+    def _build(self, values):
+        data = dict(zip(self.fields, values))
+        for field, convert in self.converters.items():
+            data[field] = convert(data[field])
+        return data
+
+    def __call__(self, obj):
+        return self._build(self._attrs(obj))
+
+    def many(self, items):
+        # Доступ к Row по атрибуту заметно дороже, чем по индексу: индексы полей ищем один раз на выборку
+        getter = None
+        for item in items:
+            if getter is None:
+                getter = self._getter_for(item)
+            yield self._build(getter(item))
+
+    def _getter_for(self, item):
+        if isinstance(item, Row):
+            return itemgetter(*(item._fields.index(field) for field in self.fields))
+        return self._attrs
+
+
+product_fields = Projection(*PRODUCT_FIELDS)
+product_to_dict = Projection(*PRODUCT_LIST_FIELDS)
+leaderboard_entry = Projection(*LEADERBOARD_FIELDS)
+review_to_dict = Projection(*REVIEW_FIELDS, created_at=datetime.isoformat)
+order_item_to_dict = Projection(*ORDER_ITEM_FIELDS)
+
+def rating_histogram(counters):
+    return {str(r): getattr(counters, f"rating_count_{r}") if counters else 0 for r in crud.RATING_VALUES}
+
+def review_stats(summary):
+    # summary — товар или строка crud.get_review_summary: итоги из счётчиков товара
+    return {
+        "review_count": summary.review_count,
+        "average_rating": summary.average_rating,
+        "weighted_rating": summary.weighted_rating,
+        "rating_histogram": rating_histogram(summary)
+    }
+
+def product_detail(product):
+    return {**product_to_dict(product), **review_stats(product)}
+
+def order_to_dict(order):
+    return {
+        "id": order.id,
+        "user_id": order.user_id,
+        "order_date": order.order_date.isoformat(),
+        "status": order.status,
+        "items": list(order_item_to_dict.many(order.items))
+    }
+
+def order_with_total(order):
+    return {**order_to_dict(order), "total": order.total}
+
+
+def dumps(obj) -> bytes:
+    # Компактно и с сортировкой ключей, как jsonify; не-ASCII orjson пишет в UTF-8 без экранирования
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, default=_default, sort_keys=True, separators=(",", ":")).encode()
+
+
+class JSONProvider(DefaultJSONProvider):
+    # Стандартный json Flask; время сборки тела попадает в метрики запроса (Server-Timing: serialize)
+    def response(self, *args, **kwargs):
+        with metrics.timed("serialize"):
+            return super().response(*args, **kwargs)
+
+
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Пишем байты orjson напрямую, минуя str → encode; перевод строки в конце — как у jsonify
+        with metrics.timed("serialize"):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(dumps(obj) + b"\n", mimetype=self.mimetype)
+
+
+def init_app(app, backend: str = JSON_BACKEND):
+    if backend not in ("orjson", "std"):
+        raise ValueError(f"Unknown JSON_BACKEND '{backend}'")
+    app.json = OrjsonProvider(app) if backend == "orjson" and orjson is not None else JSONProvider(app)
@@ -1,13 +1,27 @@
 from flask import request, jsonify
-from src import crud, schemas, models
-from src.database import SessionLocal
+from src import cache, crud, schemas
+from src.database import get_db_session
+from src.pagination import next_cursor_header, next_page, parse_limit
+from src.serializers import product_to_dict
+
+
+def favorites_check_params(args):
+    # ?product_ids=1,2,3 — отметки «в избранном» для сетки товаров одним запросом
+    raw = args.get("product_ids", "")
+    return schemas.validate_product_ids([int(pid) for pid in raw.split(",") if pid.strip()])
+
+def favorites_params(args):
+    return {
+        "cursor": args.get("cursor"),
+        "limit": parse_limit(args.get("limit"), default=50, maximum=100),
+    }
+
+def favorites_page(db, user_id, params):
+    rows = crud.get_favorites(db, user_id, limit=params["limit"] + 1, cursor=params["cursor"])
+    # Курсор строится по row.favorite_id — id записи избранного
+    rows, next_cursor = next_page(rows, params["limit"], crud.FAVORITES_SORT_KEY, "favorite_id")
+    return list(product_to_dict.many(rows)), next_cursor
 
-def get_db_session():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
 def route_user(app):
     @app.route("/users/", methods=["GET"])
@@ -20,12 +34,49 @@ def route_user(app):
         try:
             data = schemas.validate_favorite(request.get_json())
             data["user_id"] = user_id
-            favorite = crud.add_favorite(db, data["user_id"], data["product_id"])
+            favorite_id, created = crud.add_favorite(db, data["user_id"], data["product_id"])
+            if created:
+                cache.invalidate_favorites()
             return jsonify({
-                "id": favorite.id,
-                "user_id": favorite.user_id,
-                "product_id": favorite.product_id
-            }), 201 if not isinstance(favorite, models.Favorite) else 200
+                "id": favorite_id,
+                "user_id": data["user_id"],
+                "product_id": data["product_id"]
+            }), 201 if created else 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/users/<int:user_id>/favorites/bulk", methods=["POST"])
+    def add_favorites_bulk_route(user_id):
+        db = get_db_session()
+        try:
+            product_ids = schemas.validate_favorite_batch(request.get_json())
+            added = crud.add_favorites(db, user_id, product_ids)
+            if added:
+                cache.invalidate_favorites()
+            # Порядок как в запросе; уже добавленные и несуществующие товары пропускаются
+            return jsonify({"added": [pid for pid in product_ids if pid in added]})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/users/<int:user_id>/favorites/bulk", methods=["DELETE"])
+    def remove_favorites_bulk_route(user_id):
+        db = get_db_session()
+        try:
+            product_ids = schemas.validate_favorite_batch(request.get_json())
+            removed = set(crud.remove_favorites(db, user_id, product_ids))
+            if removed:
+                cache.invalidate_favorites()
+            return jsonify({"removed": [pid for pid in product_ids if pid in removed]})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.route("/users/<int:user_id>/favorites/check", methods=["GET"])
+    def check_favorites_route(user_id):
+        db = get_db_session()
+        try:
+            product_ids = favorites_check_params(request.args)
+            favorited = crud.get_favorited_product_ids(db, user_id, product_ids)
+            return jsonify({"favorited": {str(pid): pid in favorited for pid in product_ids}})
         except ValueError as e:
             return jsonify({"error": str(e)}), 400
 
@@ -35,17 +86,17 @@ def route_user(app):
         favorite = crud.remove_favorite(db, user_id, product_id)
         if not favorite:
             return jsonify({"error": "Favorite not found"}), 404
+        cache.invalidate_favorites()
         return jsonify({"message": "Favorite removed"})
 
     @app.route("/users/<int:user_id>/favorites/", methods=["GET"])
     def get_favorites_route(user_id):
         db = get_db_session()
-        products = crud.get_favorites(db, user_id)
-        return jsonify([{
-            "id": p.id,
-            "name": p.name,
-            "description": p.description,
-            "price": p.price,
-            "category": p.category,
-            "average_rating": p.average_rating
-        } for p in products])
+        try:
+            params = favorites_params(request.args)
+            items, next_cursor = favorites_page(db, user_id, params)
+            if params["cursor"] is None:
+                return jsonify(items), 200, next_cursor_header(next_cursor)
+            return jsonify({"items": items, "next_cursor": next_cursor})
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
@@ -0,0 +1,4 @@
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "commits: тест коммитит по-настоящему (несколько соединений); данные чистятся TRUNCATE"
+    )
@@ -1,52 +1,77 @@
+import json
+import os
 import pytest
 from flask import Flask, g
 from testcontainers.postgres import PostgresContainer
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.sql import text
 from src.models import Base, User
 from src.routes_init import init_routes
-from src.database import SessionLocal
 
 
-def get_db_session():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+# Один Postgres на сессию: внешний сервер из TEST_DATABASE_URL или контейнер postgres:16
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
 
-@pytest.fixture(scope="function")
-def postgres_engine():
-    try:
-        with PostgresContainer("postgres:16") as postgres:
-            connection_url = postgres.get_connection_url()
-            engine = create_engine(connection_url)
-            with engine.connect() as connection:
-                connection.execute(text("SELECT 1"))
-                print("Подключение к базе успешно!")
-            yield engine
-            engine.dispose()
-    except Exception as e:
-        print(f"Ошибка запуска контейнера Postgres: {e}")
-        raise
-
-@pytest.fixture(scope="function")
-def db_session(postgres_engine):
-    Base.metadata.create_all(postgres_engine)
-    Session = sessionmaker(bind=postgres_engine, expire_on_commit=False)
-    session = Session()
+
+@pytest.fixture(scope="session")
+def postgres_server_url():
+    if TEST_DATABASE_URL:
+        yield TEST_DATABASE_URL
+        return
+    with PostgresContainer("postgres:16") as postgres:
+        yield postgres.get_connection_url()
+
+def _recreate_database(server_url, name, drop_only=False):
+    admin = create_engine(server_url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        if not drop_only:
+            connection.execute(text(f'CREATE DATABASE "{name}"'))
+    admin.dispose()
+    return make_url(server_url).set(database=name)
+
+@pytest.fixture(scope="session")
+def postgres_engine(postgres_server_url):
+    # Своя база у каждого воркера pytest-xdist (-n auto); схема создаётся один раз на сессию
+    name = f"marketplace_test_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+    engine = create_engine(_recreate_database(postgres_server_url, name))
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+    _recreate_database(postgres_server_url, name, drop_only=True)
+
+def _truncate_tables(engine):
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with engine.begin() as connection:
+        connection.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+
+@pytest.fixture
+def db_session(request, postgres_engine):
+    if request.node.get_closest_marker("commits"):
+        # Тесту нужны настоящие коммиты (несколько соединений, asyncpg): после него таблицы очищаются
+        session = sessionmaker(bind=postgres_engine, expire_on_commit=False)()
+        try:
+            yield session
+        finally:
+            session.close()
+            _truncate_tables(postgres_engine)
+        return
+    # commit() в коде фиксирует SAVEPOINT, а внешняя транзакция в конце теста откатывается целиком
+    connection = postgres_engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, expire_on_commit=False, join_transaction_mode="create_savepoint")
     try:
         yield session
-        session.commit()
-        print("Сессия успешно закоммичена")
-    except Exception as e:
-        print(f"Ошибка в сессии: {e}")
-        session.rollback()
-        raise
     finally:
         session.close()
-    Base.metadata.drop_all(postgres_engine)
+        transaction.rollback()
+        connection.close()
+
+def _is_savepoint(statement):
+    # Служебные команды тестовой транзакции — приложение само их не выполняет
+    return statement.startswith(("SAVEPOINT", "RELEASE SAVEPOINT", "ROLLBACK TO SAVEPOINT"))
 
 @pytest.fixture
 def app_with_db(db_session):
@@ -111,6 +136,29 @@ def test_get_products(test_app, db_session):
     assert product["average_rating"] == 0.0
     assert "id" in product
 
+def test_get_products_cursor_pagination(test_app, db_session):
+    # Цены повторяются, чтобы проверить разрешение равенства по id
+    prices = [30.0, 10.0, 20.0, 10.0, 30.0]
+    for i, price in enumerate(prices):
+        response = test_app.post(
+            "/products/",
+            json={"name": f"Paged {i}", "price": price, "category": "Paging"}
+        )
+        assert response.status_code == 201
+
+    seen = []
+    cursor = ""
+    while cursor is not None:
+        response = test_app.get(f"/products/?category=Paging&sort_by=price&order=desc&limit=2&cursor={cursor}")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert len(data["items"]) <= 2
+        seen.extend((p["price"], p["id"]) for p in data["items"])
+        cursor = data["next_cursor"]
+
+    assert len(seen) == len(prices)
+    assert seen == sorted(seen, reverse=True)
+
 def test_get_product(test_app, db_session):
     # Создаем продукт
     create_response = test_app.post(
@@ -136,6 +184,35 @@ def test_get_product(test_app, db_session):
     assert data["average_rating"] == 0.0
     assert data["id"] == product_id
 
+# now() внутри одной откатываемой транзакции не меняется, а ETag строится по updated_at
+@pytest.mark.commits
+def test_product_conditional_get(app_with_db, test_app, db_session):
+    from src import cache
+
+    product_id = test_app.post(
+        "/products/",
+        json={"name": "Tagged", "price": 1.0, "category": "Etag"}
+    ).get_json()["id"]
+
+    first = test_app.get(f"/products/{product_id}")
+    etag = first.headers["ETag"]
+    assert first.headers["Last-Modified"]
+    assert test_app.get(f"/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+
+    # Без кэша 304 отдаётся по (id, updated_at), без загрузки товара
+    cache.init_app(app_with_db, cache.NullCache())
+    assert test_app.get(f"/products/{product_id}", headers={"If-None-Match": etag}).status_code == 304
+    listing = test_app.get("/products/?category=Etag")
+    assert test_app.get("/products/?category=Etag",
+                        headers={"If-None-Match": listing.headers["ETag"]}).status_code == 304
+
+    test_app.put(f"/products/{product_id}", json={"name": "Retagged", "price": 2.0, "category": "Etag"})
+    changed = test_app.get(f"/products/{product_id}", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert test_app.get("/products/?category=Etag",
+                        headers={"If-None-Match": listing.headers["ETag"]}).status_code == 200
+
 def test_update_product(test_app, db_session):
     # Создаем продукт
     create_response = test_app.post(
@@ -238,6 +315,165 @@ def test_create_review(test_app, db_session):
     product_data = product_response.get_json()
     assert product_data["average_rating"] == 4.0
 
+def test_review_aggregates_and_reconcile(test_app, db_session):
+    from src import crud
+    from src.models import Product
+
+    product_id = test_app.post(
+        "/products/",
+        json={"name": "Aggregated", "price": 5.0, "category": "Test"}
+    ).get_json()["id"]
+    users = [User(name=f"rater{i}", email=f"rater{i}@example.com") for i in range(2)]
+    db_session.add_all(users)
+    db_session.commit()
+
+    for user, rating in zip(users, (4, 5)):
+        response = test_app.post(
+            f"/products/{product_id}/reviews/",
+            json={"user_id": user.id, "rating": rating, "product_id": product_id}
+        )
+        assert response.status_code == 201
+
+    product = db_session.get(Product, product_id)
+    db_session.refresh(product)
+    assert (product.review_count, product.rating_sum, product.average_rating) == (2, 9, 4.5)
+
+    # Ломаем агрегаты и проверяем, что сверка восстанавливает их по таблице reviews
+    product.review_count, product.rating_sum, product.average_rating = 7, 1, 1.0
+    product.rating_count_1 = 3
+    db_session.commit()
+    assert crud.reconcile_product_ratings(db_session) == 1
+    db_session.refresh(product)
+    assert (product.review_count, product.rating_sum, product.average_rating) == (2, 9, 4.5)
+    assert (product.rating_count_1, product.rating_count_4, product.rating_count_5) == (0, 1, 1)
+
+
+def test_review_upsert_edit_and_delete(test_app, db_session, postgres_engine):
+    from sqlalchemy import event
+    from src import crud
+
+    product_id = test_app.post("/products/", json={"name": "Edited", "price": 2.0, "category": "Test"}).get_json()["id"]
+    users = [User(name=f"editor{i}", email=f"editor{i}@example.com") for i in range(2)]
+    db_session.add_all(users)
+    db_session.commit()
+    url = f"/products/{product_id}/reviews/"
+
+    first = test_app.post(url, json={"user_id": users[0].id, "product_id": product_id, "rating": 2})
+    assert first.status_code == 201
+    test_app.post(url, json={"user_id": users[1].id, "product_id": product_id, "rating": 4})
+    # Повторный отзыв того же пользователя заменяет прежний
+    again = test_app.post(url, json={"user_id": users[0].id, "product_id": product_id, "rating": 5, "comment": "Better"})
+    assert again.status_code == 200
+    assert again.get_json()["id"] == first.get_json()["id"]
+    stats = test_app.get(f"{url}stats").get_json()
+    assert (stats["review_count"], stats["average_rating"]) == (2, 4.5)
+    assert stats["rating_histogram"] == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
+
+    # Правка и удаление меняют агрегаты на дельту, не перечитывая отзывы товара
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(postgres_engine, "before_cursor_execute", listener)
+    try:
+        response = test_app.put(f"{url}{first.get_json()['id']}", json={"rating": 1})
+    finally:
+        event.remove(postgres_engine, "before_cursor_execute", listener)
+    assert response.status_code == 200
+    assert (response.get_json()["rating"], response.get_json()["comment"]) == (1, "Better")
+    assert not any("count(" in statement or "sum(" in statement for statement in statements)
+    assert test_app.get(f"{url}stats").get_json()["rating_histogram"] == {"1": 1, "2": 0, "3": 0, "4": 1, "5": 0}
+
+    review_id = again.get_json()["id"]
+    assert test_app.delete(f"{url}{review_id}").status_code == 200
+    assert test_app.delete(f"{url}{review_id}").status_code == 404
+    assert test_app.put(f"{url}{review_id}", json={"rating": 3}).status_code == 404
+    assert test_app.put(f"/products/{product_id}/reviews/1", json={"rating": 9}).status_code == 400
+    stats = test_app.get(f"{url}stats").get_json()
+    assert (stats["review_count"], stats["average_rating"], stats["weighted_rating"]) == (1, 4.0, 34.0 / 11)
+    assert crud.reconcile_product_ratings(db_session) == 0
+
+
+def test_deferred_rating_aggregation(test_app, db_session, mocker):
+    from src import crud, rating_aggregator
+    from src.models import Product
+
+    mocker.patch("src.crud.RATING_AGGREGATION", "deferred")
+    product_id = test_app.post("/products/", json={"name": "Hot", "price": 1.0, "category": "Test"}).get_json()["id"]
+    users = [User(name=f"queued{i}", email=f"queued{i}@example.com") for i in range(3)]
+    db_session.add_all(users)
+    db_session.commit()
+    url = f"/products/{product_id}/reviews/"
+    review_ids = [
+        test_app.post(url, json={"user_id": user.id, "product_id": product_id, "rating": rating}).get_json()["id"]
+        for user, rating in zip(users, (5, 4, 1))
+    ]
+    test_app.put(f"{url}{review_ids[2]}", json={"rating": 2})
+    test_app.delete(f"{url}{review_ids[1]}")
+    # Повторный POST с той же оценкой меняет только комментарий: приращения нет
+    again = test_app.post(url, json={"user_id": users[0].id, "product_id": product_id, "rating": 5, "comment": "Same"})
+    assert again.status_code == 200
+
+    # Отзывы записаны, агрегаты товара ждут воркера
+    product = db_session.get(Product, product_id)
+    assert product.review_count == 0
+    assert crud.pending_rating_deltas(db_session)[0] == 5
+    assert rating_aggregator.process_batch(db_session) == 5
+    db_session.refresh(product)
+    assert (product.review_count, product.rating_sum, product.average_rating) == (2, 7, 3.5)
+    assert (product.rating_count_1, product.rating_count_2, product.rating_count_4, product.rating_count_5) == (0, 1, 0, 1)
+    assert rating_aggregator.process_batch(db_session) == 0
+
+    # Сверка учитывает ещё не сведённые приращения и удаляет их — повторного учёта нет
+    test_app.post(url, json={"user_id": users[1].id, "product_id": product_id, "rating": 3})
+    assert crud.reconcile_product_ratings(db_session) == 1
+    assert crud.pending_rating_deltas(db_session)[0] == 0
+    db_session.refresh(product)
+    assert (product.review_count, product.rating_sum) == (3, 10)
+
+
+def test_review_stats_and_weighted_leaderboard(test_app, db_session):
+    users = [User(name=f"stats{i}", email=f"stats{i}@example.com") for i in range(20)]
+    db_session.add_all(users)
+    db_session.commit()
+    # Одна пятёрка против двадцати оценок 4 и 5: по среднему выше первый, по байесовской оценке — второй
+    single = test_app.post("/products/", json={"name": "Single", "price": 1.0, "category": "Stats"}).get_json()["id"]
+    popular = test_app.post("/products/", json={"name": "Popular", "price": 1.0, "category": "Stats"}).get_json()["id"]
+    test_app.post(f"/products/{single}/reviews/", json={"user_id": users[0].id, "product_id": single, "rating": 5})
+    for i, user in enumerate(users):
+        test_app.post(f"/products/{popular}/reviews/",
+                      json={"user_id": user.id, "product_id": popular, "rating": 5 if i % 2 else 4})
+
+    response = test_app.get(f"/products/{popular}/reviews/stats")
+    assert response.status_code == 200
+    assert response.get_json() == {
+        "product_id": popular,
+        "review_count": 20,
+        "average_rating": 4.5,
+        "weighted_rating": (90 + 30.0) / 30,
+        "rating_histogram": {"1": 0, "2": 0, "3": 0, "4": 10, "5": 10}
+    }
+    assert test_app.get(f"/products/{popular}/reviews/stats",
+                        headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+    assert test_app.get(f"/products/{single}").get_json()["rating_histogram"] == {"1": 0, "2": 0, "3": 0, "4": 0, "5": 1}
+    assert test_app.get("/products/999999/reviews/stats").status_code == 404
+
+    data = test_app.get("/products/leaderboard?by=rating&category=Stats").get_json()
+    assert [item["id"] for item in data["items"]] == [popular, single]
+    data = test_app.get("/products/search?category=Stats&sort_by=rating").get_json()
+    assert [item["id"] for item in data["items"]] == [popular, single]
+
+
+def test_create_review_unknown_product(test_app, db_session):
+    user = User(name="lost", email="lost@example.com")
+    db_session.add(user)
+    db_session.commit()
+
+    response = test_app.post(
+        "/products/999/reviews/",
+        json={"user_id": user.id, "rating": 3, "product_id": 999}
+    )
+    assert response.status_code == 400
+    assert "not found" in response.get_json()["error"]
+
 def test_get_reviews(test_app, db_session):
     # Создаем продукт
     create_product_response = test_app.post(
@@ -279,3 +515,605 @@ def test_get_reviews(test_app, db_session):
     assert review["comment"] == "Great product!"
     assert review["user_id"] == user_id
     assert "id" in review
+
+    etag = response.headers["ETag"]
+    not_modified = test_app.get(f"/products/{product_id}/reviews/?sort_by=rating&order=desc",
+                                headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.get_data() == b""
+
+
+def test_create_order(test_app, db_session):
+    from src.models import OrderItem
+
+    product_id = test_app.post(
+        "/products/",
+        json={"name": "Order Product", "price": 12.5, "category": "Test"}
+    ).get_json()["id"]
+    user = User(name="buyer", email="buyer@example.com")
+    db_session.add(user)
+    db_session.commit()
+
+    response = test_app.post(
+        "/orders/",
+        json={"user_id": user.id, "items": [{"product_id": product_id, "quantity": 2, "price": 12.5}]}
+    )
+    assert response.status_code == 201
+    order_id = response.get_json()["id"]
+    items = db_session.query(OrderItem).filter(OrderItem.order_id == order_id).all()
+    assert [(i.product_id, i.quantity) for i in items] == [(product_id, 2)]
+    # В ответе — сохранённые позиции с их id, а не эхо запроса
+    assert response.get_json()["items"] == [
+        {"id": items[0].id, "product_id": product_id, "quantity": 2, "price": 12.5}
+    ]
+
+
+def test_user_orders_fixed_query_count(test_app, db_session, postgres_engine):
+    from sqlalchemy import event
+    from src import crud
+
+    product_id = test_app.post("/products/", json={"name": "Bulk Buy", "price": 2.5, "category": "Test"}).get_json()["id"]
+    user = User(name="shopper", email="shopper@example.com")
+    db_session.add(user)
+    db_session.commit()
+    crud.create_orders(db_session, [
+        {"user_id": user.id, "items": [{"product_id": product_id, "quantity": n, "price": 2.5}] * 2}
+        for n in range(1, 8)
+    ])
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: _is_savepoint(statement) or statements.append(statement)
+    event.listen(postgres_engine, "before_cursor_execute", listener)
+    try:
+        page = test_app.get(f"/users/{user.id}/orders?limit=5&cursor=").get_json()
+    finally:
+        event.remove(postgres_engine, "before_cursor_execute", listener)
+    # Заказы с суммами и одна selectin-выборка позиций, независимо от размера страницы
+    assert len(statements) == 2
+    assert len(page["items"]) == 5
+    assert all(len(order["items"]) == 2 for order in page["items"])
+
+    rest = test_app.get(f"/users/{user.id}/orders?limit=5&cursor={page['next_cursor']}").get_json()
+    assert rest["next_cursor"] is None
+    orders = page["items"] + rest["items"]
+    assert sorted(order["total"] for order in orders) == [2 * n * 2.5 for n in range(1, 8)]
+    assert len({order["id"] for order in orders}) == 7
+
+    order = test_app.get(f"/orders/{orders[0]['id']}").get_json()
+    assert order == orders[0]
+    assert test_app.get("/orders/999999").status_code == 404
+
+
+def test_get_reviews_cursor_pagination(test_app, db_session):
+    product_id = test_app.post(
+        "/products/",
+        json={"name": "Many Reviews", "price": 3.0, "category": "Test"}
+    ).get_json()["id"]
+    users = [User(name=f"critic{i}", email=f"critic{i}@example.com") for i in range(4)]
+    db_session.add_all(users)
+    db_session.commit()
+    for user, rating in zip(users, (5, 3, 5, 1)):
+        response = test_app.post(
+            f"/products/{product_id}/reviews/",
+            json={"user_id": user.id, "rating": rating, "product_id": product_id}
+        )
+        assert response.status_code == 201
+
+    for sort_by in ("rating", "created_at"):
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = test_app.get(
+                f"/products/{product_id}/reviews/?sort_by={sort_by}&order=desc&limit=3&cursor={cursor}")
+            assert response.status_code == 200
+            data = response.get_json()
+            assert data["total"] == 4
+            assert data["rating_histogram"] == {"1": 1, "2": 0, "3": 1, "4": 0, "5": 2}
+            seen.extend(data["items"])
+            cursor = data["next_cursor"]
+        assert len({r["id"] for r in seen}) == 4
+    # Без cursor — прежний массив, продолжение в заголовке X-Next-Cursor
+    response = test_app.get(f"/products/{product_id}/reviews/?sort_by=rating&order=asc&limit=2")
+    assert [r["rating"] for r in response.get_json()] == [1, 3]
+    rest = test_app.get(f"/products/{product_id}/reviews/?sort_by=rating&order=asc&limit=2"
+                        f"&cursor={response.headers['X-Next-Cursor']}").get_json()
+    assert [r["rating"] for r in rest["items"]] == [5, 5] and rest["next_cursor"] is None
+    assert "X-Next-Cursor" not in test_app.get(f"/products/{product_id}/reviews/?limit=4").headers
+
+
+def test_export_products(test_app, db_session):
+    for i in range(3):
+        test_app.post("/products/", json={"name": f"Export {i}", "price": 1.0 + i, "category": "Feed"})
+    test_app.post("/products/", json={"name": "Other", "price": 1.0, "category": "Other"})
+
+    ndjson = test_app.get("/products/export?category=Feed")
+    assert ndjson.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in ndjson.get_data(as_text=True).splitlines()]
+    assert [p["name"] for p in lines] == ["Export 0", "Export 1", "Export 2"]
+
+    array = test_app.get("/products/export?format=json")
+    assert len(array.get_json()) == 4
+
+
+def test_search_products(test_app, db_session):
+    catalog = [
+        ("Wireless Headphones", "Noise cancelling wireless headphones", 120.0, "Audio"),
+        ("Wired Headphones", "Studio headphones with cable", 60.0, "Audio"),
+        ("Wireless Mouse", "Compact mouse", 25.0, "Computers"),
+        ("Desk Lamp", "Warm light", 30.0, "Home"),
+    ]
+    for name, description, price, category in catalog:
+        test_app.post("/products/", json={
+            "name": name, "description": description, "price": price, "category": category
+        })
+
+    response = test_app.get("/products/search?q=wireless")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["total"] == 2
+    assert data["items"][0]["name"] == "Wireless Headphones"  # слово встречается дважды
+    assert data["facets"] == {"category": {"Audio": 1, "Computers": 1}}
+
+    data = test_app.get("/products/search?q=headphones&max_price=100&category=Audio").get_json()
+    assert [p["name"] for p in data["items"]] == ["Wired Headphones"]
+
+    data = test_app.get("/products/search?sort_by=price&limit=2").get_json()
+    assert [p["price"] for p in data["items"]] == [25.0, 30.0]
+    assert data["total"] == 4
+
+
+def test_bulk_import_products(test_app, db_session):
+    from src.models import Product
+
+    ndjson = "\n".join([
+        json.dumps({"sku": "A-1", "name": "Imported A", "price": 10.0, "category": "Bulk"}),
+        json.dumps({"sku": "B-2", "name": "Imported B", "price": 20.0, "category": "Bulk"}),
+        json.dumps({"name": "No SKU", "price": 1.0, "category": "Bulk"}),
+        "{not json",
+        json.dumps({"sku": "A-1", "name": "Imported A v2", "price": 11.0, "category": "Bulk"}),
+    ])
+    response = test_app.post("/products/bulk", data=ndjson, content_type="application/x-ndjson")
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data["inserted"], data["updated"], data["failed"]) == (2, 0, 2)
+    assert [e["row"] for e in data["errors"]] == [3, 4]
+
+    csv_payload = "sku,name,description,price,category\nB-2,Imported B v2,Updated,25.5,Bulk\nC-3,Bad,,abc,Bulk\n"
+    response = test_app.post("/products/bulk", data=csv_payload, content_type="text/csv")
+    data = response.get_json()
+    assert (data["inserted"], data["updated"], data["failed"]) == (0, 1, 1)
+
+    # Остаток из CSV приходит строкой; пустая ячейка и выгрузка без колонки stock его не меняют
+    csv_payload = "sku,name,price,category,stock\nD-4,Stocked,5,Bulk,7\nA-1,Imported A v2,11,Bulk,3\nE-5,Bad,1,Bulk,-1\n"
+    data = test_app.post("/products/bulk", data=csv_payload, content_type="text/csv").get_json()
+    assert (data["inserted"], data["updated"], data["failed"]) == (1, 1, 1)
+    assert data["errors"] == [{"row": 3, "error": "Stock must be a non-negative integer"}]
+    ndjson = json.dumps({"sku": "B-2", "name": "Imported B v2", "description": "Updated", "price": 25.5,
+                         "category": "Bulk", "stock": 4})
+    test_app.post("/products/bulk", data=ndjson, content_type="application/x-ndjson")
+    csv_payload = "sku,name,price,category\nA-1,Imported A v2,11,Bulk\n"
+    test_app.post("/products/bulk", data=csv_payload, content_type="text/csv")
+
+    products = {p.sku: p for p in db_session.query(Product).filter(Product.category == "Bulk")}
+    assert {sku: p.stock for sku, p in products.items()} == {"A-1": 3, "B-2": 4, "D-4": 7}
+    assert products["A-1"].name == "Imported A v2"
+    assert (products["B-2"].price, products["B-2"].description) == (25.5, "Updated")
+    # Загрузка идёт в обход ORM: рейтинг всё равно не NULL, и курсор по нему проходит все строки
+    assert {p.average_rating for p in products.values()} == {0.0}
+    seen, cursor = [], ""
+    while cursor is not None:
+        response = test_app.get(f"/products/?category=Bulk&sort_by=average_rating&limit=1&cursor={cursor}")
+        data = response.get_json()
+        seen.extend(p["id"] for p in data["items"])
+        cursor = data["next_cursor"]
+    assert sorted(seen) == sorted(p.id for p in products.values())
+
+
+def test_bulk_import_rejects_unknown_content_type(test_app):
+    response = test_app.post("/products/bulk", data="x", content_type="text/plain")
+    assert response.status_code == 415
+
+
+@pytest.mark.commits
+def test_asgi_app_with_asyncpg(postgres_engine, db_session):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from sqlalchemy.orm import sessionmaker
+    from starlette.testclient import TestClient
+    from src import cache
+    from src.asgi import create_app, make_async_engine
+
+    async_engine = make_async_engine(postgres_engine.url.set(drivername="postgresql+asyncpg"))
+    asgi_app = create_app(async_sessionmaker(async_engine, expire_on_commit=False), cache.NullCache(),
+                          sessionmaker(bind=postgres_engine, expire_on_commit=False))
+    db_session.add(User(id=1, name="async", email="async@example.com"))
+    db_session.commit()
+
+    with TestClient(asgi_app) as client:
+        response = client.post("/products/", json={"name": "Async Product", "price": 12.5, "category": "Async"})
+        assert response.status_code == 201
+        product_id = response.json()["id"]
+
+        response = client.post(f"/products/{product_id}/reviews/", json={"user_id": 1, "rating": 4, "product_id": product_id})
+        assert response.status_code == 201
+
+        response = client.get("/products/?category=Async&cursor=")
+        assert [p["average_rating"] for p in response.json()["items"]] == [4.0]
+        etag = response.headers["ETag"]
+        assert client.get("/products/?category=Async&cursor=", headers={"If-None-Match": etag}).status_code == 304
+
+        response = client.post("/orders/", json={"user_id": 1, "items": [{"product_id": product_id, "quantity": 2, "price": 12.5}]})
+        assert response.status_code == 201
+        assert client.get("/products/999999").status_code == 404
+
+        order_id = response.json()["id"]
+        response = client.put(f"/orders/{order_id}/status", json={"status": "processing"})
+        assert response.json() == {"id": order_id, "status": "processing"}
+        response = client.post("/orders/status", json={"order_ids": [order_id], "status": "done"})
+        assert response.json() == {"status": "done", "updated": [order_id], "skipped": []}
+        assert client.put(f"/orders/{order_id}/status", json={"status": "new"}).status_code == 409
+
+        response = client.post("/users/1/favorites/bulk", json={"product_ids": [product_id]})
+        assert response.json() == {"added": [product_id]}
+        response = client.get("/users/1/favorites/")
+        assert [p["id"] for p in response.json()] == [product_id]
+        assert "X-Next-Cursor" not in response.headers
+
+        # Импорт и экспорт идут через синхронную сессию: COPY и серверный курсор psycopg2
+        response = client.post("/products/bulk", content="sku,name,price,category,stock\nASGI-1,Imported,3.5,Async,2\n",
+                               headers={"Content-Type": "text/csv"})
+        assert response.json() == {"inserted": 1, "updated": 0, "failed": 0, "errors": []}
+        response = client.get("/products/export?category=Async", headers={"Accept-Encoding": "identity"})
+        assert sorted(json.loads(line)["name"] for line in response.text.splitlines()) == ["Async Product", "Imported"]
+
+        assert {"pool_size", "checked_out", "checkouts"} <= set(client.get("/health/db").json()["pool"])
+        assert 'route="/products/{product_id:int}/reviews/"' in client.get("/metrics").text
+
+
+def test_favorites_bulk_and_pagination(test_app, db_session):
+    user = User(name="fan", email="fan@example.com")
+    db_session.add(user)
+    db_session.commit()
+    ids = [
+        test_app.post("/products/", json={"name": f"Fav {i}", "price": 1.0, "category": "Fav"}).get_json()["id"]
+        for i in range(5)
+    ]
+
+    response = test_app.post(f"/users/{user.id}/favorites/", json={"user_id": user.id, "product_id": ids[0]})
+    assert response.status_code == 201
+    repeated = test_app.post(f"/users/{user.id}/favorites/", json={"user_id": user.id, "product_id": ids[0]})
+    assert repeated.status_code == 200
+    assert repeated.get_json()["id"] == response.get_json()["id"]
+
+    # Повтор и несуществующий товар пропускаются без ошибки
+    response = test_app.post(f"/users/{user.id}/favorites/bulk", json={"product_ids": ids + [999999]})
+    assert response.get_json() == {"added": ids[1:]}
+
+    response = test_app.get(f"/users/{user.id}/favorites/check?product_ids={ids[0]},{ids[1]},999999")
+    assert response.get_json() == {"favorited": {str(ids[0]): True, str(ids[1]): True, "999999": False}}
+
+    response = test_app.delete(f"/users/{user.id}/favorites/bulk", json={"product_ids": [ids[1], ids[2], 999999]})
+    assert response.get_json() == {"removed": [ids[1], ids[2]]}
+    assert test_app.delete(f"/users/{user.id}/favorites/{ids[1]}").status_code == 404
+
+    response = test_app.get(f"/users/{user.id}/favorites/?limit=2")
+    assert [p["id"] for p in response.get_json()] == [ids[4], ids[3]]
+    assert response.headers["X-Next-Cursor"]
+
+    seen, cursor = [], ""
+    while cursor is not None:
+        data = test_app.get(f"/users/{user.id}/favorites/?limit=2&cursor={cursor}").get_json()
+        seen.extend(p["id"] for p in data["items"])
+        cursor = data["next_cursor"]
+    assert seen == [ids[4], ids[3], ids[0]]
+
+
+def test_favorite_counts_and_leaderboard(test_app, db_session):
+    from src import crud
+    from src.models import Product
+
+    users = [User(name=f"voter{i}", email=f"voter{i}@example.com") for i in range(3)]
+    db_session.add_all(users)
+    db_session.commit()
+    ids = [
+        test_app.post("/products/", json={"name": f"Popular {i}", "price": 1.0, "category": "Top" if i < 3 else "Other"})
+        .get_json()["id"]
+        for i in range(4)
+    ]
+    etag = test_app.get(f"/products/{ids[0]}").headers["ETag"]
+
+    # ids[1] — у трёх пользователей, ids[0] — у двух, ids[3] (другая категория) — у одного
+    for user, product_ids in zip(users, ([ids[0], ids[1], ids[3]], [ids[0], ids[1]], [ids[1]])):
+        test_app.post(f"/users/{user.id}/favorites/bulk", json={"product_ids": product_ids})
+    test_app.post(f"/users/{users[0].id}/favorites/bulk", json={"product_ids": [ids[0]]})  # повтор не считается
+    test_app.delete(f"/users/{users[1].id}/favorites/{ids[0]}")
+
+    counts = dict(db_session.query(Product.id, Product.favorite_count).filter(Product.id.in_(ids)))
+    assert [counts[i] for i in ids] == [1, 3, 0, 1]
+    # Счётчик избранного не входит в ответ, поэтому ETag карточки не меняется
+    assert test_app.get(f"/products/{ids[0]}", headers={"If-None-Match": etag}).status_code == 304
+
+    data = test_app.get("/products/leaderboard?by=favorites&category=Top").get_json()
+    assert [(p["id"], p["favorite_count"]) for p in data["items"]] == [(ids[1], 3), (ids[0], 1)]
+    data = test_app.get("/products/leaderboard?limit=1").get_json()
+    assert [p["id"] for p in data["items"]] == [ids[1]]
+    # Изменение избранного сбрасывает закэшированный лидерборд
+    test_app.delete(f"/users/{users[2].id}/favorites/bulk", json={"product_ids": [ids[1]]})
+    data = test_app.get("/products/leaderboard?by=favorites&category=Top").get_json()
+    assert [(p["id"], p["favorite_count"]) for p in data["items"]] == [(ids[1], 2), (ids[0], 1)]
+
+    db_session.query(Product).filter(Product.id == ids[2]).update({"favorite_count": 5})
+    db_session.commit()
+    assert crud.reconcile_favorite_counts(db_session) == 1
+
+
+def test_order_snapshots_price_and_reserves_stock(test_app, db_session):
+    from src.models import Product
+
+    product_id = test_app.post(
+        "/products/", json={"name": "Limited", "price": 40.0, "category": "Test", "stock": 3}
+    ).get_json()["id"]
+    user = User(name="collector", email="collector@example.com")
+    db_session.add(user)
+    db_session.commit()
+
+    response = test_app.post("/orders/", json={"user_id": user.id, "items": [
+        {"product_id": product_id, "quantity": 2, "price": 0.01}
+    ]})
+    assert response.status_code == 201
+    assert response.get_json()["items"][0]["price"] == 40.0
+
+    response = test_app.post("/orders/", json={"user_id": user.id, "items": [{"product_id": product_id, "quantity": 2}]})
+    assert response.status_code == 409
+    response = test_app.post("/orders/", json={"user_id": user.id, "items": [{"product_id": 999999, "quantity": 1}]})
+    assert response.status_code == 400
+    db_session.expire_all()
+    assert db_session.get(Product, product_id).stock == 1
+
+
+@pytest.mark.commits
+def test_concurrent_orders_do_not_oversell(postgres_engine, db_session):
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import create_engine
+    from src import crud
+    from src.models import Order, Product
+
+    product = Product(name="Flash Sale", price=9.0, category="Test", stock=10)
+    user = User(name="crowd", email="crowd@example.com")
+    db_session.add_all([product, user])
+    db_session.commit()
+
+    engine = create_engine(postgres_engine.url, pool_size=20)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def place_order(_):
+        with Session() as session:
+            try:
+                crud.create_order(session, {"user_id": user.id, "items": [{"product_id": product.id, "quantity": 1}]})
+                return "created"
+            except crud.InsufficientStock:
+                return "sold out"
+
+    with ThreadPoolExecutor(20) as pool:
+        results = list(pool.map(place_order, range(60)))
+    engine.dispose()
+
+    assert results.count("created") == 10
+    db_session.expire_all()
+    assert db_session.get(Product, product.id).stock == 0
+    assert db_session.query(Order).filter(Order.user_id == user.id).count() == 10
+
+
+def test_order_status_transitions(test_app, db_session):
+    from src import crud
+
+    product_id = test_app.post("/products/", json={"name": "Lifecycle", "price": 1.0, "category": "Test"}).get_json()["id"]
+    user = User(name="tracker", email="tracker@example.com")
+    db_session.add(user)
+    db_session.commit()
+    order_ids = crud.create_orders(db_session, [
+        {"user_id": user.id, "items": [{"product_id": product_id, "quantity": 1}]} for _ in range(3)
+    ])
+
+    assert test_app.put(f"/orders/{order_ids[0]}/status", json={"status": "done"}).status_code == 409
+    response = test_app.put(f"/orders/{order_ids[0]}/status", json={"status": "processing"})
+    assert response.get_json() == {"id": order_ids[0], "status": "processing"}
+    assert test_app.put("/orders/999999/status", json={"status": "processing"}).status_code == 404
+
+    response = test_app.post("/orders/status", json={"order_ids": order_ids + [999999], "status": "done"})
+    assert response.get_json() == {"status": "done", "updated": [order_ids[0]], "skipped": order_ids[1:] + [999999]}
+    assert test_app.get(f"/orders/{order_ids[0]}").get_json()["status"] == "done"
+
+
+@pytest.mark.commits
+def test_fulfillment_workers_claim_disjoint_batches(postgres_engine, db_session):
+    import threading
+    from sqlalchemy import create_engine
+    from src import crud, fulfillment
+    from src.models import Order
+
+    product_id = db_session.execute(text(
+        "INSERT INTO products (name, price, category) VALUES ('Queue', 1.0, 'Test') RETURNING id"
+    )).scalar()
+    user = User(name="queue", email="queue@example.com")
+    db_session.add(user)
+    db_session.commit()
+    order_ids = crud.create_orders(db_session, [
+        {"user_id": user.id, "items": [{"product_id": product_id, "quantity": 1}]} for _ in range(40)
+    ])
+
+    engine = create_engine(postgres_engine.url)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+
+    def failing_handler(db, orders):
+        raise RuntimeError("carrier unavailable")
+
+    with Session() as session:
+        with pytest.raises(RuntimeError):
+            fulfillment.process_batch(session, failing_handler, batch_size=5)
+    # Сбой обработчика откатывает claim — заказы снова в очереди
+    db_session.expire_all()
+    assert db_session.query(Order).filter(Order.status == "new").count() == 40
+
+    seen, lock = [], threading.Lock()
+
+    def handler(db, orders):
+        with lock:
+            seen.extend(order.id for order in orders)
+
+    workers = [
+        threading.Thread(target=fulfillment.run_worker, args=(Session, handler, 3), kwargs={"once": True})
+        for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    engine.dispose()
+
+    assert sorted(seen) == sorted(order_ids)
+    db_session.expire_all()
+    assert db_session.query(Order).filter(Order.status == "done").count() == 40
+
+
+def _migrations_database(postgres_server_url, suffix):
+    from alembic.config import Config
+
+    # Миграции применяются к отдельной пустой базе, а не к общей базе воркера
+    name = f"marketplace_{suffix}_{os.environ.get('PYTEST_XDIST_WORKER', 'main')}"
+    engine = create_engine(_recreate_database(postgres_server_url, name))
+    config = Config("alembic.ini", attributes={"configure_logger": False})
+    config.set_main_option("sqlalchemy.url", engine.url.render_as_string(hide_password=False).replace("%", "%%"))
+    return name, engine, config
+
+def test_migrations_match_models(postgres_server_url):
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+
+    name, engine, config = _migrations_database(postgres_server_url, "migrations")
+    try:
+        command.upgrade(config, "head")
+        with engine.connect() as connection:
+            # Схема после миграций совпадает с моделями: create_all и alembic не расходятся
+            assert compare_metadata(MigrationContext.configure(connection), Base.metadata) == []
+            index = connection.execute(text(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = 'ix_orders_new_id'"
+            )).scalar()
+            assert "WHERE" in index
+        command.downgrade(config, "base")
+    finally:
+        engine.dispose()
+        _recreate_database(postgres_server_url, name, drop_only=True)
+
+
+def test_migrations_upgrade_baseline_database(postgres_server_url):
+    from alembic import command
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from src import crud
+
+    # База в схеме до миграций (0001) с данными прежней версии: повторы избранного и отзывов,
+    # заказ без статуса, устаревший average_rating
+    name, engine, config = _migrations_database(postgres_server_url, "baseline")
+    try:
+        command.upgrade(config, "0001")
+        with engine.begin() as connection:
+            connection.execute(text("""
+                INSERT INTO users (id, name, email) VALUES (1, 'a', 'a@example.com'), (2, 'b', 'b@example.com');
+                INSERT INTO products (id, name, price, category, average_rating)
+                    VALUES (1, 'Old', 1.0, 'Cat', NULL), (2, 'Quiet', 2.0, 'Cat', 4.0);
+                INSERT INTO reviews (user_id, product_id, rating) VALUES (1, 1, 2), (1, 1, 4), (2, 1, 5);
+                INSERT INTO favorites (user_id, product_id) VALUES (1, 1), (1, 1), (2, 1), (2, 2);
+                INSERT INTO orders (user_id, status) VALUES (1, NULL);
+            """))
+        command.upgrade(config, "head")
+        with engine.connect() as connection:
+            assert compare_metadata(MigrationContext.configure(connection), Base.metadata) == []
+            rows = connection.execute(text(
+                "SELECT id, review_count, rating_sum, average_rating, favorite_count FROM products ORDER BY id"
+            )).all()
+            # Из повторного отзыва остаётся последний (4), повтор избранного не считается
+            assert [tuple(r) for r in rows] == [(1, 2, 9, 4.5, 2), (2, 0, 0, 0.0, 1)]
+            assert connection.execute(text("SELECT count(*) FROM favorites")).scalar() == 3
+            assert connection.execute(text("SELECT status FROM orders")).scalar() == "new"
+        with Session(engine) as db:
+            assert crud.reconcile_product_ratings(db) == 0
+            assert crud.reconcile_favorite_counts(db) == 0
+        command.downgrade(config, "0001")
+    finally:
+        engine.dispose()
+        _recreate_database(postgres_server_url, name, drop_only=True)
+
+
+def test_crud_queries_use_indexes(postgres_engine, db_session):
+    from sqlalchemy import event
+    from src import crud
+
+    product_id = crud.create_product(db_session, {"name": "Desk lamp", "description": "Steel lamp",
+                                                  "price": 5.0, "category": "Home"}).id
+    user = User(name="planner", email="planner@example.com")
+    db_session.add(user)
+    db_session.commit()
+    crud.add_favorite(db_session, user.id, product_id)
+    crud.create_review(db_session, {"user_id": user.id, "product_id": product_id, "rating": 4})
+    order_id = crud.create_order(db_session, {"user_id": user.id, "items": [{"product_id": product_id,
+                                                                             "quantity": 1}]}).id
+
+    queries = {
+        "products by category": lambda: crud.get_products(db_session, category="Home", sort_by="price", cursor=""),
+        "products by rating": lambda: crud.get_products(db_session, sort_by="average_rating", order="desc"),
+        "product": lambda: crud.get_product(db_session, product_id),
+        "search": lambda: crud.search_products(db_session, q="lamp"),
+        "reviews": lambda: crud.get_reviews(db_session, product_id),
+        "favorites": lambda: crud.get_favorites(db_session, user.id),
+        "favorites check": lambda: crud.get_favorited_product_ids(db_session, user.id, [product_id]),
+        "leaderboard": lambda: crud.get_leaderboard(db_session, category="Home"),
+        "rating leaderboard": lambda: crud.get_leaderboard(db_session, by="rating", category="Home"),
+        "order": lambda: crud.get_order(db_session, order_id),
+        "user orders": lambda: crud.get_user_orders(db_session, user.id),
+        "claim orders": lambda: crud.claim_orders(db_session, 10),
+    }
+    for name, query in queries.items():
+        statements = []
+        listener = lambda conn, cursor, statement, parameters, *args: (
+            _is_savepoint(statement) or statements.append((statement, parameters)))
+        event.listen(postgres_engine, "before_cursor_execute", listener)
+        try:
+            query()
+        finally:
+            event.remove(postgres_engine, "before_cursor_execute", listener)
+            db_session.rollback()
+        assert statements, name
+        with postgres_engine.connect() as connection:
+            # На маленьких таблицах планировщик выбрал бы seq scan и с индексом; без индекса он останется
+            connection.execute(text("SET enable_seqscan = off"))
+            for statement, parameters in statements:
+                plan = "\n".join(connection.exec_driver_sql("EXPLAIN " + statement, parameters).scalars())
+                assert "Seq Scan" not in plan, f"{name}: {statement}\n{plan}"
+
+
+def test_request_metrics_count_queries(test_app, db_session):
+    import re
+
+    product_id = test_app.post("/products/", json={"name": "Metered", "price": 1.0, "category": "Test"}).get_json()["id"]
+    user = User(name="metered", email="metered@example.com")
+    db_session.add(user)
+    db_session.commit()
+    labels = 'method="POST",route="/products/<int:product_id>/reviews/"'
+
+    def series(name):
+        # Реестр метрик общий для процесса, поэтому сравниваем приращения
+        match = re.search(rf"^{name}{{{labels}}} (\S+)$", test_app.get("/metrics").get_data(as_text=True), re.M)
+        return float(match.group(1)) if match else 0.0
+
+    before = {name: series(name) for name in ("db_queries_per_request_count", "db_queries_per_request_sum",
+                                              "db_commits_total")}
+    response = test_app.post(f"/products/{product_id}/reviews/",
+                             json={"user_id": user.id, "product_id": product_id, "rating": 5})
+    assert response.status_code == 201
+    queries = int(re.search(r'desc="(\d+) queries"', response.headers["Server-Timing"]).group(1))
+    assert queries > 0
+
+    assert series("db_queries_per_request_count") - before["db_queries_per_request_count"] == 1
+    assert series("db_queries_per_request_sum") - before["db_queries_per_request_sum"] == queries
+    assert series("db_commits_total") - before["db_commits_total"] >= 1
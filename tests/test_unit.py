@@ -1,7 +1,9 @@
+import gzip
+import io
 import json
-from src import models, schemas
+from src import cache, crud, models, schemas, pagination
 import pytest
-from datetime import datetime
+from datetime import datetime, timezone
 from src.routes_init import init_routes
 from flask import Flask
 
@@ -97,10 +99,46 @@ def test_read_products_success(client, db_session, mocker):
         {"id": 2, "name": "Product 2", "description": "Desc 2", "price": 20.0, "category": "Cat 2", "average_rating": 3.0}
     ]
 
+def test_read_products_cursor_mode(client, mocker):
+    # crud возвращает limit + 1 строк — значит, есть следующая страница
+    mock_products = [
+        models.Product(id=i, name=f"Product {i}", description=None, price=10.0 * i, category="Cat", average_rating=0.0)
+        for i in (1, 2, 3)
+    ]
+    get_products = mocker.patch("src.crud.get_products", return_value=mock_products)
+
+    response = client.get("/products/?cursor=&limit=2&sort_by=price")
+
+    assert response.status_code == 200
+    assert [p["id"] for p in response.json["items"]] == [1, 2]
+    assert get_products.call_args.kwargs["limit"] == 3
+    assert pagination.decode_cursor(response.json["next_cursor"], "price:asc") == (20.0, 2)
+
+
+def test_read_products_invalid_cursor(client):
+    response = client.get("/products/?cursor=garbage")
+
+    assert response.status_code == 400
+    assert response.json == {"error": "Invalid cursor"}
+
+def test_cursor_value_must_match_sort_column_type(client):
+    # Строка вместо цены и число вместо даты отклоняются до SQL, как и испорченный курсор
+    price_cursor = pagination.encode_cursor("price:asc", "abc", 1)
+    response = client.get(f"/products/?cursor={price_cursor}&sort_by=price")
+    assert (response.status_code, response.json) == (400, {"error": "Invalid cursor"})
+
+    date_cursor = pagination.encode_cursor("created_at:desc", 12345, 1)
+    response = client.get(f"/products/1/reviews/?cursor={date_cursor}")
+    assert (response.status_code, response.json) == (400, {"error": "Invalid cursor"})
+
+    assert pagination.decode_cursor(pagination.encode_cursor("price:asc", 10, 1), "price:asc", float) == (10.0, 1)
+
 # Тесты для маршрута получения одного продукта
 def test_read_product_success(client, db_session, mocker):
     # Подготовка данных
-    mock_product = models.Product(id=1, name="Product 1", description="Desc 1", price=10.0, category="Cat 1", average_rating=4.5)
+    mock_product = models.Product(id=1, name="Product 1", description="Desc 1", price=10.0, category="Cat 1", average_rating=4.5,
+                                  review_count=2, weighted_rating=3.25, rating_count_1=0, rating_count_2=0,
+                                  rating_count_3=0, rating_count_4=1, rating_count_5=1)
     mocker.patch("src.crud.get_product", return_value=mock_product)
 
     # Выполняем запрос
@@ -109,9 +147,39 @@ def test_read_product_success(client, db_session, mocker):
     # Проверяем результат
     assert response.status_code == 200
     assert response.json == {
-        "id": 1, "name": "Product 1", "description": "Desc 1", "price": 10.0, "category": "Cat 1", "average_rating": 4.5
+        "id": 1, "name": "Product 1", "description": "Desc 1", "price": 10.0, "category": "Cat 1", "average_rating": 4.5,
+        "review_count": 2, "weighted_rating": 3.25,
+        "rating_histogram": {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
     }
 
+def test_read_product_if_modified_since(client, mocker):
+    updated_at = datetime(2025, 4, 2, 12, 0, 0, 500000, tzinfo=timezone.utc)
+    mock_product = models.Product(id=1, name="Product 1", description=None, price=10.0, category="Cat 1",
+                                  average_rating=0.0, updated_at=updated_at)
+    mocker.patch("src.crud.get_product", return_value=mock_product)
+
+    response = client.get("/products/1")
+    assert response.headers["Last-Modified"] == "Wed, 02 Apr 2025 12:00:00 GMT"
+
+    not_modified = client.get("/products/1", headers={"If-Modified-Since": "Wed, 02 Apr 2025 12:00:00 GMT"})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["ETag"] == response.headers["ETag"]
+    modified = client.get("/products/1", headers={"If-Modified-Since": "Wed, 02 Apr 2025 11:59:59 GMT"})
+    assert modified.status_code == 200
+
+def test_product_list_ignores_if_modified_since(client, mocker):
+    # Удаление строки не меняет максимум updated_at, поэтому список проверяется только по ETag
+    updated_at = datetime(2025, 4, 2, 12, 0, tzinfo=timezone.utc)
+    mocker.patch("src.crud.get_products", return_value=[
+        models.Product(id=1, name="Product 1", description=None, price=1.0, category="Cat", average_rating=0.0,
+                       updated_at=updated_at)
+    ])
+
+    response = client.get("/products/")
+    assert "Last-Modified" not in response.headers
+    assert client.get("/products/", headers={"If-Modified-Since": "Wed, 02 Apr 2025 13:00:00 GMT"}).status_code == 200
+    assert client.get("/products/", headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
 def test_read_product_not_found(client, db_session, mocker):
     mocker.patch("src.crud.get_product", return_value=None)
 
@@ -123,6 +191,55 @@ def test_read_product_not_found(client, db_session, mocker):
     assert response.json == {"error": "Product not found"}
 
 
+def test_request_session_closed_on_teardown(client, mocker):
+    session = mocker.MagicMock()
+    mocker.patch("src.database.SessionLocal", return_value=session)
+    mocker.patch("src.crud.get_product", return_value=None)
+
+    response = client.get("/products/1")
+
+    assert response.status_code == 404
+    session.close.assert_called_once()
+
+
+def test_db_health_reports_pool_metrics(client):
+    response = client.get("/health/db")
+
+    assert response.status_code == 200
+    assert {"pool_size", "checked_out", "overflow", "checkouts"} <= set(response.json["pool"])
+
+
+def test_export_products_gzip_ndjson(client, mocker):
+    rows = [
+        models.Product(id=i, name=f"Product {i}", description=None, price=1.0, category="Cat", average_rating=0.0)
+        for i in (1, 2)
+    ]
+    stream_products = mocker.patch("src.crud.stream_products", return_value=iter(rows))
+
+    response = client.get("/products/export?category=Cat", headers={"Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(response.get_data()).decode().splitlines()
+    assert [json.loads(line)["id"] for line in lines] == [1, 2]
+    assert stream_products.call_args.kwargs["category"] == "Cat"
+
+
+def test_export_products_rejects_unknown_format(client):
+    response = client.get("/products/export?format=xml")
+
+    assert response.status_code == 400
+
+
+def test_search_products_invalid_price(client, mocker):
+    search_products = mocker.patch("src.crud.search_products")
+
+    response = client.get("/products/search?q=phone&min_price=cheap")
+
+    assert response.status_code == 400
+    search_products.assert_not_called()
+
+
 def test_update_product_success(client, mocker):
     # Подготовка данных
     product_data = {"name": "Updated Product", "price": 15.99}
@@ -167,6 +284,24 @@ def test_delete_product_not_found(client, db_session, mocker):
     assert response.json == {"error": "Product not found"}
 
 
+def test_review_upsert_update_and_delete_routes(client, mocker):
+    review = models.Review(id=7, user_id=1, product_id=1, rating=5, comment=None,
+                           created_at=datetime(2025, 4, 2, 12, 0))
+    mocker.patch("src.crud.create_review", return_value=(review, False))
+    update_review = mocker.patch("src.crud.update_review", return_value=None)
+    mocker.patch("src.crud.delete_review", return_value=False)
+
+    response = client.post("/products/1/reviews/", json={"user_id": 1, "product_id": 1, "rating": 5})
+    assert response.status_code == 200
+    assert response.json["id"] == 7
+
+    response = client.put("/products/1/reviews/7", json={"rating": 4, "user_id": 2})
+    assert response.status_code == 404
+    assert update_review.call_args.args[1:] == (1, 7, {"rating": 4})
+    assert client.put("/products/1/reviews/7", json={"rating": 0}).status_code == 400
+    assert client.delete("/products/1/reviews/7").json == {"error": "Review not found"}
+
+
 def test_create_order_success(client, mocker, db_session):
     # Данные для заказа
     order_data = {
@@ -182,7 +317,11 @@ def test_create_order_success(client, mocker, db_session):
         id=1,
         user_id=order_data["user_id"],
         status="new",
-        order_date=datetime.now()
+        order_date=datetime.now(),
+        items=[
+            models.OrderItem(id=10, product_id=1, quantity=2, price=20.0),
+            models.OrderItem(id=11, product_id=2, quantity=1, price=15.5)
+        ]
     )
 
     # Мокаем добавление заказа и товаров
@@ -198,7 +337,387 @@ def test_create_order_success(client, mocker, db_session):
         "status": "new",
         "order_date": mock_order.order_date.isoformat(),
         "items": [
-            {"product_id": 1, "quantity": 2, "price": 20.0},
-            {"product_id": 2, "quantity": 1, "price": 15.5}
+            {"id": 10, "product_id": 1, "quantity": 2, "price": 20.0},
+            {"id": 11, "product_id": 2, "quantity": 1, "price": 15.5}
+        ]
+    }
+
+
+def test_create_orders_batch_success(client, mocker):
+    batch = {
+        "orders": [
+            {"user_id": 1, "items": [{"product_id": 1, "quantity": 1, "price": 5.0}]},
+            {"user_id": 2, "items": [{"product_id": 2, "quantity": 3, "price": 7.5}]}
         ]
     }
+    create_orders = mocker.patch("src.orders.create_orders", return_value=[10, 11])
+
+    response = client.post("/orders/batch", data=json.dumps(batch), content_type="application/json")
+
+    assert response.status_code == 201
+    assert response.json == {"created": 2, "order_ids": [10, 11]}
+    assert create_orders.call_args.args[1] == batch["orders"]
+
+
+def test_create_orders_batch_reports_invalid_order(client, mocker):
+    create_orders = mocker.patch("src.orders.create_orders")
+    batch = {
+        "orders": [
+            {"user_id": 1, "items": [{"product_id": 1, "quantity": 1, "price": 5.0}]},
+            {"user_id": 1, "items": []}
+        ]
+    }
+
+    response = client.post("/orders/batch", data=json.dumps(batch), content_type="application/json")
+
+    assert response.status_code == 400
+    assert response.json == {"error": "orders[1]: Order must contain at least one item"}
+    create_orders.assert_not_called()
+
+
+
+def test_get_order_not_found(client, mocker):
+    mocker.patch("src.crud.get_order", return_value=None)
+
+    response = client.get("/orders/42")
+
+    assert response.status_code == 404
+    assert response.json == {"error": "Order not found"}
+
+
+
+def test_transition_orders_rejects_unknown_status(client):
+    response = client.post("/orders/status", data=json.dumps({"order_ids": [1, 2], "status": "shipped"}),
+                           content_type="application/json")
+
+    assert response.status_code == 400
+    assert response.json == {"error": "Unknown order status 'shipped'"}
+
+
+def test_check_favorites_rejects_bad_ids(client):
+    response = client.get("/users/1/favorites/check?product_ids=1,abc")
+    assert response.status_code == 400
+    response = client.get("/users/1/favorites/check")
+    assert response.json == {"error": "'product_ids' must be a non-empty list"}
+
+
+def test_add_favorites_bulk_validates_list(client, mocker):
+    add_favorites = mocker.patch("src.crud.add_favorites", return_value={3: 10})
+    mocker.patch("src.users.get_db_session")
+
+    response = client.post("/users/1/favorites/bulk", data=json.dumps({"product_ids": [3, 3, 4]}),
+                           content_type="application/json")
+    assert response.json == {"added": [3]}
+    assert add_favorites.call_args.args[1:] == (1, [3, 4])
+
+    response = client.post("/users/1/favorites/bulk", data=json.dumps({"product_ids": [True]}),
+                           content_type="application/json")
+    assert response.status_code == 400
+
+
+def test_compiled_schemas_report_paths_and_normalize():
+    with pytest.raises(ValueError, match=r"^orders\[1\]\.items\[0\]: Quantity must be a positive integer$"):
+        schemas.validate_order_batch({"orders": [
+            {"user_id": 1, "items": [{"product_id": 1, "quantity": 1}]},
+            {"user_id": 1, "items": [{"product_id": 1, "quantity": True}]}
+        ]})
+    with pytest.raises(ValueError, match=r"^items\[0\]: Field 'product_id' must be a positive integer$"):
+        schemas.validate_order({"user_id": 1, "items": [{"product_id": "1", "quantity": 1}]})
+    with pytest.raises(ValueError, match="must not contain more than 500 items"):
+        schemas.validate_favorite_batch({"product_ids": list(range(1, 502))})
+    with pytest.raises(ValueError, match="Request body must be a JSON object"):
+        schemas.validate_product(None)
+
+    # Неизвестные поля отбрасываются, цена приводится к float
+    assert schemas.validate_product({"name": "Lamp", "price": 3, "category": "Home", "average_rating": 5}) == \
+        {"name": "Lamp", "price": 3.0, "category": "Home"}
+    assert schemas.validate_product_import({"sku": "a", "name": "Lamp", "price": "2.5", "category": "Home"})["price"] == 2.5
+    with pytest.raises(ValueError, match="Field 'sku' is required"):
+        schemas.validate_product_import({"name": "Lamp", "price": 2.5, "category": "Home"})
+
+
+
+def test_leaderboard_rejects_unknown_kind(client):
+    response = client.get("/products/leaderboard?by=views")
+    assert response.status_code == 400
+    assert response.json == {"error": "Unsupported leaderboard 'views'"}
+
+
+def test_serializers_accept_orm_objects_and_rows():
+    from sqlalchemy.engine import result_tuple
+    from src import serializers
+
+    product = models.Product(id=1, name="Lamp", description=None, price=9.5, category="Home", average_rating=4.0)
+    row = result_tuple(serializers.PRODUCT_LIST_FIELDS)((1, "Lamp", None, 9.5, "Home", 4.0))
+    expected = {"id": 1, "name": "Lamp", "description": None, "price": 9.5, "category": "Home", "average_rating": 4.0}
+    assert serializers.product_to_dict(row) == serializers.product_to_dict(product) == expected
+    # Для Row поля берутся по индексам: лишние колонки (updated_at, favorite_id) в ответ не попадают
+    wide_row = result_tuple(("favorite_id",) + serializers.PRODUCT_LIST_FIELDS)((7, 1, "Lamp", None, 9.5, "Home", 4.0))
+    assert list(serializers.product_to_dict.many([wide_row])) == list(serializers.product_to_dict.many([product])) == [expected]
+
+
+def test_json_backends_render_same_body():
+    from src import serializers
+
+    body = {"items": [{"price": 10.5, "name": "Lamp", "id": 1}], "next_cursor": None}
+    std, fast = Flask("std"), Flask("fast")
+    serializers.init_app(std, backend="std")
+    serializers.init_app(fast, backend="orjson")
+    with std.app_context():
+        expected = std.json.response(body).get_data()
+    with fast.app_context():
+        assert fast.json.response(body).get_data() == expected
+    assert serializers.dumps(body) + b"\n" == expected
+
+
+class FakeRedis:
+    # Минимальная замена redis-клиента для RedisCache
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+    def incr(self, key):
+        self.data[key] = int(self.data.get(key, 0)) + 1
+        return self.data[key]
+
+    def expire(self, key, seconds):
+        pass
+
+    def pipeline(self, transaction=True):
+        return self  # команды выполняются сразу
+
+    def execute(self):
+        pass
+
+
+def test_lru_cache_evicts_and_expires(mocker):
+    lru = cache.LRUCache(maxsize=2, ttl=10)
+    clock = mocker.patch("src.cache.time.monotonic", return_value=100.0)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)  # вытесняет самый давно использованный ключ "b"
+    assert lru.get("b") is None
+
+    clock.return_value = 111.0
+    assert lru.get("a") is None
+    assert lru.stats == {"hits": 1, "misses": 2, "evictions": 2}
+
+
+def test_redis_cache_with_local_stand_in():
+    redis_cache = cache.RedisCache(FakeRedis(), ttl=10)
+    redis_cache.set("product:1", {"id": 1})
+    assert redis_cache.get("product:1") == {"id": 1}
+    redis_cache.bump("products")
+    assert redis_cache.generation("products") == 1
+    redis_cache.delete("product:1")
+    assert redis_cache.get("product:1") is None
+    assert redis_cache.stats["hits"] == 1 and redis_cache.stats["misses"] == 1
+
+
+def test_cache_backend_follows_worker_count(monkeypatch):
+    monkeypatch.delenv("REDIS_URL", raising=False)
+    assert isinstance(cache.make_cache("auto", processes=1), cache.LRUCache)
+    # Несколько процессов без Redis: LRU каждого воркера не узнаёт о чужих записях
+    assert isinstance(cache.make_cache("auto", processes=4), cache.NullCache)
+    with pytest.raises(ValueError):
+        cache.make_cache("memory", processes=4)
+
+
+def test_unknown_rating_aggregation_rejected():
+    assert crud._rating_aggregation("deferred") == "deferred"
+    with pytest.raises(ValueError, match="Unknown RATING_AGGREGATION 'defered'"):
+        crud._rating_aggregation("defered")
+
+
+def test_stale_product_detail_not_cached_after_invalidation():
+    redis_cache = cache.RedisCache(FakeRedis())
+    # Запрос прочитал поколение и строку до записи, а в кэш положил уже после её сброса
+    key = cache.product_key(1, redis_cache)
+    cache.invalidate_product(1, cache=redis_cache)
+    redis_cache.set(key, {"id": 1, "average_rating": 0.0})
+    assert redis_cache.get(cache.product_key(1, redis_cache)) is None
+
+
+def test_invalidation_is_per_product():
+    lru = cache.LRUCache()
+    keys = {product_id: cache.product_key(product_id, lru) for product_id in (1, 2, 3)}
+    list_key = cache.products_list_key({"limit": 10}, lru)
+    for key in (*keys.values(), list_key):
+        lru.set(key, {})
+
+    cache.invalidate_products([1, 2], cache=lru)
+    # Карточка 3 остаётся в кэше, списки и карточки 1, 2 — нет
+    assert [cache.product_key(i, lru) == key for i, key in keys.items()] == [False, False, True]
+    assert cache.products_list_key({"limit": 10}, lru) != list_key
+
+
+def test_product_detail_cached_until_update(app, client, mocker):
+    cache.init_app(app, cache.RedisCache(FakeRedis()))
+    product = models.Product(id=1, name="Cached", description=None, price=1.0, category="Cat", average_rating=0.0)
+    get_product = mocker.patch("src.crud.get_product", return_value=product)
+    mocker.patch("src.products.update_product", return_value=product)
+
+    assert client.get("/products/1").json["name"] == "Cached"
+    assert client.get("/products/1").json["name"] == "Cached"
+    assert get_product.call_count == 1
+
+    client.put("/products/1", data=json.dumps({"name": "Cached", "price": 1.0, "category": "Cat"}),
+               content_type="application/json")
+    client.get("/products/1")
+    assert get_product.call_count == 2
+
+
+def test_product_list_cache_invalidated_by_new_product(client, mocker):
+    get_products = mocker.patch("src.crud.get_products", return_value=[])
+    mocker.patch("src.products.create_product", return_value=models.Product(id=5, name="New", price=1.0, category="Cat"))
+
+    client.get("/products/?limit=10")
+    client.get("/products/?limit=10&skip=0")
+    assert get_products.call_count == 1
+
+    client.post("/products/", data=json.dumps({"name": "New", "price": 1.0, "category": "Cat"}),
+                content_type="application/json")
+    client.get("/products/?limit=10")
+    assert get_products.call_count == 2
+
+
+class FakeAsyncSession:
+    # Заменяет AsyncSession: run_sync вызывает функцию с мок-сессией
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def run_sync(self, fn, *args):
+        return fn(self.session, *args)
+
+
+@pytest.fixture
+def asgi_client(db_session):
+    from starlette.testclient import TestClient
+    from src.asgi import create_app
+    asgi_app = create_app(session_factory=lambda: FakeAsyncSession(db_session), response_cache=cache.NullCache())
+    with TestClient(asgi_app) as client:
+        yield client
+
+
+def test_asgi_read_product_shares_crud_and_etag(asgi_client, client, mocker):
+    mock_product = models.Product(id=1, name="Product 1", description="Desc 1", price=10.0, category="Cat 1",
+                                  average_rating=4.5, updated_at=datetime(2025, 4, 2, 12, 0, tzinfo=timezone.utc))
+    mocker.patch("src.crud.get_product", return_value=mock_product)
+    mocker.patch("src.crud.get_product_versions", return_value=[(1, mock_product.updated_at)])
+
+    response = asgi_client.get("/products/1")
+    assert response.status_code == 200
+    assert response.json() == client.get("/products/1").json
+    assert response.headers["Last-Modified"] == "Wed, 02 Apr 2025 12:00:00 GMT"
+
+    not_modified = asgi_client.get("/products/1", headers={"If-None-Match": response.headers["ETag"]})
+    assert not_modified.status_code == 304
+
+
+def test_asgi_validation_error_is_400(asgi_client):
+    response = asgi_client.post("/orders/", json={"user_id": 1, "items": []})
+    assert response.status_code == 400
+    assert response.json() == {"error": "Order must contain at least one item"}
+
+    response = asgi_client.get("/products/?cursor=broken")
+    assert response.status_code == 400
+    assert response.json() == {"error": "Invalid cursor"}
+
+
+def test_asgi_unexpected_error_is_logged_not_returned(db_session, mocker, caplog):
+    from starlette.testclient import TestClient
+    from src.asgi import create_app
+    mocker.patch("src.crud.get_order", side_effect=RuntimeError("password=secret"))
+    asgi_app = create_app(session_factory=lambda: FakeAsyncSession(db_session), response_cache=cache.NullCache())
+
+    with TestClient(asgi_app, raise_server_exceptions=False) as asgi_client:
+        response = asgi_client.get("/orders/1")
+
+    assert response.status_code == 500
+    assert response.json() == {"error": "Internal server error"}
+    assert "password=secret" in caplog.text
+
+
+def test_asgi_favorites_status_and_metrics(asgi_client, mocker):
+    mocker.patch("src.crud.get_favorited_product_ids", return_value={2})
+    mocker.patch("src.crud.transition_order", side_effect=crud.InvalidTransition("Cannot change order status"))
+
+    response = asgi_client.get("/users/1/favorites/check?product_ids=1,2")
+    assert response.json() == {"favorited": {"1": False, "2": True}}
+    assert asgi_client.get("/users/1/favorites/check?product_ids=1,abc").status_code == 400
+    assert asgi_client.put("/orders/1/status", json={"status": "processing"}).status_code == 409
+    assert response.headers["Server-Timing"].startswith('db;dur=0.00;desc="0 queries", serialize;dur=')
+
+    body = asgi_client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/users/{user_id:int}/favorites/check",status="200"}' in body
+    assert 'http_requests_total{method="PUT",route="/orders/{order_id:int}/status",status="409"}' in body
+
+
+def test_metrics_and_server_timing(client, mocker):
+    product = models.Product(id=1, name="Timed", description=None, price=1.0, category="Cat", average_rating=0.0)
+    mocker.patch("src.crud.get_product", return_value=product)
+
+    response = client.get("/products/1")
+    assert response.headers["Server-Timing"].startswith('db;dur=0.00;desc="0 queries", serialize;dur=')
+
+    body = client.get("/metrics").get_data(as_text=True)
+    # Метка маршрута — шаблон, а не путь: число серий не растёт с числом товаров
+    assert 'http_requests_total{method="GET",route="/products/<int:product_id>",status="200"}' in body
+    assert 'db_queries_per_request_bucket{method="GET",route="/products/<int:product_id>",le="0"}' in body
+    assert 'route="/metrics"' not in body
+
+
+def test_slow_query_logged(mocker, caplog):
+    from sqlalchemy import create_engine, text as sql_text
+
+    mocker.patch("src.metrics.SLOW_QUERY_MS", 1e-6)
+    with create_engine("sqlite://").connect() as connection:
+        connection.execute(sql_text("SELECT   1"))
+    assert "slow query" in caplog.text and "SELECT 1" in caplog.text
+
+
+def test_import_parsers_accept_plain_wsgi_input():
+    from src import product_import
+
+    class Body:
+        # Как gunicorn.http.body.Body: только read(size), без интерфейса io
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.data.read(size)
+
+    rows = list(product_import.iter_ndjson(Body('{"sku": "a", "name": "Чайник"}\n\n{"sku": "b"}\n'.encode())))
+    assert [row["sku"] for row, _ in rows] == ["a", "b"]
+    assert rows[0][0]["name"] == "Чайник"
+    rows = list(product_import.iter_csv(Body(b"sku,name,price\nc,Lamp,2.5\n")))
+    assert rows[0][0]["price"] == 2.5
+
+
+def test_rating_aggregator_drains_queue_and_invalidates_cache(mocker):
+    from src import rating_aggregator
+
+    apply_rating_deltas = mocker.patch("src.crud.apply_rating_deltas", side_effect=[[(1, 2), (5, 1)], [(7, 1)]])
+    invalidate_products = mocker.patch("src.cache.invalidate_products")
+    sleep = mocker.patch("time.sleep")
+
+    # Полная пачка — сразу следующая; неполная — очередь разобрана, с --once воркер выходит
+    assert rating_aggregator.run_worker(mocker.MagicMock, batch_size=3, once=True) == 4
+    assert apply_rating_deltas.call_count == 2
+    assert [c.args[0] for c in invalidate_products.call_args_list] == [[1, 5], [7]]
+    sleep.assert_not_called()